@@ -1,55 +1,108 @@
-from typing import List, Dict
+from typing import List, Dict, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
 from vehicle import Vehicle
+from fleet import build_latest_view
+from instrumentation import timed
+from tariff import TariffEngine
+from segmentation import SegmentDB
+from snapshot import format_energy_report
+
+# Fallback efficiencies (kWh/mile) for vehicles without lifetime energy data,
+# keyed by (model_type, trim_badging). A trim of None is the model-wide value.
+FALLBACK_EFFICIENCY: Dict[Tuple[str, Optional[str]], float] = {
+    ("modely", None): 0.285,  # Model Y Long Range
+    ("model3", None): 0.245,  # Model 3 Standard Range
+}
+DEFAULT_FALLBACK_EFFICIENCY = 0.245
+
+ROLLUP_GROUPS = {
+    "model": ["model"],
+    "trim": ["model", "trim"],
+    "performance_package": ["model", "performance_package"],
+}
+
+
+def latest_frame(vehicles: Sequence[Vehicle], extra: Sequence[str] = ()) -> pd.DataFrame:
+    """One row per vehicle with its latest metrics, read from the store columns.
+
+    ``extra`` names further fields (e.g. battery health) to add as columns.
+    """
+    view = build_latest_view(vehicles, ("model_type", "trim_badging", "performance_package",
+                                        "odometer", "lifetime_energy_used", "battery_level") + tuple(extra))
+    frame = pd.DataFrame({
+        "vin": view["vin"],
+        "name": view["name"],
+        "model": pd.Categorical(view["model_type"]),
+        "trim": pd.Categorical(view["trim_badging"]),
+        "performance_package": pd.Categorical(view["performance_package"]),
+        "odometer": view["odometer"],
+        "lifetime_energy_used": view["lifetime_energy_used"],
+        "battery_level": view["battery_level"],
+    })
+    for name in extra:
+        frame[name] = view[name]
+    return frame
 
 
 class EnergyAndCostAnalyzer:
     """Analyzes energy efficiency and cost metrics for Tesla fleet."""
-    def __init__(self, vehicles: List[Vehicle], kwh_rate: float = 0.36):
+    def __init__(self, vehicles: List[Vehicle], kwh_rate: float = 0.36,
+                 fallback_efficiency: Dict[Tuple[str, Optional[str]], float] = None,
+                 tariff_engine: TariffEngine = None, segments: SegmentDB = None):
         self.vehicles = vehicles
         self.kwh_rate = kwh_rate
+        self.tariff_engine = tariff_engine
+        self.segments = segments
+        self.fallback_efficiency = fallback_efficiency if fallback_efficiency is not None else FALLBACK_EFFICIENCY
+
+    def _fallback_efficiency(self, frame: pd.DataFrame) -> np.ndarray:
+        """Look up the estimated efficiency for each row by model and trim."""
+        models = frame["model"].astype(str).str.lower()
+        codes, combos = pd.factorize(pd.MultiIndex.from_arrays([models, frame["trim"].astype(str)]))
+        table = self.fallback_efficiency
+        values = np.array([
+            table.get((model, trim), table.get((model, None), DEFAULT_FALLBACK_EFFICIENCY))
+            for model, trim in combos
+        ], dtype=np.float64)
+        return values[codes] if len(values) else np.empty(0)
+
+    def efficiency_frame(self, frame: pd.DataFrame = None) -> pd.DataFrame:
+        """Per-vehicle efficiency and cost for vehicles with a non-zero odometer, by efficiency.
+
+        ``frame`` is a precomputed latest_frame(); its extra columns are kept.
+        """
+        frame = latest_frame(self.vehicles) if frame is None else frame
+        frame = frame[frame["odometer"].fillna(0) != 0]
+        miles = frame["odometer"].to_numpy()
+        energy = frame["lifetime_energy_used"].fillna(0).to_numpy()
+        actual = energy != 0
+        fallback = self._fallback_efficiency(frame)
+
+        total_energy = np.where(actual, energy, miles * fallback)
+        total_cost = total_energy * self.kwh_rate
+        frame = frame.assign(
+            total_miles=miles,
+            total_energy=total_energy,
+            efficiency=np.where(actual, energy / np.where(actual, miles, 1), fallback),
+            total_cost=total_cost,
+            cost_per_mile=total_cost / miles,
+            source=np.where(actual, "Actual", "Estimated"),
+        )
+        return frame.sort_values("efficiency", kind="mergesort")
 
-    def calculate_efficiency_metrics(self) -> Dict:
-        """Calculate energy efficiency metrics for each vehicle and the fleet."""
-        efficiency_data = []
-        total_energy = 0
-        total_miles = 0
-
-        for vehicle in self.vehicles:
-            metrics = vehicle.get_latest_metrics()
-            if metrics.odometer:
-                # Use actual lifetime energy
-                if metrics.lifetime_energy_used:
-                    efficiency = metrics.lifetime_energy_used / metrics.odometer
-                    total_energy_used = metrics.lifetime_energy_used
-                    source = "Actual"
-                else:
-                    # Use estimated efficiency for vehicles without lifetime energy data
-                    if metrics.model_type.lower() == "modely":
-                        efficiency = 0.285  # Model Y Long Range
-                    else:
-                        efficiency = 0.245  # Model 3 Standard Range
-                    total_energy_used = metrics.odometer * efficiency
-                    source = "Estimated"
-
-                total_cost = total_energy_used * self.kwh_rate
-                cost_per_mile = total_cost / metrics.odometer
-
-                efficiency_data.append({
-                    'name': vehicle.display_name,
-                    'model': metrics.model_type,
-                    'total_miles': metrics.odometer,
-                    'total_energy': total_energy_used,
-                    'efficiency': efficiency,
-                    'total_cost': total_cost,
-                    'cost_per_mile': cost_per_mile,
-                    'source': source
-                })
-
-                total_energy += total_energy_used
-                total_miles += metrics.odometer
-
-        # Sort by efficiency
-        efficiency_data.sort(key=lambda x: x['efficiency'])
+    def calculate_efficiency_metrics(self, frame: pd.DataFrame = None) -> Dict:
+        """Calculate energy efficiency metrics for each vehicle and the fleet.
+
+        ``frame`` is a precomputed efficiency_frame(), e.g. from a cohort report.
+        """
+        frame = self.efficiency_frame() if frame is None else frame
+        total_energy = float(frame["total_energy"].sum())
+        total_miles = float(frame["total_miles"].sum())
+
+        vehicle_columns = ['name', 'model', 'total_miles', 'total_energy', 'efficiency',
+                           'total_cost', 'cost_per_mile', 'source']
+        efficiency_data = frame[vehicle_columns].astype({'model': str}).to_dict('records')
 
         fleet_metrics = {
             'vehicles': efficiency_data,
@@ -65,35 +118,57 @@ class EnergyAndCostAnalyzer:
 
         return fleet_metrics
 
-    def generate_text_report(self) -> str:
-        """Generate a text-based report of energy efficiency and cost analysis."""
-        metrics = self.calculate_efficiency_metrics()
-
-        report = [
-            "Energy Efficiency and Cost Analysis Report",
-            "\nFleet Summary:",
-            f"- Total Vehicles: {metrics['fleet_summary']['total_vehicles']}",
-            f"- Total Energy Used: {metrics['fleet_summary']['total_energy_used']:,.2f} kWh",
-            f"- Total Miles Driven: {metrics['fleet_summary']['total_miles']:,.2f} miles",
-            f"- Fleet Average Efficiency: {metrics['fleet_summary']['fleet_efficiency']:.3f} kWh/mile",
-            f"- Total Energy Cost: ${metrics['fleet_summary']['total_cost']:,.2f}",
-            f"- Average Cost per Mile: ${metrics['fleet_summary']['average_cost_per_mile']:.3f}",
-            "\nVehicle Rankings (by efficiency):"
-        ]
-
-        for idx, vehicle in enumerate(metrics['vehicles'], 1):
-            report.append(
-                f"\n{idx}. {vehicle['name']} ({vehicle['model']}) - {vehicle['source']} Data:"
-                f"\n   - Efficiency: {vehicle['efficiency']:.3f} kWh/mile"
-                f"\n   - Total Energy Used: {vehicle['total_energy']:,.1f} kWh"
-                f"\n   - Total Cost: ${vehicle['total_cost']:,.2f}"
-                f"\n   - Cost per Mile: ${vehicle['cost_per_mile']:.3f}"
+    def rollups(self, frame: pd.DataFrame = None) -> Dict[str, pd.DataFrame]:
+        """Energy and cost totals grouped by model, trim and performance package."""
+        frame = self.efficiency_frame() if frame is None else frame
+        rollups = {}
+        for name, keys in ROLLUP_GROUPS.items():
+            grouped = frame.groupby(keys, observed=True).agg(
+                vehicles=("vin", "size"),
+                total_miles=("total_miles", "sum"),
+                total_energy=("total_energy", "sum"),
+                total_cost=("total_cost", "sum"),
             )
+            grouped["efficiency"] = grouped["total_energy"] / grouped["total_miles"]
+            grouped["cost_per_mile"] = grouped["total_cost"] / grouped["total_miles"]
+            rollups[name] = grouped.reset_index()
+        return rollups
+
+    def report_data(self, metrics: Dict = None) -> Dict:
+        """Everything the text report shows, as plain JSON-ready values (see snapshot.py).
+
+        ``metrics`` is a precomputed calculate_efficiency_metrics() result.
+        """
+        metrics = self.calculate_efficiency_metrics() if metrics is None else metrics
+        data = {"metrics": metrics, "charging": None, "trips": None}
+
+        if self.tariff_engine is not None:
+            charging = self.tariff_engine.price_fleet(self.vehicles, segments=self.segments)
+            data["charging"] = [
+                {"name": summary['name'], "sessions": summary['sessions'], "kwh": summary['kwh'],
+                 "cost": summary['cost'], "by_window": summary['by_window']}
+                for summary in charging.vehicles.values()
+            ]
+
+        if self.segments is not None:
+            totals = self.segments.vehicle_totals()
+            data["trips"] = [
+                {"name": vehicle.display_name, **totals[vehicle.vin]}
+                for vehicle in self.vehicles if vehicle.vin in totals
+            ]
+
+        return data
+
+    @timed("energy_report")
+    def generate_text_report(self, data: Dict = None) -> str:
+        """Generate a text-based report of energy efficiency and cost analysis.
 
-        return "\n".join(report)
+        ``data`` is a precomputed report_data() result, e.g. from a snapshot.
+        """
+        return format_energy_report(**(data if data is not None else self.report_data()))
 
-    def save_text_report(self, filename: str = "energy_report.txt") -> None:
+    def save_text_report(self, filename: str = "energy_report.txt", data: Dict = None) -> None:
         """Save the text report to a file."""
-        report = self.generate_text_report()
+        report = self.generate_text_report(data)
         with open(filename, 'w') as f:
             f.write(report)
\ No newline at end of file
@@ -0,0 +1,442 @@
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Set, Tuple
+import numpy as np
+from metrics_store import MetricsStore, COLUMN_DTYPES
+from instrumentation import metrics, timed
+
+ANOMALY_COLUMNS = ("timestamp", "odometer", "lifetime_energy_used", "battery_level", "charging_state",
+                   "battery_health", "is_climate_on", "inside_temp", "outside_temp",
+                   "latitude", "longitude", "display_name")
+PARKED_MILES = 0.1  # odometer change below which an interval counts as parked
+MAD_TO_SIGMA = 1.4826
+WINSOR = 3.0  # samples are clipped to median +- WINSOR spreads before updating the baselines
+TAPER_LEVEL = 80  # charge rate is only scored below this battery level, before charging tapers
+
+
+@dataclass(frozen=True)
+class Signal:
+    """A per-interval quantity watched for anomalies."""
+    name: str
+    unit: str
+    direction: int  # +1 alerts on unusually high values, -1 on unusually low ones
+    min_scale: float  # floor on the spread estimate, in ``unit``
+
+
+SIGNALS = (
+    Signal("efficiency", "kWh/mi", 1, 0.02),
+    Signal("vampire_drain", "%/h", 1, 0.25),  # battery level is whole percent
+    Signal("charge_rate", "kW", -1, 1.0),
+    Signal("climate_load", "°C", 1, 1.0),
+)
+SIGNALS_BY_NAME = {signal.name: signal for signal in SIGNALS}
+
+
+@dataclass
+class Alert:
+    """One anomalous sample, with the baseline it was compared against."""
+    vin: str
+    name: str
+    timestamp_ms: int
+    signal: str
+    detector: str  # "zscore" (spike), "cusum" (sustained shift) or "climate_on" (rule)
+    value: float
+    baseline: float
+    score: float
+    context: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def time(self) -> datetime:
+        return datetime.fromtimestamp(self.timestamp_ms / 1000)
+
+    @property
+    def message(self) -> str:
+        if self.detector == "climate_on":
+            return f"{self.name}: climate on while parked for {self.value:.1f} h"
+        unit = SIGNALS_BY_NAME[self.signal].unit
+        kind = "sustained shift in" if self.detector == "cusum" else "unusual"
+        return (f"{self.name}: {kind} {self.signal.replace('_', ' ')} {self.value:.3g} {unit} "
+                f"(baseline {self.baseline:.3g} {unit}, score {self.score:.1f})")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"vin": self.vin, "name": self.name, "time": self.time.isoformat(timespec="seconds"),
+                "signal": self.signal, "detector": self.detector, "value": self.value,
+                "baseline": self.baseline, "score": self.score, "message": self.message, **self.context}
+
+
+class _Baseline:
+    """Running statistics of one signal per store slot, a fixed handful of floats each.
+
+    An exponentially weighted mean and variance feed a one-sided CUSUM of
+    standardized residuals; a sign-step running median and an exponentially
+    weighted absolute deviation give robust z-scores. Updates use samples
+    winsorized around the median, so one outlier cannot drag the baselines.
+    """
+    FIELDS = ("count", "mean", "var", "median", "mad", "cusum")
+
+    def __init__(self, signal: Signal, alpha: float):
+        self.signal = signal
+        self.alpha = alpha
+        self.count = np.zeros(0, dtype=np.int64)
+        self.mean = self.var = self.median = self.mad = self.cusum = np.zeros(0)
+
+    def resize(self, size: int):
+        if size <= len(self.count):
+            return
+        capacity = max(size, 2 * len(self.count), 16)
+        for name in self.FIELDS:
+            old = getattr(self, name)
+            grown = np.zeros(capacity, old.dtype)
+            grown[:len(old)] = old
+            setattr(self, name, grown)
+
+    def step(self, slots: np.ndarray, x: np.ndarray, slack: float,
+             min_samples: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Score samples (one per slot) against, then fold them into, the baselines.
+
+        Returns (median baseline, robust z, CUSUM statistic, warmed-up mask),
+        all signed so that positive means "in the alerting direction".
+        """
+        signal = self.signal
+        n = self.count[slots]
+        first = n == 0
+        mean = np.where(first, x, self.mean[slots])
+        median = np.where(first, x, self.median[slots])
+        var, mad = np.where(first, 0.0, self.var[slots]), np.where(first, 0.0, self.mad[slots])
+        scale = np.maximum(MAD_TO_SIGMA * mad, signal.min_scale)
+        robust_z = signal.direction * (x - median) / scale
+        z = signal.direction * (x - mean) / np.maximum(np.sqrt(var), signal.min_scale)
+        warm = n >= min_samples
+        cusum = np.where(warm, np.maximum(0.0, self.cusum[slots] + z - slack), 0.0)
+
+        # Exact averages while warming up, exponential weighting afterwards.
+        a = np.maximum(self.alpha, 1.0 / (n + 1))
+        clipped = np.clip(x, median - WINSOR * scale, median + WINSOR * scale)
+        delta = clipped - mean
+        self.mean[slots] = mean + a * delta
+        self.var[slots] = (1 - a) * (var + a * delta * delta)
+        self.mad[slots] = mad + a * (np.abs(clipped - median) - mad)
+        self.median[slots] = median + a * scale * np.sign(clipped - median)
+        self.count[slots] = n + 1
+        self.cusum[slots] = cusum
+        return median, robust_z, cusum, warm
+
+    def restart(self, slots: np.ndarray):
+        """Forget the baselines of slots whose signal shifted, to learn the new level."""
+        self.count[slots] = 0
+        self.cusum[slots] = 0.0
+
+
+class AnomalyDetector:
+    """Online anomaly detection over a MetricsStore's snapshot stream.
+
+    Each pair of consecutive snapshots of a vehicle yields interval signals:
+    driving efficiency (kWh per mile, accumulated over ``efficiency_miles``),
+    vampire drain (battery % lost per hour while parked and not charging,
+    accumulated over ``min_drain_hours``),
+    charge rate (kW added while charging, below TAPER_LEVEL) and climate load (inside/outside
+    temperature difference held while parked with climate on). Every signal
+    keeps a _Baseline per vehicle and alerts on robust z-scores above
+    ``z_threshold`` (spikes) and on CUSUM statistics above
+    ``cusum_threshold`` (sustained shifts, after which the baseline is
+    relearned). Climate left on while parked for ``climate_hours`` raises a
+    rule alert once per stretch.
+
+    State is a fixed set of arrays indexed by store slot, so memory does not
+    grow with history. The store's append events mark vehicles dirty;
+    ``update()`` reads only their new rows (straight from the latest columns
+    when a vehicle has exactly one, the usual poll case) and processes the
+    samples of all vehicles together, one vectorized round per sample depth.
+    Vehicles already in the store are tracked from their next snapshot unless
+    ``backfill`` is set, in which case their history is replayed first.
+    """
+    def __init__(self, store: MetricsStore, alpha: float = 0.05, z_threshold: float = 4.0,
+                 cusum_slack: float = 0.5, cusum_threshold: float = 8.0, min_samples: int = 10,
+                 efficiency_miles: float = 5.0, min_drain_hours: float = 4.0, max_gap_hours: float = 24.0,
+                 climate_hours: float = 12.0, default_capacity_kwh: float = 75.0,
+                 backfill: bool = False, max_alerts: int = 1000):
+        self.store = store
+        self.z_threshold = z_threshold
+        self.cusum_slack = cusum_slack
+        self.cusum_threshold = cusum_threshold
+        self.min_samples = min_samples
+        self.efficiency_miles = efficiency_miles
+        self.min_drain_hours = min_drain_hours
+        self.max_gap_hours = max_gap_hours
+        self.climate_hours = climate_hours
+        self.default_capacity_kwh = default_capacity_kwh
+        self.baselines = {signal.name: _Baseline(signal, alpha) for signal in SIGNALS}
+        self.alerts: Deque[Alert] = deque(maxlen=max_alerts)
+
+        self._last = {name: np.zeros(0, COLUMN_DTYPES[name]) for name in ANOMALY_COLUMNS}
+        self._rows = np.zeros(0, dtype=np.int64)  # in-memory rows per slot at the last update
+        self._seeded = np.zeros(0, dtype=bool)  # slot has a remembered last sample
+        self._trip_miles = np.zeros(0)
+        self._trip_kwh = np.zeros(0)
+        self._parked_hours = np.zeros(0)
+        self._parked_drop = np.zeros(0)
+        self._climate_since = np.zeros(0, dtype=np.int64)  # -1 when climate is off or driving
+        self._climate_alerted = np.zeros(0, dtype=bool)
+        self._listeners: List[Callable[[Alert], None]] = []
+        self._lock = threading.Lock()
+        self._dirty: Set[str] = set()
+        store.subscribe(self._on_append)
+
+        vins = store.vins
+        if backfill:
+            self._dirty.update(vins)
+        elif vins:
+            slots = store.slots(vins)
+            self._resize(len(vins))
+            self._remember(slots, {name: store.latest_column(name)[slots] for name in ANOMALY_COLUMNS})
+            self._rows[slots] = [store.row_count(vin) for vin in vins]
+            self._seeded[slots] = True
+
+    def _on_append(self, vin: str):
+        with self._lock:
+            self._dirty.add(vin)
+
+    def on_alert(self, listener: Callable[[Alert], None]):
+        """Call ``listener(alert)`` for every alert raised."""
+        self._listeners.append(listener)
+
+    def _resize(self, size: int):
+        if size <= len(self._rows):
+            return
+        capacity = max(size, 2 * len(self._rows), 16)
+
+        def grow(array: np.ndarray, fill) -> np.ndarray:
+            grown = np.full(capacity, fill, array.dtype)
+            grown[:len(array)] = array
+            return grown
+
+        self._last = {name: grow(column, 0) for name, column in self._last.items()}
+        self._rows = grow(self._rows, 0)
+        self._seeded = grow(self._seeded, False)
+        self._trip_miles = grow(self._trip_miles, 0.0)
+        self._trip_kwh = grow(self._trip_kwh, 0.0)
+        self._parked_hours = grow(self._parked_hours, 0.0)
+        self._parked_drop = grow(self._parked_drop, 0.0)
+        self._climate_since = grow(self._climate_since, -1)
+        self._climate_alerted = grow(self._climate_alerted, False)
+        for baseline in self.baselines.values():
+            baseline.resize(capacity)
+
+    def _remember(self, slots: np.ndarray, columns: Dict[str, np.ndarray]):
+        for name in ANOMALY_COLUMNS:
+            self._last[name][slots] = columns[name]
+
+    def _new_samples(self, vins: List[str]) -> Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+        """(slot, depth, columns) of every unseen sample of the given VINs, grouped by VIN in time order."""
+        store = self.store
+        slots = store.slots(vins)
+        self._resize(len(store.vins))
+        rows = np.fromiter((store.row_count(vin) for vin in vins), dtype=np.int64, count=len(vins))
+        seen = np.where(self._seeded[slots], self._rows[slots], -1)
+        single = (seen >= 0) & (rows == seen + 1)
+        single &= store.latest_column("timestamp")[slots] > self._last["timestamp"][slots]
+
+        fast = slots[single]
+        parts = [{name: store.latest_column(name)[fast] for name in ANOMALY_COLUMNS}]
+        part_slots, part_depths = [fast], [np.zeros(len(fast), dtype=np.int64)]
+        for i in np.flatnonzero(~single).tolist():
+            slot = int(slots[i])
+            last = int(self._last["timestamp"][slot]) if seen[i] >= 0 else None
+            chunk = store.columns(vins[i], ANOMALY_COLUMNS, None if last is None else last + 1)
+            if last is not None:
+                newer = chunk["timestamp"] > last
+                chunk = {name: column[newer] for name, column in chunk.items()}
+            count = len(chunk["timestamp"])
+            if count:
+                parts.append(chunk)
+                part_slots.append(np.full(count, slot, dtype=np.intp))
+                part_depths.append(np.arange(count, dtype=np.int64))
+        self._rows[slots] = rows
+
+        columns = {name: np.concatenate([part[name] for part in parts]) for name in ANOMALY_COLUMNS}
+        return np.concatenate(part_slots), np.concatenate(part_depths), columns
+
+    @timed("anomaly_update")
+    def update(self) -> List[Alert]:
+        """Process snapshots appended since the last call; returns the new alerts, oldest first."""
+        with self._lock:
+            vins, self._dirty = list(self._dirty), set()
+        if not vins:
+            return []
+        slots, depths, cur = self._new_samples(vins)
+        if not len(slots):
+            return []
+
+        # Previous sample: the row before in the same VIN's run, else the last one remembered.
+        first = depths == 0
+        prev = {}
+        for name in ANOMALY_COLUMNS:
+            shifted = np.empty_like(cur[name])
+            shifted[1:] = cur[name][:-1]
+            shifted[first] = self._last[name][slots[first]]
+            prev[name] = shifted
+        has_prev = ~first | self._seeded[slots]
+
+        signals, extras = self._interval_signals(cur, prev, has_prev)
+        found = self._run_rounds(slots, depths, cur, signals, extras)
+
+        last_of_run = np.ones(len(slots), dtype=bool)
+        last_of_run[:-1] = slots[1:] != slots[:-1]
+        self._remember(slots[last_of_run], {name: cur[name][last_of_run] for name in ANOMALY_COLUMNS})
+        self._seeded[slots] = True
+
+        alerts = self._build_alerts(slots, cur, found)
+        metrics.count("anomaly_samples", len(slots))
+        metrics.count("anomaly_alerts", len(alerts))
+        self.alerts.extend(alerts)
+        for alert in alerts:
+            for listener in self._listeners:
+                listener(alert)
+        return alerts
+
+    def _interval_signals(self, cur: Dict[str, np.ndarray], prev: Dict[str, np.ndarray],
+                          has_prev: np.ndarray) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+        """Per-sample signal values (NaN where a signal does not apply) and rule inputs."""
+        store = self.store
+        charging_code = store.code("charging_state", "Charging")
+        capacity = store.health_values("capacity")[cur["battery_health"]]
+        capacity = np.where(np.isnan(capacity), self.default_capacity_kwh, capacity)
+
+        hours = (cur["timestamp"] - prev["timestamp"]) / 3_600_000
+        interval = has_prev & (hours > 0) & (hours <= self.max_gap_hours)
+        miles = cur["odometer"] - prev["odometer"]
+        level_drop = prev["battery_level"].astype(np.float64) - cur["battery_level"]
+        charging_now = cur["charging_state"] == charging_code
+        charged = charging_now & (prev["charging_state"] == charging_code)
+        charging = charging_now | (prev["charging_state"] == charging_code)
+        parked = interval & (np.abs(miles) < PARKED_MILES)
+        safe_hours = np.where(interval, hours, 1.0)
+
+        # Drive energy from the lifetime counter, else from the battery level drop.
+        energy = cur["lifetime_energy_used"] - prev["lifetime_energy_used"]
+        energy = np.where(np.isfinite(energy) & (energy > 0), energy, level_drop * capacity / 100)
+        driving = interval & (miles >= PARKED_MILES) & ~charging & (energy > 0)
+
+        climate_on = cur["is_climate_on"] & prev["is_climate_on"]
+        temps = np.abs(cur["inside_temp"] - cur["outside_temp"])
+        nan = np.full(len(hours), np.nan)
+        idle = parked & ~charging
+        signals = {
+            "charge_rate": np.where(charged & (level_drop < 0) & (cur["battery_level"] <= TAPER_LEVEL),
+                                    -level_drop * capacity / 100 / safe_hours, nan),
+            "climate_load": np.where(parked & climate_on & np.isfinite(temps), temps, nan),
+        }
+        extras = {
+            "trip_miles": np.where(driving, miles, 0.0),
+            "trip_kwh": np.where(driving, energy, 0.0),
+            "parked_hours": np.where(idle, hours, 0.0),
+            "parked_drop": np.where(idle, level_drop, 0.0),
+            "unparked": interval & ~idle,
+            "climate_parked": cur["is_climate_on"] & (~has_prev | (np.abs(miles) < PARKED_MILES)),
+        }
+        return signals, extras
+
+    def _run_rounds(self, slots: np.ndarray, depths: np.ndarray, cur: Dict[str, np.ndarray],
+                    signals: Dict[str, np.ndarray], extras: Dict[str, np.ndarray]) -> List[Tuple]:
+        """Fold samples into the per-slot state, one depth at a time; returns raw alert tuples.
+
+        Each tuple is (sample indices, signal, detector, values, baselines, scores).
+        """
+        found = []
+        timestamps = cur["timestamp"]
+        accumulated = {"efficiency": np.full(len(slots), np.nan), "vampire_drain": np.full(len(slots), np.nan)}
+        climate_ms = self.climate_hours * 3_600_000
+        for depth in range(int(depths.max()) + 1):
+            index = np.flatnonzero(depths == depth) if depth or depths.any() else np.arange(len(slots))
+            at = slots[index]
+
+            # Efficiency is scored once per efficiency_miles of driving, and drain once
+            # per min_drain_hours of an uninterrupted parked stretch.
+            self._trip_miles[at] += extras["trip_miles"][index]
+            self._trip_kwh[at] += extras["trip_kwh"][index]
+            done = self._trip_miles[at] >= self.efficiency_miles
+            accumulated["efficiency"][index[done]] = self._trip_kwh[at[done]] / self._trip_miles[at[done]]
+            self._trip_miles[at[done]] = 0.0
+            self._trip_kwh[at[done]] = 0.0
+
+            restart = at[extras["unparked"][index]]
+            self._parked_hours[restart] = 0.0
+            self._parked_drop[restart] = 0.0
+            self._parked_hours[at] += extras["parked_hours"][index]
+            self._parked_drop[at] += extras["parked_drop"][index]
+            done = self._parked_hours[at] >= self.min_drain_hours
+            accumulated["vampire_drain"][index[done]] = self._parked_drop[at[done]] / self._parked_hours[at[done]]
+            self._parked_hours[at[done]] = 0.0
+            self._parked_drop[at[done]] = 0.0
+
+            for name, baseline in self.baselines.items():
+                values = accumulated[name] if name in accumulated else signals[name]
+                valid = ~np.isnan(values[index])
+                if not valid.any():
+                    continue
+                rows, x = index[valid], values[index[valid]]
+                median, robust_z, cusum, warm = baseline.step(slots[rows], x, self.cusum_slack, self.min_samples)
+                spike = warm & (robust_z >= self.z_threshold)
+                if spike.any():
+                    found.append((rows[spike], name, "zscore", x[spike], median[spike], robust_z[spike]))
+                shift = warm & (cusum >= self.cusum_threshold)
+                if shift.any():
+                    found.append((rows[shift], name, "cusum", x[shift], median[shift], cusum[shift]))
+                    baseline.restart(slots[rows[shift]])
+
+            # Climate left on while parked: one alert per stretch.
+            on = extras["climate_parked"][index]
+            since = self._climate_since[at]
+            since = np.where(on, np.where(since < 0, timestamps[index], since), -1)
+            alerted = self._climate_alerted[at] & on
+            long = on & ~alerted & (timestamps[index] - since >= climate_ms)
+            if long.any():
+                hours = (timestamps[index[long]] - since[long]) / 3_600_000
+                found.append((index[long], "climate_load", "climate_on", hours,
+                              np.full(len(hours), self.climate_hours), hours / self.climate_hours))
+            self._climate_since[at] = since
+            self._climate_alerted[at] = alerted | long
+        return found
+
+    def _build_alerts(self, slots: np.ndarray, cur: Dict[str, np.ndarray], found: List[Tuple]) -> List[Alert]:
+        if not found:
+            return []
+        vins = self.store.vins
+        alerts = []
+        for rows, signal, detector, values, baselines, scores in found:
+            names = self.store.decode("display_name", cur["display_name"][rows])
+            for i, row in enumerate(rows.tolist()):
+                alerts.append(Alert(
+                    vin=vins[slots[row]], name=str(names[i]), timestamp_ms=int(cur["timestamp"][row]),
+                    signal=signal, detector=detector, value=float(values[i]),
+                    baseline=float(baselines[i]), score=float(scores[i]),
+                    context={
+                        "odometer": float(cur["odometer"][row]),
+                        "battery_level": int(cur["battery_level"][row]),
+                        "latitude": float(cur["latitude"][row]),
+                        "longitude": float(cur["longitude"][row]),
+                    },
+                ))
+        alerts.sort(key=lambda alert: alert.timestamp_ms)
+        return alerts
+
+    def recent(self, vin: str = None, signal: str = None) -> List[Alert]:
+        """Alerts kept from recent updates (up to ``max_alerts``), optionally for one VIN or signal."""
+        return [alert for alert in self.alerts
+                if (vin is None or alert.vin == vin) and (signal is None or alert.signal == signal)]
+
+    def baseline(self, vin: str, signal: str) -> Dict[str, float]:
+        """A vehicle's current baseline for a signal: samples, mean, std, median and robust spread."""
+        slot = self.store.slot(vin)
+        state = self.baselines[signal]
+        if slot >= len(state.count):
+            return {"samples": 0, "mean": np.nan, "std": np.nan, "median": np.nan, "spread": np.nan}
+        return {
+            "samples": int(state.count[slot]),
+            "mean": float(state.mean[slot]),
+            "std": float(np.sqrt(state.var[slot])),
+            "median": float(state.median[slot]),
+            "spread": float(MAD_TO_SIGMA * state.mad[slot]),
+        }
@@ -0,0 +1,144 @@
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, List, Sequence
+from synthetic import SyntheticFleet
+from fleet import FleetAnalytics
+from analysis import EnergyAndCostAnalyzer
+from visualizer import FleetVisualizer
+
+DEFAULT_SIZES = (10, 1_000, 10_000, 100_000)
+BENCHMARKS = ("vehicle_construction", "ingest", "fleet_summary", "efficiency_metrics",
+              "text_report", "dashboard")
+
+
+@dataclass
+class BenchmarkResult:
+    """Timing and memory for one benchmark at one fleet size."""
+    name: str
+    vehicles: int
+    snapshots: int
+    best_seconds: float
+    mean_seconds: float
+    peak_bytes: int
+    allocated_blocks: int
+
+
+def measure(name: str, vehicles: int, snapshots: int, function: Callable[[], object],
+            setup: Callable[[], None] = None, repeat: int = 3) -> BenchmarkResult:
+    """Time ``function`` ``repeat`` times, then run it once more under tracemalloc.
+
+    Wall times come from untraced runs; the traced run reports the peak
+    traced memory and the net number of memory blocks still allocated.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        gc.collect()
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+
+    if setup:
+        setup()
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    result = function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    allocated = sys.getallocatedblocks() - blocks
+    del result
+    return BenchmarkResult(name, vehicles, snapshots, min(times), sum(times) / len(times), peak, allocated)
+
+
+def run_size(n_vehicles: int, snapshots: int, benchmarks: Sequence[str], repeat: int,
+             output_dir: str) -> List[BenchmarkResult]:
+    """Run the selected benchmarks against a synthetic fleet of one size."""
+    generator = SyntheticFleet(n_vehicles)
+    history = list(generator.snapshots(snapshots))
+    vehicles_data, health_data = history[0]
+    results = []
+    state: Dict[str, FleetAnalytics] = {}
+
+    def build():
+        fleet = FleetAnalytics()
+        fleet.ingest(vehicles_data, health_data)
+        return fleet
+
+    def fresh():
+        state["fleet"] = FleetAnalytics()
+        state["fleet"].ingest(vehicles_data, health_data)
+
+    def ingest():
+        for later_vehicles, later_health in history[1:]:
+            state["fleet"].ingest(later_vehicles, later_health)
+
+    fleet = build()
+    for later_vehicles, later_health in history[1:]:
+        fleet.ingest(later_vehicles, later_health)
+    analyzer = EnergyAndCostAnalyzer(fleet.vehicles)
+    visualizer = FleetVisualizer(fleet.vehicles, fleet)
+    dashboard_file = os.path.join(output_dir, f"dashboard_{n_vehicles}.html")
+
+    cases = {
+        "vehicle_construction": (build, None),
+        "ingest": (ingest, fresh),
+        "fleet_summary": (fleet.get_fleet_summary, None),
+        "efficiency_metrics": (analyzer.calculate_efficiency_metrics, None),
+        "text_report": (analyzer.generate_text_report, None),
+        "dashboard": (lambda: visualizer.create_dashboard(dashboard_file), None),
+    }
+    for name in benchmarks:
+        function, setup = cases[name]
+        results.append(measure(name, n_vehicles, snapshots, function, setup, repeat))
+    return results
+
+
+def format_results(results: Sequence[BenchmarkResult]) -> str:
+    """Render results as a fixed-width table."""
+    lines = [f"{'benchmark':<22}{'vehicles':>10}{'best (s)':>12}{'mean (s)':>12}{'peak (MiB)':>12}{'blocks':>12}"]
+    for r in results:
+        lines.append(f"{r.name:<22}{r.vehicles:>10,}{r.best_seconds:>12.4f}{r.mean_seconds:>12.4f}"
+                     f"{r.peak_bytes / 2 ** 20:>12.1f}{r.allocated_blocks:>12,}")
+    return "\n".join(lines)
+
+
+def main():
+    """Run the benchmark suite against synthetic fleets."""
+    parser = argparse.ArgumentParser(description="Benchmark the fleet analytics pipeline on synthetic data.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="comma-separated fleet sizes")
+    parser.add_argument("--snapshots", type=int, default=3, help="snapshots per vehicle")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per benchmark")
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help="comma-separated benchmarks to run")
+    parser.add_argument("--json", dest="json_file", help="also write results to this JSON file")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    benchmarks = [name for name in args.only.split(",") if name]
+    unknown = set(benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for size in sizes:
+            size_results = run_size(size, args.snapshots, benchmarks, args.repeat, output_dir)
+            print(format_results(size_results), flush=True)
+            results.extend(size_results)
+
+    if args.json_file:
+        with open(args.json_file, 'w') as f:
+            json.dump([asdict(r) for r in results], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import argparse
+import sys
+from typing import List, Optional
+from snapshot import SNAPSHOT_FILE, build_snapshot, format_energy_report, format_summary, load_snapshot, \
+    save_snapshot, snapshot_time
+
+# Only the snapshot module is imported up front. numpy, pandas, plotly and
+# requests are imported inside the commands that need them, so `summary` and
+# `report` answered from the last snapshot start without loading any of them.
+
+HISTORY_DIR = "history"
+SEGMENTS_DB = "segments.db"
+API_CACHE_DB = "api_cache.db"
+TARIFF_FILE = "tariff.json"
+REPORTS_BASE = "reports/fleet_report"
+
+
+def refresh(history_dir: str = HISTORY_DIR, segments_db: str = SEGMENTS_DB,
+            snapshot_file: str = SNAPSHOT_FILE, tariff_file: str = TARIFF_FILE):
+    """Fetch the fleet, merge it into the history, segment it and save a snapshot; returns the fleet."""
+    from tessie_api import TessieAPIManager
+    from fleet import FleetAnalytics
+    from metrics_store import MetricsStore
+    from segment_store import SegmentStore
+    from segmentation import SegmentDB, segment_store
+    from analysis import EnergyAndCostAnalyzer
+    from response_cache import ResponseCache
+    from tariff import load_tariff_engine
+    from key import API_KEY
+
+    cache = ResponseCache(API_CACHE_DB)
+    with TessieAPIManager(api_key=API_KEY, cache=cache) as api_manager:
+        vehicle_records, health_map = api_manager.fetch_fleet_records()
+    cache.close()
+    fleet = FleetAnalytics.from_store(MetricsStore(backing=SegmentStore(history_dir)))
+    fleet.ingest_records(vehicle_records, health_map)
+    fleet.store.flush()
+
+    segments = SegmentDB(segments_db)
+    try:
+        segment_store(fleet.store, segments)
+        report = EnergyAndCostAnalyzer(fleet.vehicles, tariff_engine=load_tariff_engine(tariff_file),
+                                       segments=segments).report_data()
+    finally:
+        segments.close()
+    save_snapshot(build_snapshot(fleet.get_fleet_summary(), report), snapshot_file)
+    return fleet
+
+
+def _snapshot(args: argparse.Namespace):
+    """The snapshot to answer from, refreshing first if asked or if there is none."""
+    snapshot = None if args.refresh else load_snapshot(args.snapshot)
+    if snapshot is None:
+        refresh(args.history, args.segments, args.snapshot, args.tariff)
+        snapshot = load_snapshot(args.snapshot)
+    return snapshot
+
+
+def summary_command(args: argparse.Namespace):
+    snapshot = _snapshot(args)
+    if args.json:
+        import json
+        print(json.dumps({"created": snapshot_time(snapshot), **snapshot["summary"]}))
+    else:
+        print(format_summary(snapshot["summary"]))
+
+
+def report_command(args: argparse.Namespace):
+    report = format_energy_report(**_snapshot(args)["report"])
+    if args.output == "-":
+        print(report)
+    else:
+        with open(args.output, "w") as f:
+            f.write(report)
+
+
+def _fleet(args: argparse.Namespace):
+    """The fleet from the persisted history, refreshed from the API first if asked."""
+    if args.refresh:
+        return refresh(args.history, args.segments, args.snapshot, args.tariff)
+    from fleet import FleetAnalytics
+    from metrics_store import MetricsStore
+    from segment_store import SegmentStore
+    return FleetAnalytics.from_store(MetricsStore(backing=SegmentStore(args.history)))
+
+
+def dashboard_command(args: argparse.Namespace):
+    fleet = _fleet(args)
+    from visualizer import FleetVisualizer
+    FleetVisualizer(fleet.vehicles, fleet).create_dashboard(args.output, mode=args.mode)
+
+
+def cohorts_command(args: argparse.Namespace):
+    fleet = _fleet(args)
+    from analysis import EnergyAndCostAnalyzer
+    from segmentation import SegmentDB
+    from reports import DEFAULT_FORMATS, CohortReportBuilder, export_report
+    from tariff import load_tariff_engine
+
+    formats = args.formats.split(",") if args.formats else DEFAULT_FORMATS
+    segments = SegmentDB(args.segments)
+    try:
+        analyzer = EnergyAndCostAnalyzer(fleet.vehicles, tariff_engine=load_tariff_engine(args.tariff),
+                                         segments=segments)
+        report = CohortReportBuilder(fleet.vehicles, analyzer, period=args.period).build()
+    finally:
+        segments.close()
+    for files in export_report(report, args.output, formats).values():
+        for filename in files:
+            print(filename)
+
+
+def poll_command(args: argparse.Namespace):
+    from poller import main as poller_main
+    poller_main(args.extra)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Tesla fleet analytics.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def command(name: str, handler, help: str, refreshes: bool = True) -> argparse.ArgumentParser:
+        subparser = commands.add_parser(name, help=help)
+        subparser.set_defaults(handler=handler)
+        if refreshes:
+            subparser.add_argument("--refresh", action="store_true",
+                                   help="fetch the fleet from the API first instead of using the last snapshot")
+            subparser.add_argument("--snapshot", default=SNAPSHOT_FILE, help="snapshot file")
+            subparser.add_argument("--history", default=HISTORY_DIR, help="persisted metrics history directory")
+            subparser.add_argument("--segments", default=SEGMENTS_DB, help="trip and charge-session database")
+            subparser.add_argument("--tariff", default=TARIFF_FILE,
+                                   help="JSON tariff file for charging costs (a flat rate if it does not exist)")
+        return subparser
+
+    summary = command("summary", summary_command, "print the fleet summary from the last snapshot")
+    summary.add_argument("--json", action="store_true", help="print JSON instead of text")
+
+    report = command("report", report_command, "write the energy and cost report from the last snapshot")
+    report.add_argument("--output", default="energy_report.txt", help="report file, or - for stdout")
+
+    dashboard = command("dashboard", dashboard_command, "render the dashboard from the persisted history")
+    dashboard.add_argument("--output", default="dashboard.html", help="dashboard file (.html or .html.gz)")
+    dashboard.add_argument("--mode", default="auto", choices=("auto", "classic", "scalable"))
+
+    cohorts = command("cohorts", cohorts_command, "compare cohorts and export the fleet report from the persisted history")
+    cohorts.add_argument("--output", default=REPORTS_BASE, help="path prefix of the report files")
+    cohorts.add_argument("--formats", default=None,
+                         help="comma-separated subset of csv,json,parquet,md,html,txt (default: all available)")
+    cohorts.add_argument("--period", default="7d", help="period compared with the one before it, e.g. 7d or 30d")
+
+    command("poll", poll_command, "poll the fleet continuously; other arguments go to poller.py", refreshes=False)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None):
+    """Run one subcommand; `summary` and `report` work offline from the last snapshot."""
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    args.extra = extra
+    if extra and args.command != "poll":
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
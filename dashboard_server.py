@@ -0,0 +1,253 @@
+import argparse
+import hashlib
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
+from plotly.offline import get_plotlyjs
+from fleet import FleetAnalytics
+from visualizer import FleetVisualizer, SCALABLE_COLUMNS, SCALABLE_CATEGORY_COLUMNS
+
+EVENTS_PATH = "/events"
+PLOTLYJS_PATH = "/plotly.js"
+HEARTBEAT_SECONDS = 15.0
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+def _json_values(values: np.ndarray) -> list:
+    """Column values as JSON-safe Python values (NaN becomes null)."""
+    if values.dtype.kind == 'f':
+        return [None if v != v else v for v in values.tolist()]
+    return values.tolist()
+
+
+class DashboardServer:
+    """Serves the scalable dashboard and pushes changed vehicles over server-sent events.
+
+    The page and plotly.js are served with ETags so reloads revalidate
+    cheaply. Fleet change events mark VINs dirty; every ``push_interval``
+    seconds the dirty VINs are coalesced into one ``update`` event holding
+    just their positions and values, so bandwidth and server work scale with
+    the number of changed vehicles rather than the fleet size. Fleet
+    membership changes send a ``reload`` event instead.
+    """
+    def __init__(self, fleet: FleetAnalytics, host: str = "127.0.0.1", port: int = 8050,
+                 push_interval: float = 1.0):
+        self.fleet = fleet
+        self.visualizer = FleetVisualizer(fleet.vehicles, fleet)
+        self.push_interval = push_interval
+        # _lock guards the page state and client list and is only held briefly;
+        # _render_lock serializes page renders and delta reads of the fleet view;
+        # _dirty_lock is the only lock the ingest thread takes (in _on_change).
+        self._lock = threading.Lock()
+        self._render_lock = threading.Lock()
+        self._dirty_lock = threading.Lock()
+        self._dirty: Set[str] = set()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._clients: List[queue.Queue] = []
+        self._page: Optional[Tuple[bytes, str]] = None
+        self._page_vehicles = 0
+        self._energy_known: Optional[np.ndarray] = None
+        self._dirty_since_page = False
+        plotlyjs = get_plotlyjs().encode()
+        self._plotlyjs = (plotlyjs, _etag(plotlyjs))
+
+        fleet.on_change(self._on_change)
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._threads: List[threading.Thread] = []
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def _on_change(self, vin: str):
+        with self._dirty_lock:
+            self._dirty.add(vin)
+        self._wake.set()
+
+    def page(self) -> Tuple[bytes, str]:
+        """Current page and its ETag, rebuilt only after the fleet changed since it was built.
+
+        The render runs outside ``_lock``, so it never holds up fleet ingestion
+        or clients connecting; changes pushed meanwhile mark the new page stale.
+        """
+        with self._render_lock:
+            with self._lock:
+                if self._page is not None and not self._dirty_since_page:
+                    return self._page
+                self._dirty_since_page = False
+            view = self.fleet.latest_view()
+            energy_known = ~np.isnan(view["lifetime_energy_used"])
+            vehicles = len(self.fleet.vehicles)
+            parts = self.visualizer.scalable_page(f'<script src="{PLOTLYJS_PATH}"></script>', EVENTS_PATH)
+            body = "".join(parts).encode()
+            page = (body, _etag(body))
+            with self._lock:
+                self._page, self._page_vehicles, self._energy_known = page, vehicles, energy_known
+            return page
+
+    def _delta(self, vins: Set[str]) -> Tuple[str, Optional[Dict]]:
+        """Event name and payload for a batch of changed VINs."""
+        if len(self.fleet.vehicles) != self._page_vehicles:
+            return "reload", None
+        view = self.fleet.latest_view()
+        positions = np.sort(self.fleet.positions(vins))
+        known = ~np.isnan(view["lifetime_energy_used"][positions])
+        if self._energy_known is not None and (known != self._energy_known[positions]).any():
+            # The energy chart indexes vehicles with data; a change in that set needs a new layout.
+            return "reload", None
+        columns = {}
+        for name in SCALABLE_COLUMNS:
+            values = view[name][positions]
+            columns[name] = values.tolist() if name in SCALABLE_CATEGORY_COLUMNS else _json_values(values)
+        columns["name"] = view["name"][positions].tolist()
+        return "update", {"positions": positions.tolist(), "columns": columns}
+
+    def _broadcast(self, event: str, payload: Optional[Dict]):
+        message = f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode()
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            client.put(message)
+
+    def _push_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait()
+            if self._stop.is_set():
+                break
+            # Coalesce changes arriving within one push interval.
+            time.sleep(self.push_interval)
+            self._wake.clear()
+            with self._dirty_lock:
+                vins, self._dirty = self._dirty, set()
+            if not vins:
+                continue
+            with self._render_lock:
+                with self._lock:
+                    if self._page is None:
+                        continue
+                    self._dirty_since_page = True
+                event, payload = self._delta(vins)
+            self._broadcast(event, payload)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, body: bytes, etag: str, content_type: str, cache_control: str):
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", cache_control)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if path == "/":
+                    body, etag = server.page()
+                    self._send(body, etag, "text/html; charset=utf-8", "no-cache")
+                elif path == PLOTLYJS_PATH:
+                    body, etag = server._plotlyjs
+                    self._send(body, etag, "application/javascript", "public, max-age=86400")
+                elif path == EVENTS_PATH:
+                    self._stream()
+                else:
+                    self.send_error(404)
+
+            def _stream(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "keep-alive")
+                self.end_headers()
+                client: queue.Queue = queue.Queue()
+                with server._lock:
+                    server._clients.append(client)
+                try:
+                    while not server._stop.is_set():
+                        try:
+                            message = client.get(timeout=HEARTBEAT_SECONDS)
+                        except queue.Empty:
+                            message = b": heartbeat\n\n"
+                        self.wfile.write(message)
+                        self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    with server._lock:
+                        server._clients.remove(client)
+                    self.close_connection = True
+
+        return Handler
+
+    def start(self):
+        """Serve and push updates from background threads."""
+        for target in (self.httpd.serve_forever, self._push_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Stop pushing and shut the HTTP server down."""
+        self._stop.set()
+        self._wake.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    """Poll the fleet and serve a live dashboard until interrupted."""
+    from key import API_KEY
+    from metrics_store import MetricsStore
+    from segment_store import SegmentStore
+    from tessie_api import TessieAPIManager
+    from poller import FleetPoller
+
+    parser = argparse.ArgumentParser(description="Serve a live fleet dashboard.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument("--push-interval", type=float, default=1.0,
+                        help="seconds over which vehicle changes are batched into one push")
+    parser.add_argument("--history", default="history", help="directory for persisted metrics history")
+    args = parser.parse_args()
+
+    with TessieAPIManager(api_key=API_KEY) as api_manager:
+        fleet = FleetAnalytics.from_store(MetricsStore(backing=SegmentStore(args.history)))
+        poller = FleetPoller(api_manager, fleet)
+        poller.poll_once()
+        server = DashboardServer(fleet, args.host, args.port, args.push_interval)
+        server.start()
+        print(f"Serving live dashboard at {server.url}")
+        try:
+            poller.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            poller.stop()
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+from base import ChargingState
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class SchemaError(ValueError):
+    """Raised when a payload is not valid JSON, is missing a required field or has the wrong type.
+
+    With msgspec, both malformed JSON and schema violations surface as
+    ``msgspec.DecodeError`` (``ValidationError`` is a subclass), which the
+    decoders re-raise as this.
+    """
+
+
+# VehicleMetrics field -> (path into a vehicle state payload, required key)
+STATE_SCHEMA: Dict[str, Tuple[Tuple[str, ...], bool]] = {
+    "timestamp": (("drive_state", "timestamp"), True),
+    "display_name": (("display_name",), True),
+    "battery_level": (("charge_state", "battery_level"), True),
+    "battery_range": (("charge_state", "battery_range"), True),
+    "charging_state": (("charge_state", "charging_state"), True),
+    "lifetime_energy_used": (("charge_state", "lifetime_energy_used"), False),
+    "latitude": (("drive_state", "latitude"), True),
+    "longitude": (("drive_state", "longitude"), True),
+    "speed": (("drive_state", "speed"), True),
+    "power": (("drive_state", "power"), True),
+    "odometer": (("vehicle_state", "odometer"), True),
+    "inside_temp": (("climate_state", "inside_temp"), True),
+    "outside_temp": (("climate_state", "outside_temp"), True),
+    "is_climate_on": (("climate_state", "is_climate_on"), True),
+    "model_type": (("vehicle_config", "car_type"), True),
+    "performance_package": (("vehicle_config", "performance_package"), True),
+    "trim_badging": (("vehicle_config", "trim_badging"), True),
+    "efficiency_package": (("vehicle_config", "efficiency_package"), True),
+}
+# Fields from vehicle_config, which only changes with the car's configuration.
+STATIC_FIELDS = ("model_type", "performance_package", "trim_badging", "efficiency_package")
+
+
+def loads(payload: bytes) -> Any:
+    """Parse JSON bytes with the fastest available parser; malformed JSON raises SchemaError."""
+    try:
+        if orjson is not None:
+            return orjson.loads(payload)
+        return json.loads(payload)
+    except ValueError as exc:  # json.JSONDecodeError and orjson.JSONDecodeError
+        raise SchemaError(str(exc)) from None
+
+
+def _results(payload: bytes) -> List[Any]:
+    """The ``results`` list of a JSON response body."""
+    try:
+        results = loads(payload)["results"]
+    except (KeyError, TypeError):
+        raise SchemaError("missing results") from None
+    if not isinstance(results, list):
+        raise SchemaError("results is not a list")
+    return results
+
+
+def _finish(record: Dict[str, Any], state: str) -> Dict[str, Any]:
+    """Apply the derived and defaulted fields shared by every decoding path."""
+    record["is_active"] = state == "online"
+    if record["lifetime_energy_used"] is None:
+        record["lifetime_energy_used"] = 0.0
+    record["power"] = record["power"] or 0
+    try:
+        record["charging_state"] = ChargingState(record["charging_state"])
+    except ValueError as exc:
+        raise SchemaError(str(exc)) from None
+    return record
+
+
+def flatten_state(state_data: Dict) -> Dict[str, Any]:
+    """Pull the VehicleMetrics fields out of a decoded vehicle state dict."""
+    record = {}
+    for name, (path, required) in STATE_SCHEMA.items():
+        value = state_data
+        try:
+            for key in path:
+                value = value[key] if required else value.get(key)
+        except (KeyError, TypeError, AttributeError):
+            raise SchemaError(f"missing {'.'.join(path)}") from None
+        record[name] = value
+    try:
+        return _finish(record, state_data["state"])
+    except KeyError:
+        raise SchemaError("missing state") from None
+
+
+if msgspec is not None:
+    class _DriveState(msgspec.Struct):
+        timestamp: int
+        latitude: Optional[float]
+        longitude: Optional[float]
+        speed: Optional[float]
+        power: Optional[float]
+
+    class _ChargeState(msgspec.Struct):
+        battery_level: Optional[int]
+        battery_range: Optional[float]
+        charging_state: str
+        lifetime_energy_used: Optional[float] = None
+
+    class _VehicleState(msgspec.Struct):
+        odometer: Optional[float]
+
+    class _ClimateState(msgspec.Struct):
+        inside_temp: Optional[float]
+        outside_temp: Optional[float]
+        is_climate_on: Optional[bool]
+
+    class _VehicleConfig(msgspec.Struct):
+        car_type: str
+        performance_package: Optional[str]
+        trim_badging: Optional[str]
+        efficiency_package: Optional[str]
+
+    class _State(msgspec.Struct):
+        state: str
+        display_name: Optional[str]
+        drive_state: _DriveState
+        charge_state: _ChargeState
+        vehicle_state: _VehicleState
+        climate_state: _ClimateState
+        vehicle_config: _VehicleConfig
+
+    class _Vehicle(msgspec.Struct):
+        vin: str
+        last_state: _State
+
+    class _VehiclesResponse(msgspec.Struct):
+        results: List[_Vehicle]
+
+    class _RawVehicle(msgspec.Struct):
+        vin: str
+        last_state: msgspec.Raw
+
+    class _RawVehiclesResponse(msgspec.Struct):
+        results: List[_RawVehicle]
+
+    class _VolatileState(msgspec.Struct):
+        state: str
+        display_name: Optional[str]
+        drive_state: _DriveState
+        charge_state: _ChargeState
+        vehicle_state: _VehicleState
+        climate_state: _ClimateState
+        vehicle_config: msgspec.Raw
+
+    _vehicles_decoder = msgspec.json.Decoder(_VehiclesResponse)
+    _state_decoder = msgspec.json.Decoder(_State)
+    _raw_vehicles_decoder = msgspec.json.Decoder(_RawVehiclesResponse)
+    _volatile_decoder = msgspec.json.Decoder(_VolatileState)
+    _config_decoder = msgspec.json.Decoder(_VehicleConfig)
+
+    def _static_from_struct(config: "_VehicleConfig") -> Dict[str, Any]:
+        return {
+            "model_type": config.car_type,
+            "performance_package": config.performance_package,
+            "trim_badging": config.trim_badging,
+            "efficiency_package": config.efficiency_package,
+        }
+
+    def _volatile_from_struct(state) -> Dict[str, Any]:
+        drive, charge, climate = state.drive_state, state.charge_state, state.climate_state
+        return {
+            "timestamp": drive.timestamp,
+            "display_name": state.display_name,
+            "battery_level": charge.battery_level,
+            "battery_range": charge.battery_range,
+            "charging_state": charge.charging_state,
+            "lifetime_energy_used": charge.lifetime_energy_used,
+            "latitude": drive.latitude,
+            "longitude": drive.longitude,
+            "speed": drive.speed,
+            "power": drive.power,
+            "odometer": state.vehicle_state.odometer,
+            "inside_temp": climate.inside_temp,
+            "outside_temp": climate.outside_temp,
+            "is_climate_on": climate.is_climate_on,
+        }
+
+    def _record_from_struct(state: "_State") -> Dict[str, Any]:
+        return _finish({**_volatile_from_struct(state), **_static_from_struct(state.vehicle_config)}, state.state)
+
+
+def decode_vehicles(payload: bytes) -> List[Dict[str, Any]]:
+    """Decode a /vehicles response into one flat record per vehicle.
+
+    Records are keyed by VehicleMetrics field names plus ``vin``, with the
+    timestamp left in epoch milliseconds. With msgspec installed the bytes
+    are decoded and validated in one pass into structs holding only these
+    fields; otherwise the payload is parsed with orjson (or json) and the
+    fields are pulled out through STATE_SCHEMA.
+    """
+    if msgspec is not None:
+        try:
+            vehicles = _vehicles_decoder.decode(payload).results
+        except msgspec.DecodeError as exc:
+            raise SchemaError(str(exc)) from None
+        records = []
+        for vehicle in vehicles:
+            record = _record_from_struct(vehicle.last_state)
+            record["vin"] = vehicle.vin
+            records.append(record)
+        return records
+
+    records = []
+    for vehicle in _results(payload):
+        try:
+            state, vin = vehicle["last_state"], vehicle["vin"]
+        except (KeyError, TypeError):
+            raise SchemaError("missing vin or last_state") from None
+        record = flatten_state(state)
+        record["vin"] = vin
+        records.append(record)
+    return records
+
+
+def decode_state(payload: bytes) -> Dict[str, Any]:
+    """Decode a /{vin}/state response into a flat record (without ``vin``)."""
+    if msgspec is not None:
+        try:
+            return _record_from_struct(_state_decoder.decode(payload))
+        except msgspec.DecodeError as exc:
+            raise SchemaError(str(exc)) from None
+    return flatten_state(loads(payload))
+
+
+def decode_battery_health(payload: bytes) -> Dict[str, Dict]:
+    """Decode a /battery_health response into a VIN -> health dict map."""
+    try:
+        return {item["vin"]: item for item in _results(payload)}
+    except (KeyError, TypeError):
+        raise SchemaError("missing vin") from None
+
+
+def split_vehicles(payload: bytes) -> Optional[List[Tuple[str, bytes]]]:
+    """(vin, raw last_state JSON) per vehicle of a /vehicles response, or None without msgspec."""
+    if msgspec is None:
+        return None
+    try:
+        return [(vehicle.vin, bytes(vehicle.last_state)) for vehicle in _raw_vehicles_decoder.decode(payload).results]
+    except msgspec.DecodeError as exc:
+        raise SchemaError(str(exc)) from None
+
+
+def decode_volatile(raw_state: bytes) -> Tuple[Dict[str, Any], bytes]:
+    """Decode a raw vehicle state without its config: (record minus STATIC_FIELDS, raw vehicle_config)."""
+    try:
+        state = _volatile_decoder.decode(raw_state)
+    except msgspec.DecodeError as exc:
+        raise SchemaError(str(exc)) from None
+    return _finish(_volatile_from_struct(state), state.state), bytes(state.vehicle_config)
+
+
+def decode_static(raw_config: bytes) -> Dict[str, Any]:
+    """Decode a raw vehicle_config into the STATIC_FIELDS of a record."""
+    try:
+        return _static_from_struct(_config_decoder.decode(raw_config))
+    except msgspec.DecodeError as exc:
+        raise SchemaError(str(exc)) from None
@@ -1,27 +1,261 @@
-from typing import List, Dict, Any
-from datetime import datetime
+from typing import List, Dict, Any, Optional, Callable, Sequence, Set, Tuple
+import numpy as np
 from vehicle import Vehicle
-import pandas as pd
+from metrics_store import MetricsStore, CATEGORICAL_FIELDS, HEALTH_FIELDS, TimeBound, to_epoch_ms
+from instrumentation import timed
+from rollups import Interval, STATS, align, finish_stats, group_percentile, parse_interval, reduce_stats
+
+# Latest values kept in the fleet's incrementally refreshed view.
+VIEW_FIELDS = (
+    "is_active", "battery_level", "charging_state", "lifetime_energy_used",
+    "latitude", "longitude", "odometer", "model_type", "performance_package", "trim_badging",
+) + HEALTH_FIELDS
+
+
+def _store_view(store: MetricsStore, vins: Sequence[str], names: Sequence[str]) -> Dict[str, np.ndarray]:
+    slots = store.slots(vins)
+    health_ids = store.latest_column("battery_health")[slots]
+    view = {}
+    for name in names:
+        if name in HEALTH_FIELDS:
+            view[name] = store.health_values(name)[health_ids]
+        elif name in CATEGORICAL_FIELDS:
+            view[name] = store.decode(name, store.latest_column(name)[slots])
+        else:
+            view[name] = store.latest_column(name)[slots]
+    return view
+
+
+def build_latest_view(vehicles: Sequence[Vehicle], names: Sequence[str] = VIEW_FIELDS) -> Dict[str, np.ndarray]:
+    """Latest values per vehicle, in vehicle order, as decoded arrays.
+
+    Includes ``vin`` and ``name`` (the vehicle display name) alongside the
+    requested metric fields; battery health fields are NaN without health data.
+    """
+    groups: Dict[int, List[int]] = {}
+    for position, vehicle in enumerate(vehicles):
+        groups.setdefault(id(vehicle.store), []).append(position)
+    view = {
+        "vin": np.array([v.vin for v in vehicles], dtype=object),
+        "name": np.array([v.display_name for v in vehicles], dtype=object),
+    }
+    for name in names:
+        view[name] = None
+    for positions in groups.values():
+        store = vehicles[positions[0]].store
+        part = _store_view(store, [vehicles[p].vin for p in positions], names)
+        for name, values in part.items():
+            if view[name] is None:
+                view[name] = np.empty(len(vehicles), dtype=values.dtype)
+            view[name][positions] = values
+    for name in names:
+        if view[name] is None:
+            view[name] = np.empty(0)
+    return view
+
 
 class FleetAnalytics:
-    """Class for analyzing fleet-wide metrics."""
-    def __init__(self):
+    """Class for analyzing fleet-wide metrics.
+
+    Summary totals are maintained incrementally from store append events, and
+    derived views are cached until a vehicle in the fleet changes.
+    """
+    def __init__(self, store: MetricsStore = None):
         self.vehicles: List[Vehicle] = []
+        self._by_vin: Dict[str, Vehicle] = {}
+        self._positions: Dict[str, int] = {}
+        self.store = store if store is not None else MetricsStore()
+
+        self._totals = {"active": 0, "odometer": 0.0, "battery_level": 0, "charging": 0}
+        self._contributions: Dict[str, Tuple[int, float, int, int]] = {}
+        self._cache: Dict[str, Any] = {}
+        self._view: Optional[Dict[str, np.ndarray]] = None
+        self._view_changed: Set[str] = set()
+        self._listeners: List[Callable[[str], None]] = []
+        self.store.subscribe(self._on_append)
+
+    @classmethod
+    def from_store(cls, store: MetricsStore) -> "FleetAnalytics":
+        """Build a fleet from every vehicle held in a store or its backing segments."""
+        fleet = cls(store)
+        vins = store.backing.vins() if store.backing is not None else store.vins
+        for vin in vins:
+            fleet.add_vehicle(Vehicle.from_store(vin, store))
+        return fleet
 
     def add_vehicle(self, vehicle: Vehicle):
         """Add a vehicle to the fleet."""
+        vehicle.attach_store(self.store)
+        self._positions[vehicle.vin] = len(self.vehicles)
         self.vehicles.append(vehicle)
+        self._by_vin[vehicle.vin] = vehicle
+        self._changed(vehicle.vin)
+
+    @timed("fleet_ingest")
+    def ingest(self, vehicles_data: List[Dict], battery_health_data: List[Dict]) -> List[Vehicle]:
+        """Merge a /vehicles and /battery_health response into the fleet.
+
+        Known vehicles only record a snapshot if their state changed; returns
+        the vehicles that were added.
+        """
+        health_map = {item['vin']: item for item in battery_health_data}
+        added = []
+        for vehicle_data in vehicles_data:
+            vin = vehicle_data['vin']
+            vehicle = self.get_vehicle(vin)
+            if vehicle is None:
+                vehicle = Vehicle(vehicle_data, health_map.get(vin), store=self.store)
+                self.add_vehicle(vehicle)
+                added.append(vehicle)
+            else:
+                if vin in health_map:
+                    vehicle.update_battery_health(health_map[vin])
+                vehicle.ingest_state(vehicle_data['last_state'])
+        return added
+
+    @timed("fleet_ingest")
+    def ingest_records(self, records: List[Dict], health_map: Dict[str, Dict]) -> List[Vehicle]:
+        """Like ingest, for decoded vehicle records and a VIN -> battery health map."""
+        added = []
+        for record in records:
+            vin = record['vin']
+            vehicle = self.get_vehicle(vin)
+            if vehicle is None:
+                vehicle = Vehicle.from_record(record, health_map.get(vin), store=self.store)
+                self.add_vehicle(vehicle)
+                added.append(vehicle)
+            else:
+                if vin in health_map:
+                    vehicle.update_battery_health(health_map[vin])
+                vehicle.ingest_record(record)
+        return added
+
+    def get_vehicle(self, vin: str) -> Optional[Vehicle]:
+        """Look up a vehicle by VIN."""
+        return self._by_vin.get(vin)
+
+    def on_change(self, listener: Callable[[str], None]):
+        """Call ``listener(vin)`` whenever a fleet vehicle records a new snapshot."""
+        self._listeners.append(listener)
+
+    def _on_append(self, vin: str):
+        if vin in self._by_vin:
+            self._changed(vin)
+
+    def _changed(self, vin: str):
+        """Fold a vehicle's new latest values into the totals in O(1)."""
+        store = self.store
+        slot = store.slot(vin)
+        charging_state = store.latest_value("charging_state", slot)
+        contribution = (
+            int(store.latest_value("is_active", slot)),
+            float(store.latest_value("odometer", slot)),
+            int(store.latest_value("battery_level", slot)),
+            int(store.categories["charging_state"].decode(charging_state) == "Charging"),
+        )
+        previous = self._contributions.get(vin, (0, 0.0, 0, 0))
+        for key, new, old in zip(self._totals, contribution, previous):
+            self._totals[key] += new - old
+        self._contributions[vin] = contribution
+
+        self._cache.clear()
+        self._view_changed.add(vin)
+        for listener in self._listeners:
+            listener(vin)
+
+    def cached(self, key: str, builder: Callable[[], Any]) -> Any:
+        """Return a derived value, rebuilding it only after the fleet changed."""
+        if key not in self._cache:
+            self._cache[key] = builder()
+        return self._cache[key]
+
+    def invalidate(self, key: str = None):
+        """Drop one cached derived value, or all of them and rebuild the totals."""
+        if key is not None:
+            self._cache.pop(key, None)
+            return
+        self._cache.clear()
+        self._view = None
+        self._totals = dict.fromkeys(self._totals, 0)
+        self._contributions.clear()
+        for vehicle in self.vehicles:
+            self._changed(vehicle.vin)
+
+    def latest_view(self) -> Dict[str, np.ndarray]:
+        """Latest values per vehicle in fleet order; only changed vehicles are refreshed."""
+        if self._view is None or len(self._view["vin"]) != len(self.vehicles):
+            self._view = build_latest_view(self.vehicles)
+        elif self._view_changed:
+            # Swap the set first so changes recorded meanwhile (e.g. by a poller thread) are kept.
+            changed, self._view_changed = self._view_changed, set()
+            vins = list(changed)
+            positions = self.positions(vins)
+            for name, values in _store_view(self.store, vins, VIEW_FIELDS).items():
+                self._view[name][positions] = values
+            self._view["name"][positions] = [self._by_vin[vin].display_name for vin in vins]
+            return self._view
+        self._view_changed = set()
+        return self._view
+
+    def positions(self, vins: Sequence[str]) -> np.ndarray:
+        """Positions of fleet VINs in ``vehicles`` (and the rows of latest_view); unknown VINs are skipped."""
+        return np.fromiter((self._positions[vin] for vin in vins if vin in self._positions), dtype=np.intp)
+
+    def window(self, field: str, start: TimeBound = None, end: TimeBound = None, agg: str = "mean") -> np.ndarray:
+        """One aggregate of a metric over [start, end) per vehicle, in fleet order."""
+        rollups = self.store.rollups
+        return np.array([rollups.window(v.vin, field, start, end, (agg,))[field][agg] for v in self.vehicles],
+                        dtype=np.float64)
+
+    def resample(self, field: str, every: Interval, aggs: Sequence[str] = ("mean",),
+                 start: TimeBound = None, end: TimeBound = None) -> Dict[str, np.ndarray]:
+        """A metric downsampled fleet-wide into ``every``-wide buckets.
+
+        Means, minima, maxima, sums and counts pool every vehicle's samples in
+        a bucket; ``delta`` sums the per-vehicle deltas (e.g. fleet miles per
+        day from ``odometer``); percentiles pool the raw samples.
+        """
+        rollups = self.store.rollups
+        every_ms = parse_interval(every)
+        parts = [rollups.resample_stats(v.vin, field, every_ms, start, end) for v in self.vehicles]
+        parts = [(timestamps, stats) for timestamps, stats in parts if len(timestamps)]
+        if not parts:
+            return {"timestamp": np.empty(0, dtype=np.int64), **{agg: np.empty(0) for agg in aggs}}
+        timestamps = np.concatenate([part[0] for part in parts])
+        stats = {name: np.concatenate([part[1][name] for part in parts]) for name in STATS}
+        deltas = finish_stats(stats, "delta")
+        order = np.argsort(timestamps, kind="stable")
+        timestamps = timestamps[order]
+        starts = np.concatenate([[0], np.flatnonzero(timestamps[1:] != timestamps[:-1]) + 1])
+        buckets = timestamps[starts]
+        pooled = reduce_stats({name: values[order] for name, values in stats.items()}, starts)
+
+        result = {"timestamp": buckets}
+        for agg in aggs:
+            if agg == "delta":
+                result[agg] = np.add.reduceat(np.nan_to_num(deltas[order]), starts)
+            elif agg.startswith("p"):
+                bounds = align(to_epoch_ms(start), to_epoch_ms(end), every_ms)
+                raw = [rollups.raw(v.vin, field, *bounds) for v in self.vehicles]
+                raw_ts = np.concatenate([r[0] for r in raw])
+                groups, values = group_percentile(np.concatenate([r[1] for r in raw]),
+                                                  raw_ts // every_ms * every_ms, float(agg[1:]))
+                result[agg] = np.full(len(buckets), np.nan)
+                result[agg][np.searchsorted(buckets, groups)] = values
+            elif agg in ("first", "last"):
+                raise ValueError(f"{agg!r} is not defined across vehicles")
+            else:
+                result[agg] = finish_stats(pooled, agg)
+        return result
 
     def get_fleet_summary(self) -> Dict[str, Any]:
         """Get current fleet-wide summary metrics."""
-        active_vehicles = [v for v in self.vehicles if v.get_latest_metrics().is_active]
+        totals = self._totals
 
         return {
             "total_vehicles": len(self.vehicles),
-            "active_vehicles": len(active_vehicles),
-            "total_fleet_miles": sum(v.get_latest_metrics().odometer for v in self.vehicles),
-            "average_battery_level": sum(v.get_latest_metrics().battery_level for v in self.vehicles) / len(
-                self.vehicles),
-            "vehicles_charging": sum(
-                1 for v in self.vehicles if v.get_latest_metrics().charging_state.value == "Charging")
+            "active_vehicles": totals["active"],
+            "total_fleet_miles": totals["odometer"],
+            "average_battery_level": totals["battery_level"] / len(self.vehicles),
+            "vehicles_charging": totals["charging"]
         }
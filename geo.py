@@ -0,0 +1,404 @@
+import json
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+import numpy as np
+from fleet import FleetAnalytics
+
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE_LAT = 69.05
+DEFAULT_CELL_DEGREES = 0.05  # about 3.5 miles of latitude
+STAY_KEY_STRIDE = 1 << 32  # open stays are keyed fence * stride + vehicle position
+
+
+def haversine_miles(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Great-circle distance in miles; broadcasts over arrays."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=np.float64)) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+@dataclass
+class Geofence:
+    """A named zone (depot, customer site, ...) bounded by a (latitude, longitude) polygon."""
+    name: str
+    polygon: List[Tuple[float, float]]
+    kind: str = "site"
+
+    def __post_init__(self):
+        vertices = np.asarray(self.polygon, dtype=np.float64)
+        if vertices.ndim != 2 or vertices.shape[0] < 3 or vertices.shape[1] != 2:
+            raise ValueError(f"Geofence {self.name!r} needs at least three (lat, lon) vertices")
+        self.vertices = vertices
+
+    @classmethod
+    def circle(cls, name: str, latitude: float, longitude: float, radius_miles: float,
+               sides: int = 32, kind: str = "site") -> "Geofence":
+        """A regular polygon approximating a circle around a point."""
+        angles = np.linspace(0, 2 * np.pi, sides, endpoint=False)
+        dlat = radius_miles / MILES_PER_DEGREE_LAT
+        dlon = dlat / max(np.cos(np.radians(latitude)), 1e-6)
+        polygon = list(zip(latitude + dlat * np.sin(angles), longitude + dlon * np.cos(angles)))
+        return cls(name, polygon, kind)
+
+    @property
+    def bbox(self) -> Tuple[float, float, float, float]:
+        """(min_lat, min_lon, max_lat, max_lon)."""
+        return (*self.vertices.min(axis=0), *self.vertices.max(axis=0))
+
+
+def load_geofences(filename: str) -> List[Geofence]:
+    """Read geofences from a JSON list of {"name", "polygon": [[lat, lon], ...], "kind"}."""
+    with open(filename) as f:
+        return [Geofence(item["name"], [tuple(p) for p in item["polygon"]], item.get("kind", "site"))
+                for item in json.load(f)]
+
+
+class GridIndex:
+    """Uniform latitude/longitude grid over point positions.
+
+    Each point's cell is one int64 key, row-major, so the cells of one grid
+    row within a longitude range are a contiguous key range; the keys are
+    kept sorted so any rectangle is answered with one vectorized
+    ``searchsorted`` over its rows. Moving points only recomputes their own
+    cells; the sort is redone lazily (a few hundred microseconds at 10k).
+    """
+    def __init__(self, cell_degrees: float = DEFAULT_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self.n_cols = int(np.ceil(360 / cell_degrees)) + 1
+        self.latitude = np.empty(0)
+        self.longitude = np.empty(0)
+        self._keys = np.empty(0, dtype=np.int64)
+        self._order: Optional[np.ndarray] = None
+        self._sorted_keys: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.latitude)
+
+    def _rows(self, latitude) -> np.ndarray:
+        return np.floor((np.asarray(latitude) + 90) / self.cell_degrees).astype(np.int64)
+
+    def _cols(self, longitude) -> np.ndarray:
+        return np.floor((np.asarray(longitude) + 180) / self.cell_degrees).astype(np.int64)
+
+    def _cell_keys(self, latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+        keys = self._rows(latitude) * self.n_cols + self._cols(longitude)
+        # Points without a position go in a cell no query range reaches.
+        return np.where(np.isnan(latitude) | np.isnan(longitude), np.iinfo(np.int64).max, keys)
+
+    def resize(self, size: int):
+        """Grow to ``size`` points; new points have no position until updated."""
+        extra = size - len(self)
+        if extra > 0:
+            self.latitude = np.concatenate([self.latitude, np.full(extra, np.nan)])
+            self.longitude = np.concatenate([self.longitude, np.full(extra, np.nan)])
+            self._keys = np.concatenate([self._keys, np.full(extra, np.iinfo(np.int64).max)])
+            self._order = None
+
+    def update(self, positions: np.ndarray, latitude: np.ndarray, longitude: np.ndarray):
+        """Move points (by position) to new coordinates."""
+        if len(positions) and positions.max() >= len(self):
+            self.resize(int(positions.max()) + 1)
+        self.latitude[positions] = latitude
+        self.longitude[positions] = longitude
+        self._keys[positions] = self._cell_keys(latitude, longitude)
+        self._order = None
+
+    def _sorted(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._order is None:
+            self._order = np.argsort(self._keys, kind="stable")
+            self._sorted_keys = self._keys[self._order]
+        return self._order, self._sorted_keys
+
+    def query_boxes(self, boxes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Points in the cells covering each (min_lat, min_lon, max_lat, max_lon) box.
+
+        Returns (box index, point position) candidate pairs; callers filter
+        them exactly. A box reaching past -180 or 180 degrees longitude wraps:
+        it is split into its in-range part and the part on the other side of
+        the antimeridian, and one 360 degrees or wider spans every longitude.
+        """
+        boxes = np.atleast_2d(np.asarray(boxes, dtype=np.float64))
+        box_ids = np.arange(len(boxes))
+        full = boxes[:, 3] - boxes[:, 1] >= 360
+        west, east = (boxes[:, 1] < -180) & ~full, (boxes[:, 3] > 180) & ~full
+        wrapped_west, wrapped_east = boxes[west].copy(), boxes[east].copy()
+        wrapped_west[:, 1], wrapped_west[:, 3] = wrapped_west[:, 1] + 360, 180
+        wrapped_east[:, 1], wrapped_east[:, 3] = -180, wrapped_east[:, 3] - 360
+        boxes = boxes.copy()
+        boxes[full, 1], boxes[full, 3] = -180, 180
+        boxes = np.concatenate([boxes, wrapped_west, wrapped_east])
+        box_ids = np.concatenate([box_ids, box_ids[west], box_ids[east]])
+
+        order, sorted_keys = self._sorted()
+        row0, row1 = self._rows(np.clip(boxes[:, 0], -90, 90)), self._rows(np.clip(boxes[:, 2], -90, 90))
+        col0, col1 = self._cols(np.clip(boxes[:, 1], -180, 180)), self._cols(np.clip(boxes[:, 3], -180, 180))
+        rows_per_box = row1 - row0 + 1
+        box_of_range = np.repeat(np.arange(len(boxes)), rows_per_box)
+        rows = row0[box_of_range] + _ranks(rows_per_box)
+        lo = np.searchsorted(sorted_keys, rows * self.n_cols + col0[box_of_range], side="left")
+        hi = np.searchsorted(sorted_keys, rows * self.n_cols + col1[box_of_range], side="right")
+        counts = hi - lo
+        box_index = box_ids[np.repeat(box_of_range, counts)]
+        points = order[np.repeat(lo, counts) + _ranks(counts)]
+        return box_index, points
+
+    def within_radius(self, latitude: float, longitude: float, miles: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Positions within ``miles`` of a point and their distances, nearest first."""
+        dlat = miles / MILES_PER_DEGREE_LAT
+        dlon = min(dlat / max(np.cos(np.radians(min(abs(latitude) + dlat, 89.9))), 1e-6), 180.0)
+        _, candidates = self.query_boxes([(latitude - dlat, longitude - dlon, latitude + dlat, longitude + dlon)])
+        distances = haversine_miles(latitude, longitude, self.latitude[candidates], self.longitude[candidates])
+        inside = distances <= miles
+        candidates, distances = candidates[inside], distances[inside]
+        order = np.argsort(distances, kind="stable")
+        return candidates[order], distances[order]
+
+    def nearest(self, latitude: float, longitude: float, k: int = 1,
+                max_miles: float = 2 * np.pi * EARTH_RADIUS_MILES) -> Tuple[np.ndarray, np.ndarray]:
+        """The ``k`` nearest positions and their distances, searching outward ring by ring."""
+        radius = self.cell_degrees * MILES_PER_DEGREE_LAT
+        while True:
+            positions, distances = self.within_radius(latitude, longitude, radius)
+            if len(positions) >= k or radius >= max_miles:
+                return positions[:k], distances[:k]
+            radius = min(radius * 2, max_miles)
+
+
+def _ranks(counts: np.ndarray) -> np.ndarray:
+    """0..n-1 within each of a sequence of groups of the given sizes."""
+    counts = np.asarray(counts, dtype=np.int64)
+    total = int(counts.sum())
+    if not total:
+        return np.empty(0, dtype=np.int64)
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.arange(total, dtype=np.int64) - starts
+
+
+class GeofenceSet:
+    """Vectorized point-in-polygon tests against many geofences at once.
+
+    All polygon edges are packed into flat arrays. Points are first matched
+    to fences through the grid (bounding-box prefilter), and only surviving
+    (point, fence) pairs run the crossing-number test, over all of their
+    edges in one NumPy pass.
+    """
+    def __init__(self, geofences: Sequence[Geofence]):
+        self.geofences = list(geofences)
+        self.names = [fence.name for fence in self.geofences]
+        self.bboxes = np.array([fence.bbox for fence in self.geofences], dtype=np.float64).reshape(-1, 4)
+        starts, ends = [], []
+        for fence in self.geofences:
+            starts.append(fence.vertices)
+            ends.append(np.roll(fence.vertices, -1, axis=0))
+        self.edge_counts = np.array([len(fence.vertices) for fence in self.geofences], dtype=np.int64)
+        self.edge_offsets = np.cumsum(self.edge_counts) - self.edge_counts
+        self._starts = np.concatenate(starts) if starts else np.empty((0, 2))
+        self._ends = np.concatenate(ends) if ends else np.empty((0, 2))
+
+    def __len__(self) -> int:
+        return len(self.geofences)
+
+    def contains_pairs(self, fences: np.ndarray, latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+        """Whether each point lies inside the paired fence (crossing-number test)."""
+        edge_pair = np.repeat(np.arange(len(fences)), self.edge_counts[fences])
+        edges = np.repeat(self.edge_offsets[fences], self.edge_counts[fences]) + _ranks(self.edge_counts[fences])
+        y, x = latitude[edge_pair], longitude[edge_pair]
+        y1, x1 = self._starts[edges, 0], self._starts[edges, 1]
+        y2, x2 = self._ends[edges, 0], self._ends[edges, 1]
+        straddles = (y1 > y) != (y2 > y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            crossing_x = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        crosses = straddles & (x < crossing_x)
+        counts = np.bincount(edge_pair, weights=crosses, minlength=len(fences))
+        return counts % 2 == 1
+
+    def locate(self, index: GridIndex, positions: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(fence index, point position) pairs for points inside fences.
+
+        With ``positions``, only those points are tested.
+        """
+        if not len(self):
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+        fences, points = index.query_boxes(self.bboxes)
+        if positions is not None:
+            keep = np.zeros(len(index), dtype=bool)
+            keep[positions] = True
+            fences, points = fences[keep[points]], points[keep[points]]
+        latitude, longitude = index.latitude[points], index.longitude[points]
+        box = self.bboxes[fences]
+        in_box = ((latitude >= box[:, 0]) & (latitude <= box[:, 2]) &
+                  (longitude >= box[:, 1]) & (longitude <= box[:, 3]))
+        fences, points = fences[in_box], points[in_box]
+        inside = self.contains_pairs(fences, index.latitude[points], index.longitude[points])
+        return fences[inside], points[inside]
+
+
+@dataclass
+class Visit:
+    """A completed stay of one vehicle inside one geofence."""
+    vin: str
+    zone: str
+    start_ms: int
+    end_ms: int
+
+    @property
+    def duration(self) -> float:
+        """Seconds."""
+        return (self.end_ms - self.start_ms) / 1000
+
+
+@dataclass
+class _Occupancy:
+    """Currently open stays, as sorted stay keys with their entry timestamps."""
+    keys: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    entered: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+
+
+class FleetGeo:
+    """Spatial index, geofence membership and dwell time for a fleet's latest positions.
+
+    Vehicles that record a new snapshot are marked dirty through the fleet's
+    change events; ``update()`` moves only those in the grid and re-tests
+    only them against the geofences, so each poll costs time in proportion
+    to the vehicles that reported. Stays are timed with the vehicles' own
+    snapshot timestamps: a stay starts at the first snapshot inside a fence
+    and ends at the first one outside it.
+    """
+    def __init__(self, fleet: FleetAnalytics, geofences: Sequence[Geofence] = (),
+                 cell_degrees: float = DEFAULT_CELL_DEGREES):
+        self.fleet = fleet
+        self.index = GridIndex(cell_degrees)
+        self.fences = GeofenceSet(geofences)
+        self._completed: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self._slots = np.empty(0, dtype=np.intp)  # store slot per fleet position
+        self._occupancy = _Occupancy()
+        self._lock = threading.Lock()
+        self._dirty: Set[str] = {vehicle.vin for vehicle in fleet.vehicles}
+        fleet.on_change(self._on_change)
+
+    def _on_change(self, vin: str):
+        with self._lock:
+            self._dirty.add(vin)
+
+    def update(self) -> int:
+        """Fold the positions of vehicles changed since the last call; returns how many."""
+        with self._lock:
+            vins, self._dirty = list(self._dirty), set()
+        if not vins:
+            return 0
+        store = self.fleet.store
+        vehicles = self.fleet.vehicles
+        if len(self._slots) < len(vehicles):
+            added = [vehicle.vin for vehicle in vehicles[len(self._slots):]]
+            self._slots = np.concatenate([self._slots, store.slots(added)])
+        positions = self.fleet.positions(vins)
+        slots = self._slots[positions]
+        self.index.resize(len(vehicles))
+        self.index.update(positions, store.latest_column("latitude")[slots],
+                          store.latest_column("longitude")[slots])
+        timestamps = np.full(len(self.index), -1, dtype=np.int64)
+        timestamps[positions] = store.latest_column("timestamp")[slots]
+        self._update_occupancy(positions, timestamps)
+        return len(positions)
+
+    def _update_occupancy(self, positions: np.ndarray, timestamps: np.ndarray):
+        stride = STAY_KEY_STRIDE
+        occupancy = self._occupancy
+        fences, points = self.fences.locate(self.index, positions)
+        now_keys = np.sort(fences.astype(np.int64) * stride + points)
+
+        # Only stays of the updated vehicles can have ended.
+        moved = np.zeros(len(self.index), dtype=bool)
+        moved[positions] = True
+        ended = moved[occupancy.keys % stride] & ~np.isin(occupancy.keys, now_keys)
+        if ended.any():
+            ended_keys = occupancy.keys[ended]
+            self._completed.append((ended_keys, occupancy.entered[ended], timestamps[ended_keys % stride]))
+
+        entering = now_keys[~np.isin(now_keys, occupancy.keys)]
+        keys = np.concatenate([occupancy.keys[~ended], entering])
+        entered = np.concatenate([occupancy.entered[~ended], timestamps[entering % stride]])
+        order = np.argsort(keys, kind="stable")
+        self._occupancy = _Occupancy(keys[order], entered[order])
+
+    def _completed_stays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Completed stays as (key, entered, left) arrays, compacted into one chunk."""
+        if len(self._completed) != 1:
+            parts = self._completed or [(np.empty(0, dtype=np.int64),) * 3]
+            self._completed = [tuple(np.concatenate(column) for column in zip(*parts))]
+        return self._completed[0]
+
+    def visits(self, zone: str = None, vin: str = None) -> List[Visit]:
+        """Completed stays in time order, optionally for one zone and/or vehicle."""
+        keys, entered, left = self._completed_stays()
+        fences, positions = np.divmod(keys, STAY_KEY_STRIDE)
+        keep = np.ones(len(keys), dtype=bool)
+        if zone is not None:
+            keep &= fences == self.fences.names.index(zone)
+        if vin is not None:
+            position = self.fleet.positions([vin])
+            keep &= np.isin(positions, position)
+        order = np.flatnonzero(keep)[np.argsort(entered[keep], kind="stable")]
+        vehicles, names = self.fleet.vehicles, self.fences.names
+        return [Visit(vehicles[positions[i]].vin, names[fences[i]], int(entered[i]), int(left[i]))
+                for i in order.tolist()]
+
+    def members(self, zone: str) -> List[str]:
+        """VINs currently inside a geofence."""
+        fence = self.fences.names.index(zone)
+        keys = self._occupancy.keys
+        positions = keys[keys // STAY_KEY_STRIDE == fence] % STAY_KEY_STRIDE
+        return [self.fleet.vehicles[p].vin for p in positions]
+
+    def zones(self, vin: str) -> List[str]:
+        """Geofences a vehicle is currently inside."""
+        position = self.fleet.positions([vin])
+        if not len(position):
+            return []
+        keys = self._occupancy.keys
+        fences = keys[keys % STAY_KEY_STRIDE == position[0]] // STAY_KEY_STRIDE
+        return [self.fences.names[f] for f in fences]
+
+    def dwell_seconds(self, now_ms: int = None) -> Dict[str, Dict[str, float]]:
+        """Total time per zone and VIN, including open stays up to ``now_ms`` (default: their latest snapshot)."""
+        keys, entered, left = self._completed_stays()
+        open_keys, open_entered = self._occupancy.keys, self._occupancy.entered
+        if now_ms is None:
+            until = self.fleet.store.latest_column("timestamp")[self._slots[open_keys % STAY_KEY_STRIDE]]
+        else:
+            until = np.full(len(open_keys), now_ms, dtype=np.int64)
+        all_keys = np.concatenate([keys, open_keys])
+        durations = np.concatenate([left - entered, np.maximum(until - open_entered, 0)])
+        unique, inverse = np.unique(all_keys, return_inverse=True)
+        seconds = np.bincount(inverse, weights=durations, minlength=len(unique)) / 1000
+
+        totals: Dict[str, Dict[str, float]] = {}
+        fences, positions = np.divmod(unique, STAY_KEY_STRIDE)
+        for fence, position, value in zip(fences.tolist(), positions.tolist(), seconds.tolist()):
+            totals.setdefault(self.fences.names[fence], {})[self.fleet.vehicles[position].vin] = value
+        return totals
+
+    def within_radius(self, latitude: float, longitude: float, miles: float) -> List[Tuple[str, float]]:
+        """(VIN, miles) for vehicles within ``miles`` of a point, nearest first."""
+        positions, distances = self.index.within_radius(latitude, longitude, miles)
+        return [(self.fleet.vehicles[p].vin, d) for p, d in zip(positions.tolist(), distances.tolist())]
+
+    def nearest(self, latitude: float, longitude: float, k: int = 1) -> List[Tuple[str, float]]:
+        """(VIN, miles) for the ``k`` vehicles nearest a point."""
+        positions, distances = self.index.nearest(latitude, longitude, k)
+        return [(self.fleet.vehicles[p].vin, d) for p, d in zip(positions.tolist(), distances.tolist())]
+
+    def center(self) -> Optional[Tuple[float, float]]:
+        """Mean latitude and longitude of vehicles with a position, or None if none has one.
+
+        Longitude is averaged on the circle, so a fleet straddling the
+        antimeridian is centered near 180 degrees rather than 0.
+        """
+        latitude, longitude = self.index.latitude, self.index.longitude
+        located = np.isfinite(latitude) & np.isfinite(longitude)
+        if not located.any():
+            return None
+        radians = np.radians(longitude[located])
+        mean_longitude = np.degrees(np.arctan2(np.sin(radians).mean(), np.cos(radians).mean()))
+        return float(latitude[located].mean()), float(mean_longitude)
@@ -0,0 +1,258 @@
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is +Inf.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRIC_PREFIX = "fleet_"
+
+Labels = Tuple[Tuple[str, str], ...]
+_NOOP = nullcontext()
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        cumulative, running = {}, 0
+        for bound, count in zip(list(self.bounds) + ["+Inf"], self.counts):
+            running += count
+            cumulative[str(bound)] = running
+        return {"count": self.count, "sum": self.sum, "buckets": cumulative}
+
+
+class Registry:
+    """Counters, gauges, latency histograms and timing spans, off by default.
+
+    Every hook checks ``enabled`` first and returns immediately when it is
+    False, so instrumented code pays one attribute read per call site.
+    """
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.gauges: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._collectors: List[Callable[["Registry"], None]] = []
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def count(self, name: str, value: float = 1, **labels: str):
+        """Add to a counter."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name: str, value: float, **labels: str):
+        """Set a gauge."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name: str, seconds: float, **labels: str):
+        """Record one latency sample."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def _span(self, name: str, labels: Dict[str, str]) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - started, **labels)
+
+    def span(self, name: str, **labels: str):
+        """Context manager timing a block into the ``<name>_seconds`` histogram."""
+        if not self.enabled:
+            return _NOOP
+        return self._span(name, labels)
+
+    def timed(self, name: str = None, **labels: str) -> Callable:
+        """Decorator timing every call of a function (named after it unless ``name`` is given)."""
+        def decorator(function: Callable) -> Callable:
+            span_name = name or f"{function.__module__}_{function.__qualname__}".replace(".", "_")
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with self._span(span_name, labels):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def add_collector(self, collector: Callable[["Registry"], None]):
+        """Call ``collector(registry)`` before each export, e.g. to set memory gauges."""
+        self._collectors.append(collector)
+
+    def collect(self):
+        for collector in self._collectors:
+            collector(self)
+
+    def to_dict(self) -> Dict[str, List[Dict[str, Any]]]:
+        """All metrics as JSON-ready lists of ``{"name", "labels", ...}`` entries."""
+        self.collect()
+        with self._lock:
+            return {
+                "counters": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in sorted(self.counters.items())],
+                "gauges": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in sorted(self.gauges.items())],
+                "histograms": [{"name": n, "labels": dict(l), **h.to_dict()}
+                               for (n, l), h in sorted(self.histograms.items(), key=lambda item: item[0])],
+            }
+
+    def to_prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        def label_text(labels: Dict[str, str], extra: Dict[str, str] = None) -> str:
+            merged = {**labels, **(extra or {})}
+            if not merged:
+                return ""
+            return "{" + ",".join(f'{k}="{str(v)}"' for k, v in merged.items()) + "}"
+
+        data = self.to_dict()
+        lines = []
+        typed = set()
+        for kind, entries in (("counter", data["counters"]), ("gauge", data["gauges"])):
+            for entry in entries:
+                name = METRIC_PREFIX + entry["name"] + ("_total" if kind == "counter" else "")
+                if name not in typed:
+                    lines.append(f"# TYPE {name} {kind}")
+                    typed.add(name)
+                lines.append(f"{name}{label_text(entry['labels'])} {entry['value']}")
+        for entry in data["histograms"]:
+            name = METRIC_PREFIX + entry["name"]
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            for bound, count in entry["buckets"].items():
+                lines.append(f"{name}_bucket{label_text(entry['labels'], {'le': bound})} {count}")
+            lines.append(f"{name}_sum{label_text(entry['labels'])} {entry['sum']}")
+            lines.append(f"{name}_count{label_text(entry['labels'])} {entry['count']}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, filename: str):
+        """Write metrics to ``filename``: Prometheus text for ``.prom``/``.txt``, JSON otherwise.
+
+        The file is replaced atomically, so a scraper never reads a partial export.
+        """
+        if filename.endswith((".prom", ".txt")):
+            text = self.to_prometheus()
+        else:
+            text = json.dumps(self.to_dict(), indent=2)
+        temporary = f"{filename}.tmp"
+        with open(temporary, "w") as f:
+            f.write(text)
+        os.replace(temporary, filename)
+
+
+# The process-wide registry used by the instrumented modules.
+metrics = Registry()
+span = metrics.span
+timed = metrics.timed
+
+
+def track_store(store, registry: Registry = metrics):
+    """Report a MetricsStore's history size (VINs, rows, bytes, health records) at export time."""
+    def collect(r: Registry):
+        r.gauge("store_vins", len(store.vins))
+        r.gauge("store_rows", len(store))
+        r.gauge("store_bytes", store.nbytes)
+        r.gauge("store_health_records", len(store.health_table))
+    registry.add_collector(collect)
+
+
+def endpoint_label(path: str) -> str:
+    """An API path with its VIN replaced, so per-vehicle calls share one label."""
+    head, _, rest = path.lstrip("/").partition("/")
+    return f"{{vin}}/{rest}" if rest and len(head) == 17 else path.lstrip("/")
+
+
+@contextmanager
+def profiling(filename: str = "profile.txt", top: int = 40, memory_frames: int = 1) -> Iterator[None]:
+    """Run a block under cProfile and tracemalloc and write a ranked hot-path report.
+
+    The report lists the functions with the most cumulative and own time,
+    then the source lines holding the most memory at the end of the block
+    and the peak traced memory.
+    """
+    profiler = cProfile.Profile()
+    tracemalloc.start(memory_frames)
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - started
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        _write_profile(filename, profiler, snapshot, elapsed, current, peak, top)
+
+
+def _write_profile(filename: str, profiler: cProfile.Profile, snapshot: tracemalloc.Snapshot,
+                   elapsed: float, current: int, peak: int, top: int):
+    report = [
+        "Hot-Path Profile",
+        f"\nWall time: {elapsed:.3f}s",
+        f"Traced memory: {current / 2 ** 20:.1f} MiB at end, {peak / 2 ** 20:.1f} MiB peak",
+    ]
+    for title, key in (("Cumulative time", "cumulative"), ("Own time", "tottime")):
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).strip_dirs().sort_stats(key).print_stats(top)
+        text = stream.getvalue()
+        report.append(f"\n{title} (top {top}):")
+        report.append(text[text.find("   ncalls"):].rstrip() if "   ncalls" in text else text.rstrip())
+    snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+    report.append(f"\nLargest allocations by line (top {top}):")
+    for stat in snapshot.statistics("lineno")[:top]:
+        frame = stat.traceback[0]
+        report.append(f"- {frame.filename}:{frame.lineno}: {stat.size / 1024:,.1f} KiB in {stat.count:,} blocks")
+    with open(filename, "w") as f:
+        f.write("\n".join(report) + "\n")
+
+
+def maybe_profiling(enabled: bool, filename: str = "profile.txt"):
+    """``profiling(filename)`` when enabled, else a no-op context."""
+    return profiling(filename) if enabled else _NOOP
@@ -1,34 +1,42 @@
+import argparse
 from tessie_api import TessieAPIManager
-from vehicle import Vehicle
 from fleet import FleetAnalytics
+from metrics_store import MetricsStore
+from segment_store import SegmentStore
 from visualizer import FleetVisualizer
 from key import API_KEY
 from analysis import EnergyAndCostAnalyzer
+from reports import DEFAULT_FORMATS, CohortReportBuilder, export_report
+from battery_forecast import BatteryForecaster
+from segmentation import SegmentDB, segment_store
+from instrumentation import metrics, maybe_profiling, span, track_store
+from snapshot import build_snapshot, save_snapshot
+from response_cache import ResponseCache
+from tariff import load_tariff_engine
+from cli import API_CACHE_DB, HISTORY_DIR, REPORTS_BASE, SEGMENTS_DB, TARIFF_FILE
 
 
-def main():
-    """Main function to run the fleet analytics."""
-    # Initialize API manager
+def run():
+    """Fetch, analyze and report on the fleet."""
+    # Initialize API manager; battery health is served from the cache while fresh
+    cache = ResponseCache(API_CACHE_DB)
     api_manager = TessieAPIManager(
         api_key=API_KEY,
+        cache=cache,
     )
 
-    # Get vehicles and battery health data
-    vehicles_data = api_manager.get_vehicles()
-    battery_health_data = api_manager.get_battery_health()
-
-    # Create a mapping of VIN to battery health data
-    health_map = {item['vin']: item for item in battery_health_data}
-
-    # Initialize fleet analytics
-    fleet = FleetAnalytics()
+    # Get vehicles and battery health data concurrently
+    with span("stage", stage="fetch"):
+        vehicle_records, health_map = api_manager.fetch_fleet_records()
+    api_manager.close()
+    cache.close()
 
-    # Create vehicle objects and add to fleet
-    for vehicle_data in vehicles_data:
-        vin = vehicle_data['vin']
-        health_data = health_map.get(vin)
-        vehicle = Vehicle(vehicle_data, health_data)
-        fleet.add_vehicle(vehicle)
+    # Restore persisted history, then merge in the fresh vehicle states
+    with span("stage", stage="ingest"):
+        fleet = FleetAnalytics.from_store(MetricsStore(backing=SegmentStore(HISTORY_DIR)))
+        fleet.ingest_records(vehicle_records, health_map)
+        fleet.store.flush()
+    track_store(fleet.store)
 
     # Get fleet summary
     summary = fleet.get_fleet_summary()
@@ -37,13 +45,52 @@ def main():
         print(f"{key}: {value}")
 
     # Create visualizations
-    visualizer = FleetVisualizer(fleet.vehicles)
-    visualizer.create_dashboard("dashboard.html")
+    with span("stage", stage="dashboard"):
+        visualizer = FleetVisualizer(fleet.vehicles, fleet)
+        visualizer.create_dashboard("dashboard.html")
+
+    # Split new history into trips and charge sessions
+    with span("stage", stage="segmentation"):
+        segments = SegmentDB(SEGMENTS_DB)
+        segment_store(fleet.store, segments)
+
+    # Analyze energy and cost metrics and compare cohorts, computed once for every report
+    with span("stage", stage="energy_report"):
+        analyzer = EnergyAndCostAnalyzer(fleet.vehicles, tariff_engine=load_tariff_engine(TARIFF_FILE),
+                                         segments=segments)
+        cohort_report = CohortReportBuilder(fleet.vehicles, analyzer).build()
+        report = cohort_report.energy
+        analyzer.save_text_report(data=report)
+    segments.close()
+
+    # Export the cohort report as CSV, JSON, Markdown and HTML (and Parquet with pyarrow)
+    with span("stage", stage="cohort_report"):
+        export_report(cohort_report, REPORTS_BASE, [fmt for fmt in DEFAULT_FORMATS if fmt != "txt"])
+
+    # Snapshot the results so `cli.py summary` / `cli.py report` can answer offline
+    save_snapshot(build_snapshot(summary, report))
+
+    # Forecast battery degradation from the stored health history
+    with span("stage", stage="battery_forecast"):
+        BatteryForecaster(fleet.vehicles).save_text_report()
+
+
+def main():
+    """Main function to run the fleet analytics."""
+    parser = argparse.ArgumentParser(description="Tesla fleet analytics.")
+    parser.add_argument("--profile", nargs="?", const="profile.txt", default=None, metavar="FILE",
+                        help="profile the run (cProfile + tracemalloc) and write a ranked hot-path report")
+    parser.add_argument("--metrics-file", default=None,
+                        help="write stage timings, API latencies and store sizes here "
+                             "(.prom for Prometheus text, else JSON)")
+    args = parser.parse_args()
 
-    # Analyze energy and cost metrics
-    analyzer = EnergyAndCostAnalyzer(fleet.vehicles)
-    analyzer.save_text_report()
+    metrics.enable(bool(args.metrics_file))
+    with maybe_profiling(bool(args.profile), args.profile or "profile.txt"):
+        run()
+    if args.metrics_file:
+        metrics.export(args.metrics_file)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
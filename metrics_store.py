@@ -0,0 +1,527 @@
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Union, TYPE_CHECKING
+import numpy as np
+from base import VehicleMetrics, ChargingState, BatteryHealth
+
+if TYPE_CHECKING:
+    from segment_store import SegmentStore
+    from rollups import RollupStore
+
+# Column layout shared by every VIN partition. Timestamps are epoch milliseconds,
+# categoricals hold int codes into a per-store dictionary and battery_health holds
+# an index into the store's BatteryHealth table (-1 for none).
+COLUMNS = [
+    ("timestamp", np.int64),
+    ("is_active", np.bool_),
+    ("display_name", np.int32),
+    ("battery_level", np.int16),
+    ("battery_range", np.float64),
+    ("charging_state", np.int16),
+    ("lifetime_energy_used", np.float64),
+    ("battery_health", np.int32),
+    ("latitude", np.float64),
+    ("longitude", np.float64),
+    ("speed", np.float64),
+    ("power", np.float64),
+    ("odometer", np.float64),
+    ("inside_temp", np.float64),
+    ("outside_temp", np.float64),
+    ("is_climate_on", np.bool_),
+    ("model_type", np.int16),
+    ("performance_package", np.int16),
+    ("trim_badging", np.int16),
+    ("efficiency_package", np.int16),
+]
+COLUMN_DTYPES = dict(COLUMNS)
+CATEGORICAL_FIELDS = (
+    "display_name", "charging_state", "model_type",
+    "performance_package", "trim_badging", "efficiency_package"
+)
+HEALTH_FIELDS = tuple(BatteryHealth.__dataclass_fields__)
+# Optional floats are stored as NaN and surface as None through row views.
+NULLABLE_FIELDS = ("lifetime_energy_used", "speed", "inside_temp", "outside_temp")
+
+TimeBound = Union[None, int, float, datetime]
+
+
+def to_epoch_ms(value: TimeBound) -> Optional[int]:
+    """Convert a datetime or epoch-millisecond bound to epoch milliseconds."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float, np.number)):
+        return int(value)
+    return int(value.timestamp() * 1000)
+
+
+class Categories:
+    """Dictionary encoding for a string column."""
+    def __init__(self):
+        self.values: List[str] = []
+        self.codes: Dict[str, int] = {}
+
+    def encode(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def decode(self, code: int) -> str:
+        return self.values[code]
+
+    def decode_array(self, codes: np.ndarray) -> np.ndarray:
+        """Decode an array of codes into an object array of strings."""
+        return np.asarray(self.values, dtype=object)[codes] if len(codes) else np.empty(0, dtype=object)
+
+
+class _Partition:
+    """Growable column arrays holding the history of a single VIN."""
+    __slots__ = ("vin", "slot", "size", "columns", "persisted", "loaded_from")
+
+    def __init__(self, vin: str, slot: int, capacity: int = 16):
+        self.vin = vin
+        self.slot = slot
+        self.size = 0
+        # Rows [0, persisted) are already on disk; rows before loaded_from (epoch ms)
+        # exist only on disk. None means the whole persisted history is in memory.
+        self.persisted = 0
+        self.loaded_from: Optional[int] = None
+        self.columns = {name: np.empty(capacity, dtype) for name, dtype in COLUMNS}
+
+    def reserve(self, extra: int):
+        capacity = len(self.columns["timestamp"])
+        needed = self.size + extra
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name, column in self.columns.items():
+            grown = np.empty(capacity, column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[name] = grown
+
+    def bounds(self, start: TimeBound, end: TimeBound):
+        """Row range [lo, hi) whose timestamps fall within [start, end)."""
+        timestamps = self.columns["timestamp"][:self.size]
+        start, end = to_epoch_ms(start), to_epoch_ms(end)
+        lo = 0 if start is None else int(np.searchsorted(timestamps, start, side="left"))
+        hi = self.size if end is None else int(np.searchsorted(timestamps, end, side="left"))
+        return lo, hi
+
+
+class MetricsRow:
+    """Lightweight read-only view of one stored snapshot, shaped like VehicleMetrics."""
+    __slots__ = ("_store", "_partition", "_index")
+
+    def __init__(self, store: "MetricsStore", partition: _Partition, index: int):
+        self._store = store
+        self._partition = partition
+        self._index = index
+
+    @property
+    def vin(self) -> str:
+        return self._partition.vin
+
+    def _raw(self, name: str):
+        return self._partition.columns[name][self._index]
+
+    def to_metrics(self) -> VehicleMetrics:
+        """Materialize the row as a VehicleMetrics dataclass."""
+        return VehicleMetrics(**{name: getattr(self, name) for name in VehicleMetrics.__dataclass_fields__})
+
+    def __repr__(self):
+        return f"MetricsRow(vin={self.vin!r}, timestamp={self.timestamp!r})"
+
+
+def _row_property(name: str):
+    if name == "timestamp":
+        def getter(self):
+            return datetime.fromtimestamp(int(self._raw(name)) / 1000)
+    elif name == "charging_state":
+        def getter(self):
+            return ChargingState(self._store.categories[name].decode(self._raw(name)))
+    elif name in CATEGORICAL_FIELDS:
+        def getter(self):
+            return self._store.categories[name].decode(self._raw(name))
+    elif name == "battery_health":
+        def getter(self):
+            health_id = self._raw(name)
+            return self._store.health_table[health_id] if health_id >= 0 else None
+    elif name in NULLABLE_FIELDS:
+        def getter(self):
+            value = self._raw(name)
+            return None if np.isnan(value) else float(value)
+    else:
+        def getter(self):
+            return self._raw(name).item()
+    return property(getter)
+
+
+for _name, _ in COLUMNS:
+    setattr(MetricsRow, _name, _row_property(_name))
+
+
+class MetricsStore:
+    """Fleet-wide columnar store of vehicle metrics, partitioned by VIN.
+
+    With a ``backing`` SegmentStore, a VIN's recent history (``hydrate_days``
+    before its last persisted snapshot) is loaded from disk the first time
+    the VIN is touched, older ranges are read from disk on demand, and
+    ``flush()`` persists rows appended since the last flush.
+    """
+    def __init__(self, backing: "SegmentStore" = None, hydrate_days: Optional[float] = 7):
+        self.backing = backing
+        self.hydrate_days = hydrate_days
+        self.categories: Dict[str, Categories] = {name: Categories() for name in CATEGORICAL_FIELDS}
+        self.health_table: List[BatteryHealth] = []
+        self._health_ids: Dict[int, int] = {}
+        self._health_values: Dict[str, np.ndarray] = {}
+        self._partitions: Dict[str, _Partition] = {}
+        self._vins: List[str] = []
+        self._latest = {name: np.empty(16, dtype) for name, dtype in COLUMNS}
+        self._to_disk: Dict[str, np.ndarray] = {}
+        self._from_disk: Dict[str, np.ndarray] = {}
+        self._listeners: List[Callable[[str], None]] = []
+        self._rollups: Optional["RollupStore"] = None
+
+    def __len__(self) -> int:
+        return sum(p.size for p in self._partitions.values())
+
+    def __contains__(self, vin: str) -> bool:
+        return vin in self._partitions
+
+    @property
+    def vins(self) -> List[str]:
+        """VINs in slot order; slot i maps to row i of the latest columns."""
+        return list(self._vins)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(c.nbytes for p in self._partitions.values() for c in p.columns.values())
+
+    @property
+    def rollups(self) -> "RollupStore":
+        """Multi-resolution rollups of this store, created on first use and kept current from then on."""
+        if self._rollups is None:
+            from rollups import RollupStore
+            self._rollups = RollupStore(self)
+        return self._rollups
+
+    def subscribe(self, listener: Callable[[str], None]):
+        """Call ``listener(vin)`` after rows are appended for a VIN."""
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable[[str], None]):
+        self._listeners.remove(listener)
+
+    def _notify(self, vin: str):
+        for listener in self._listeners:
+            listener(vin)
+
+    def _find(self, vin: str) -> Optional[_Partition]:
+        """Partition for a VIN, hydrating it from the backing store on first use."""
+        partition = self._partitions.get(vin)
+        if partition is None and self.backing is not None and self.backing.time_range(vin):
+            partition = self.hydrate(vin)
+        return partition
+
+    def _partition(self, vin: str) -> _Partition:
+        partition = self._find(vin)
+        return partition if partition is not None else self._new_partition(vin)
+
+    def _new_partition(self, vin: str) -> _Partition:
+        slot = len(self._vins)
+        partition = self._partitions[vin] = _Partition(vin, slot)
+        self._vins.append(vin)
+        capacity = len(self._latest["timestamp"])
+        if slot >= capacity:
+            for name, column in self._latest.items():
+                grown = np.empty(capacity * 2, column.dtype)
+                grown[:slot] = column[:slot]
+                self._latest[name] = grown
+        return partition
+
+    def _health_id(self, health: Optional[BatteryHealth]) -> int:
+        if health is None:
+            return -1
+        health_id = self._health_ids.get(id(health))
+        if health_id is None:
+            health_id = self._health_ids[id(health)] = len(self.health_table)
+            self.health_table.append(health)
+        return health_id
+
+    def encode(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """Encode a record of Python values into column storage values."""
+        encoded = {}
+        for name, _ in COLUMNS:
+            value = record.get(name)
+            if name == "timestamp":
+                value = to_epoch_ms(value)
+            elif name == "charging_state":
+                value = self.categories[name].encode(
+                    value.value if isinstance(value, ChargingState) else value)
+            elif name in CATEGORICAL_FIELDS:
+                value = self.categories[name].encode(value)
+            elif name == "battery_health":
+                value = self._health_id(value)
+            elif value is None:
+                value = np.nan if name in NULLABLE_FIELDS else 0
+            encoded[name] = value
+        return encoded
+
+    def append(self, vin: str, record: Dict[str, Any]) -> MetricsRow:
+        """Append one snapshot for a VIN and return a row view of it."""
+        encoded = self.encode(record)
+        partition = self._partition(vin)
+        partition.reserve(1)
+        index = partition.size
+        for name, value in encoded.items():
+            partition.columns[name][index] = value
+            self._latest[name][partition.slot] = value
+        partition.size += 1
+        self._notify(vin)
+        return MetricsRow(self, partition, index)
+
+    def append_metrics(self, metrics: VehicleMetrics) -> MetricsRow:
+        """Append a VehicleMetrics instance."""
+        return self.append(metrics.vin, vars(metrics))
+
+    def record(self, vin: str, index: int = -1) -> Dict[str, Any]:
+        """Decoded Python values of one stored snapshot, suitable for append()."""
+        row = self.row(vin, index)
+        record = {name: getattr(row, name) for name, _ in COLUMNS}
+        record["timestamp"] = int(row._raw("timestamp"))
+        record["vin"] = vin
+        return record
+
+    def adopt(self, other: "MetricsStore", vin: str):
+        """Copy a VIN's history from another store into this one."""
+        for index in range(other.row_count(vin)):
+            self.append(vin, other.record(vin, index))
+
+    def extend(self, vin: str, columns: Dict[str, np.ndarray]) -> int:
+        """Append many already-encoded rows for a VIN; returns the number appended."""
+        count = len(columns["timestamp"])
+        if not count:
+            return 0
+        partition = self._partition(vin)
+        partition.reserve(count)
+        lo, hi = partition.size, partition.size + count
+        for name, _ in COLUMNS:
+            partition.columns[name][lo:hi] = columns[name]
+            self._latest[name][partition.slot] = columns[name][-1]
+        partition.size = hi
+        self._notify(vin)
+        return count
+
+    def _code_mapping(self, name: str, to_disk: bool) -> np.ndarray:
+        """Code translation table between this store and its backing store.
+
+        The tables are cached and only extended as either dictionary grows, so
+        translating codes stays O(new values) across flushes and hydrations.
+        """
+        cache = self._to_disk if to_disk else self._from_disk
+        mapping = cache.get(name, np.empty(0, np.int64))
+        if name == "battery_health":
+            if to_disk:
+                new = [self.backing.health_code(h) for h in self.health_table[len(mapping):]]
+            else:
+                new = [self._health_id(self.backing.health_record(code))
+                       for code in range(len(mapping), len(self.backing.health.values))]
+        elif to_disk:
+            new = self.backing.encode_codes(name, self.categories[name].values[len(mapping):])
+        else:
+            new = [self.categories[name].encode(v) for v in self.backing.categories[name].values[len(mapping):]]
+        if len(new):
+            mapping = cache[name] = np.concatenate([mapping, np.asarray(new, dtype=np.int64)])
+        # A trailing -1 lets a missing battery_health code (-1) map to itself.
+        return np.append(mapping, -1)
+
+    def _to_records(self, partition: _Partition, lo: int, hi: int) -> np.ndarray:
+        """Rows [lo, hi) of a partition as on-disk records with backing codes."""
+        from segment_store import RECORD_DTYPE
+        records = np.empty(hi - lo, RECORD_DTYPE)
+        for name, _ in COLUMNS:
+            values = partition.columns[name][lo:hi]
+            if name in CATEGORICAL_FIELDS or name == "battery_health":
+                values = self._code_mapping(name, to_disk=True)[values]
+            records[name] = values
+        return records
+
+    def _from_records(self, records: np.ndarray, names: Iterable[str] = None) -> Dict[str, np.ndarray]:
+        """On-disk records as columns with this store's codes."""
+        columns = {}
+        for name in (names if names is not None else COLUMN_DTYPES):
+            values = records[name]
+            if name in CATEGORICAL_FIELDS or name == "battery_health":
+                values = self._code_mapping(name, to_disk=False)[values].astype(COLUMN_DTYPES[name])
+            columns[name] = values
+        return columns
+
+    def hydrate(self, vin: str, start: TimeBound = None) -> _Partition:
+        """Load a VIN's persisted history from the backing store.
+
+        Without ``start``, loads the ``hydrate_days`` before the last persisted
+        snapshot (or everything when ``hydrate_days`` is None).
+        """
+        if vin in self._partitions:
+            raise ValueError(f"{vin} is already loaded")
+        first_ts, last_ts = self.backing.time_range(vin)
+        start = to_epoch_ms(start)
+        if start is None and self.hydrate_days is not None:
+            start = last_ts - int(self.hydrate_days * 86_400_000)
+        if start is not None and start <= first_ts:
+            start = None
+        partition = self._new_partition(vin)
+        self.extend(vin, self._from_records(self.backing.read(vin, start)))
+        partition.persisted = partition.size
+        partition.loaded_from = start
+        return partition
+
+    def flush(self) -> int:
+        """Persist rows appended since the last flush; returns the number written."""
+        pending = []
+        for partition in self._partitions.values():
+            if partition.size > partition.persisted:
+                pending.append((partition, self._to_records(partition, partition.persisted, partition.size)))
+        # Codes must be on disk before any segment that refers to them.
+        self.backing.commit_dictionary()
+        for partition, records in pending:
+            self.backing.append(partition.vin, records)
+            partition.persisted = partition.size
+        return sum(len(records) for _, records in pending)
+
+    def row_count(self, vin: str) -> int:
+        """Number of in-memory snapshots for a VIN."""
+        partition = self._find(vin)
+        return partition.size if partition else 0
+
+    def row(self, vin: str, index: int = -1) -> MetricsRow:
+        partition = self._find(vin)
+        if partition is None:
+            raise KeyError(vin)
+        if index < 0:
+            index += partition.size
+        if not 0 <= index < partition.size:
+            raise IndexError(f"row {index} out of range for {vin}")
+        return MetricsRow(self, partition, index)
+
+    def latest(self, vin: str) -> Optional[MetricsRow]:
+        """Row view of the most recent snapshot for a VIN, or None."""
+        partition = self._find(vin)
+        if not partition or not partition.size:
+            return None
+        return MetricsRow(self, partition, partition.size - 1)
+
+    def history(self, vin: str) -> List[MetricsRow]:
+        """Row views of the in-memory snapshots for a VIN."""
+        partition = self._find(vin)
+        if not partition:
+            return []
+        return [MetricsRow(self, partition, i) for i in range(partition.size)]
+
+    def column(self, vin: str, name: str, start: TimeBound = None, end: TimeBound = None) -> np.ndarray:
+        """View of one raw column for a VIN, optionally bounded to [start, end)."""
+        return self.columns(vin, [name], start, end)[name]
+
+    def columns(self, vin: str, names: Iterable[str] = None,
+                start: TimeBound = None, end: TimeBound = None) -> Dict[str, np.ndarray]:
+        """Views of several raw columns for a VIN and time range.
+
+        In-memory ranges are zero-copy; ranges reaching back before the
+        hydrated window are read from the backing store and concatenated.
+        """
+        names = list(names) if names is not None else list(COLUMN_DTYPES)
+        partition = self._find(vin)
+        if partition is None:
+            return {name: np.empty(0, COLUMN_DTYPES[name]) for name in names}
+        lo, hi = partition.bounds(start, end)
+        columns = {name: partition.columns[name][lo:hi] for name in names}
+
+        start, end = to_epoch_ms(start), to_epoch_ms(end)
+        loaded_from = partition.loaded_from
+        if loaded_from is not None and (start is None or start < loaded_from):
+            older_end = loaded_from if end is None else min(end, loaded_from)
+            older = self._from_records(self.backing.read(vin, start, older_end), names)
+            columns = {name: np.concatenate([older[name], columns[name]]) for name in names}
+        return columns
+
+    def iter_columns(self, vin: str, names: Iterable[str] = None, start: TimeBound = None,
+                     end: TimeBound = None, reverse: bool = False) -> Iterator[Dict[str, np.ndarray]]:
+        """Like columns(), but yields one chunk at a time in time order (newest chunk first with ``reverse``).
+
+        Persisted history is read segment by segment without hydrating the
+        VIN, so scanning long histories of many vehicles keeps memory
+        bounded by the largest segment, and a scan stopped early only
+        touches the segments it got to.
+        """
+        names = list(names) if names is not None else list(COLUMN_DTYPES)
+        partition = self._partitions.get(vin)
+        start_ms, end_ms = to_epoch_ms(start), to_epoch_ms(end)
+        chunks = []
+        if self.backing is not None and (partition is None or partition.loaded_from is not None):
+            disk_end = end_ms
+            if partition is not None:
+                disk_end = partition.loaded_from if end_ms is None else min(end_ms, partition.loaded_from)
+            chunks.append(self._from_records(records, names)
+                          for records in self.backing.scan(vin, start_ms, disk_end, reverse) if len(records))
+        if partition is not None:
+            lo, hi = partition.bounds(start, end)
+            if hi > lo:
+                chunks.append([{name: partition.columns[name][lo:hi] for name in names}])
+        for part in reversed(chunks) if reverse else chunks:
+            yield from part
+
+    def slot(self, vin: str) -> int:
+        """Slot index of a VIN into the latest columns."""
+        return self._find(vin).slot
+
+    def latest_value(self, name: str, slot: int):
+        """Raw latest value of one column for one slot."""
+        return self._latest[name][slot]
+
+    def slots(self, vins: Sequence[str]) -> np.ndarray:
+        """Slot indices of the given VINs into the latest columns."""
+        return np.fromiter((self._find(vin).slot for vin in vins), dtype=np.intp, count=len(vins))
+
+    def latest_column(self, name: str, vins: Sequence[str] = None) -> np.ndarray:
+        """Raw latest values of a column, one per VIN in slot order (or for the given VINs)."""
+        column = self._latest[name][:len(self._vins)]
+        if vins is None:
+            return column
+        return column[self.slots(vins)]
+
+    def health_values(self, name: str) -> np.ndarray:
+        """One BatteryHealth field per health id, with a trailing NaN so id -1 maps to NaN."""
+        values = self._health_values.get(name)
+        if values is None or len(values) != len(self.health_table) + 1:
+            values = np.array([getattr(h, name) for h in self.health_table] + [np.nan], dtype=np.float64)
+            self._health_values[name] = values
+        return values
+
+    def health_history(self, vin: str, start: TimeBound = None, end: TimeBound = None) -> Dict[str, np.ndarray]:
+        """Battery health samples for a VIN: one row per change in its health values.
+
+        Returns ``timestamp`` and ``odometer`` at each change alongside every
+        BatteryHealth field; snapshots without health data are skipped.
+        """
+        columns = self.columns(vin, ["timestamp", "odometer", "battery_health"], start, end)
+        health_ids = columns.pop("battery_health")
+        values = {name: self.health_values(name)[health_ids] for name in HEALTH_FIELDS}
+        changed = health_ids >= 0
+        if len(changed) > 1:
+            differs = np.zeros(len(changed) - 1, dtype=bool)
+            for name in HEALTH_FIELDS:
+                differs |= values[name][1:] != values[name][:-1]
+            changed[1:] &= differs | (health_ids[:-1] < 0)
+        history = {name: column[changed] for name, column in columns.items()}
+        history.update((name, column[changed]) for name, column in values.items())
+        return history
+
+    def code(self, name: str, value: str) -> int:
+        """Code of a categorical value, or -1 if it has never been stored."""
+        return self.categories[name].codes.get(value, -1)
+
+    def decode(self, name: str, codes: np.ndarray) -> np.ndarray:
+        """Decode categorical codes into an object array of strings."""
+        return self.categories[name].decode_array(codes)
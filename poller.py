@@ -0,0 +1,199 @@
+import argparse
+import json
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+from base import ChargingState
+from tessie_api import TessieAPIManager, TessieAPIError
+from decoding import SchemaError
+from fleet import FleetAnalytics
+from metrics_store import MetricsStore
+from segment_store import SegmentStore
+from instrumentation import metrics, track_store
+from anomaly import AnomalyDetector
+from response_cache import ResponseCache
+
+# Seconds between polls for each vehicle activity class.
+DEFAULT_INTERVALS = {
+    "driving": 30.0,
+    "charging": 60.0,
+    "idle": 300.0,
+    "asleep": 1800.0,
+}
+
+
+@dataclass
+class PollCycle:
+    """Outcome of one polling cycle."""
+    started: float
+    polled: int
+    changed: int
+    skipped: int
+    failed: int
+    new_vehicles: int
+    duration: float
+
+
+def classify_record(record: Dict[str, Any]) -> str:
+    """Classify a flat decoded record (see decoding) into a polling activity class."""
+    if not record['is_active']:
+        return "asleep"
+    if record['speed']:
+        return "driving"
+    if record['charging_state'] == ChargingState.CHARGING:
+        return "charging"
+    return "idle"
+
+
+class FleetPoller:
+    """Long-running poller that keeps a FleetAnalytics up to date incrementally.
+
+    Each vehicle is polled on its own schedule derived from its last known
+    activity, and a snapshot is only appended when the vehicle's state changed.
+    """
+    def __init__(self, api_manager: TessieAPIManager, fleet: FleetAnalytics = None,
+                 intervals: Dict[str, float] = None, fleet_refresh: float = 3600.0,
+                 on_cycle: Callable[[PollCycle], None] = None):
+        self.api_manager = api_manager
+        self.fleet = fleet if fleet is not None else FleetAnalytics()
+        self.intervals = {**DEFAULT_INTERVALS, **(intervals or {})}
+        self.fleet_refresh = fleet_refresh
+        self.on_cycle = on_cycle
+        self.next_due: Dict[str, float] = {}
+        self._next_fleet_refresh = 0.0
+        self._stop = threading.Event()
+
+    def _schedule(self, vin: str, record: Dict[str, Any], now: float):
+        self.next_due[vin] = now + self.intervals[classify_record(record)]
+
+    def refresh_fleet(self, now: float) -> int:
+        """Fetch the fleet list and battery health, adding any new vehicles.
+
+        Only vehicles whose state or health changed since the last refresh are
+        ingested and rescheduled; the others keep their polling schedule.
+        """
+        records, health_map = self.api_manager.fetch_fleet_records(changed_only=True)
+        added = self.fleet.ingest_records(records, health_map)
+        for record in records:
+            self._schedule(record['vin'], record, now)
+        self._next_fleet_refresh = now + self.fleet_refresh
+        return len(added)
+
+    def due_vehicles(self, now: float) -> List[str]:
+        """VINs whose next poll time has passed."""
+        return [vin for vin, due in self.next_due.items() if due <= now]
+
+    def poll_once(self, now: float = None) -> PollCycle:
+        """Run one polling cycle over the vehicles that are due."""
+        now = time.time() if now is None else now
+        started = time.perf_counter()
+        new_vehicles = 0
+        if now >= self._next_fleet_refresh:
+            try:
+                new_vehicles = self.refresh_fleet(now)
+            except (TessieAPIError, SchemaError):
+                # Keep polling the known vehicles; retry the listing on the idle interval.
+                self._next_fleet_refresh = now + self.intervals["idle"]
+                if metrics.enabled:
+                    metrics.count("poll_fleet_refresh_failed")
+
+        due = self.due_vehicles(now)
+        changed = failed = 0
+        if due:
+            details = self.api_manager.fetch_vehicle_details(due, endpoints=("state_record",))
+            for vin, payloads in details.items():
+                record = payloads["state_record"]
+                if isinstance(record, (TessieAPIError, SchemaError)):
+                    failed += 1
+                    self.next_due[vin] = now + self.intervals["idle"]
+                    continue
+                if self.fleet.get_vehicle(vin).ingest_record(record) is not None:
+                    changed += 1
+                self._schedule(vin, record, now)
+        if self.fleet.store.backing is not None:
+            self.fleet.store.flush()
+
+        cycle = PollCycle(
+            started=now,
+            polled=len(due),
+            changed=changed,
+            skipped=len(due) - changed - failed,
+            failed=failed,
+            new_vehicles=new_vehicles,
+            duration=time.perf_counter() - started
+        )
+        if metrics.enabled:
+            metrics.observe("poll_cycle_seconds", cycle.duration)
+            for outcome in ("polled", "changed", "skipped", "failed", "new_vehicles"):
+                metrics.count(f"poll_{outcome}", getattr(cycle, outcome))
+        if self.on_cycle:
+            self.on_cycle(cycle)
+        return cycle
+
+    def run(self, max_cycles: Optional[int] = None):
+        """Poll until stopped, sleeping until the next vehicle is due."""
+        cycles = 0
+        while not self._stop.is_set() and (max_cycles is None or cycles < max_cycles):
+            self.poll_once()
+            cycles += 1
+            wake = min(list(self.next_due.values()) + [self._next_fleet_refresh])
+            self._stop.wait(max(0.0, wake - time.time()))
+
+    def stop(self):
+        """Ask a running poller to exit after the current cycle."""
+        self._stop.set()
+
+
+def main(argv: Optional[List[str]] = None):
+    """Run the fleet poller until interrupted."""
+    from key import API_KEY
+
+    parser = argparse.ArgumentParser(description="Continuously poll the Tessie fleet.")
+    parser.add_argument("--cycles", type=int, default=None, help="stop after this many cycles")
+    parser.add_argument("--fleet-refresh", type=float, default=3600.0,
+                        help="seconds between full fleet and battery health refreshes")
+    parser.add_argument("--history", default="history", help="directory for persisted metrics history")
+    parser.add_argument("--metrics-file", default=None,
+                        help="rewrite runtime metrics here after every cycle (.prom for Prometheus text, else JSON)")
+    parser.add_argument("--cache", default="api_cache.db",
+                        help="SQLite cache for slowly changing endpoints such as battery health ('' to disable)")
+    parser.add_argument("--alerts", default=None,
+                        help="detect efficiency, drain, charging and climate anomalies; append alerts here as JSON lines")
+    args = parser.parse_args(argv)
+    detector = None
+
+    def report(cycle: PollCycle):
+        print(f"polled={cycle.polled} changed={cycle.changed} skipped={cycle.skipped} "
+              f"failed={cycle.failed} new={cycle.new_vehicles} took={cycle.duration:.2f}s")
+        if detector is not None:
+            alerts = detector.update()
+            if alerts:
+                with open(args.alerts, "a") as f:
+                    for alert in alerts:
+                        print(f"ALERT {alert.time:%Y-%m-%d %H:%M} {alert.message}")
+                        f.write(json.dumps(alert.to_dict()) + "\n")
+        if args.metrics_file:
+            metrics.export(args.metrics_file)
+
+    metrics.enable(bool(args.metrics_file))
+    cache = ResponseCache(args.cache) if args.cache else None
+    with TessieAPIManager(api_key=API_KEY, cache=cache) as api_manager:
+        fleet = FleetAnalytics.from_store(MetricsStore(backing=SegmentStore(args.history)))
+        track_store(fleet.store)
+        if args.alerts:
+            detector = AnomalyDetector(fleet.store)
+        poller = FleetPoller(api_manager, fleet, fleet_refresh=args.fleet_refresh, on_cycle=report)
+        try:
+            poller.run(max_cycles=args.cycles)
+        except KeyboardInterrupt:
+            pass
+        print("Fleet Summary:")
+        for key, value in poller.fleet.get_fleet_summary().items():
+            print(f"{key}: {value}")
+    if cache is not None:
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
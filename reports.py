@@ -0,0 +1,434 @@
+import html
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Tuple
+import numpy as np
+import pandas as pd
+from vehicle import Vehicle
+from analysis import EnergyAndCostAnalyzer, latest_frame
+from instrumentation import span, timed
+from rollups import Interval, parse_interval
+from snapshot import format_energy_report
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# VIN position 10 model-year codes: 2001-2009 are digits, 2010-2030 letters (no I, O, Q, U, Z).
+MODEL_YEARS: Dict[str, int] = {
+    **{str(digit): 2000 + digit for digit in range(1, 10)},
+    **{code: 2010 + offset for offset, code in enumerate("ABCDEFGHJKLMNPRSTVWXY")},
+}
+# Bands are (edges, labels); ages are whole years, so age bands include their upper edge.
+AGE_BANDS = ([-np.inf, 1, 3, 5, np.inf], ["0-1 years", "2-3 years", "4-5 years", "6+ years"])
+HEALTH_BANDS = ([-np.inf, 80, 85, 90, 95, np.inf], ["<80%", "80-85%", "85-90%", "90-95%", "95%+"])
+UNKNOWN = "unknown"
+
+# Cohort name -> grouping columns of the per-vehicle table.
+COHORTS: Dict[str, List[str]] = {
+    "fleet": ["fleet"],
+    "model": ["model"],
+    "trim": ["model", "trim"],
+    "age": ["age_band"],
+    "health": ["health_band"],
+}
+PERCENTILE_FIELDS = ("efficiency", "cost_per_mile", "health_percent")
+PERCENTILES = (10, 50, 90)
+
+VEHICLE_COLUMNS = [
+    "vin", "name", "model", "trim", "model_year", "age_band", "health_percent", "health_band",
+    "degradation_percent", "odometer", "battery_level", "total_miles", "total_energy", "efficiency",
+    "total_cost", "cost_per_mile", "source", "period_miles", "period_kwh", "period_efficiency",
+    "previous_period_miles", "previous_period_kwh", "previous_period_efficiency",
+]
+# Display precision for Markdown/HTML (CSV, JSON and Parquet keep full precision).
+CELL_FORMATS = {
+    "efficiency": "{:.3f}", "cost_per_mile": "{:.3f}", "period_efficiency": "{:.3f}",
+    "previous_period_efficiency": "{:.3f}", "model_year": "{:.0f}", "vehicles": "{:.0f}",
+}
+DEFAULT_CELL_FORMAT = "{:,.2f}"
+CHUNK_ROWS = 5000
+
+FORMATS = ("csv", "json", "parquet", "md", "html", "txt")
+DEFAULT_FORMATS = tuple(fmt for fmt in FORMATS if fmt != "parquet" or pq is not None)
+
+
+def model_years(vins: Sequence[str]) -> np.ndarray:
+    """Model year of each VIN from its 10th character (NaN if unrecognized)."""
+    codes = pd.Series(vins, dtype=object).str[9]
+    return codes.map(MODEL_YEARS).to_numpy(dtype=np.float64)
+
+
+def _band(values: np.ndarray, bands: Tuple[List[float], List[str]], right: bool = False) -> pd.Categorical:
+    """Values binned into labelled bands, with NaN in an ``unknown`` band."""
+    edges, labels = bands
+    binned = pd.cut(values, edges, labels=labels, right=right)
+    return binned.add_categories([UNKNOWN]).fillna(UNKNOWN)
+
+
+def _edge_value(chunks: Iterator[Dict[str, np.ndarray]], field: str, last: bool = False) -> float:
+    """The first (or last) valid value of a field in a stream of column chunks, or NaN."""
+    for chunk in chunks:
+        valid = np.flatnonzero(~np.isnan(chunk[field]))
+        if len(valid):
+            return float(chunk[field][valid[-1] if last else valid[0]])
+    return np.nan
+
+
+def period_deltas(vehicles: Sequence[Vehicle], field: str, bounds: Sequence[int]) -> np.ndarray:
+    """Change of a metric per vehicle (rows) over consecutive windows of ``bounds`` (ms, columns).
+
+    Each change is the last minus the first valid sample in the window, so
+    only the history segments at the window edges are read.
+    """
+    deltas = np.full((len(vehicles), len(bounds) - 1), np.nan)
+    for position, vehicle in enumerate(vehicles):
+        store, vin = vehicle.store, vehicle.vin
+        for window, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:])):
+            first = _edge_value(store.iter_columns(vin, (field,), lo, hi), field)
+            if first == first:
+                last = _edge_value(store.iter_columns(vin, (field,), lo, hi, reverse=True), field, last=True)
+                deltas[position, window] = last - first
+    return deltas
+
+
+@dataclass
+class CohortReport:
+    """One computed fleet comparison, rendered to every export format.
+
+    ``vehicles`` has one row per vehicle (VEHICLE_COLUMNS), ranked by
+    efficiency with undriven vehicles last; ``cohorts`` holds one table
+    per COHORTS entry; ``energy`` is the report_data() of the text report.
+    """
+    generated: float
+    period_start: int
+    period_end: int
+    period_ms: int
+    vehicles: pd.DataFrame
+    cohorts: Dict[str, pd.DataFrame]
+    energy: Dict[str, Any]
+
+    @property
+    def summary(self) -> Dict[str, Any]:
+        return self.energy["metrics"]["fleet_summary"]
+
+    def period(self) -> Dict[str, str]:
+        """Current and previous period bounds as ISO times."""
+        def iso(ms: int) -> str:
+            return datetime.fromtimestamp(ms / 1000).isoformat(timespec="seconds")
+        return {
+            "start": iso(self.period_start),
+            "end": iso(self.period_end),
+            "previous_start": iso(self.period_start - self.period_ms),
+        }
+
+    def cohort_table(self) -> pd.DataFrame:
+        """All cohorts in one long table, keyed by ``cohort`` and ``group``."""
+        parts = []
+        for name, table in self.cohorts.items():
+            keys = COHORTS[name]
+            group = table[keys].astype(str).agg(" / ".join, axis=1) if len(table) else pd.Series(dtype=object)
+            parts.append(table.drop(columns=keys).assign(cohort=name, group=group.to_numpy()))
+        long = pd.concat(parts, ignore_index=True)
+        return long[["cohort", "group"] + [c for c in long.columns if c not in ("cohort", "group")]]
+
+    def vehicle_chunks(self, rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+        """The per-vehicle table in slices of ``rows``, for streaming writers."""
+        for lo in range(0, len(self.vehicles), rows):
+            yield self.vehicles.iloc[lo:lo + rows]
+
+
+def cohort_stats(table: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    """Counts, totals, percentiles and period-over-period changes per group of ``keys``."""
+    grouped = table.groupby(keys, observed=True, dropna=False, sort=True)
+    stats = grouped.agg(
+        vehicles=("vin", "size"),
+        total_miles=("total_miles", "sum"),
+        total_energy=("total_energy", "sum"),
+        total_cost=("total_cost", "sum"),
+        period_miles=("period_miles", "sum"),
+        period_kwh=("period_kwh", "sum"),
+        previous_period_miles=("previous_period_miles", "sum"),
+        previous_period_kwh=("previous_period_kwh", "sum"),
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        stats["efficiency"] = stats["total_energy"] / stats["total_miles"]
+        stats["cost_per_mile"] = stats["total_cost"] / stats["total_miles"]
+        stats["period_efficiency"] = stats["period_kwh"] / stats["period_miles"]
+        stats["previous_period_efficiency"] = stats["previous_period_kwh"] / stats["previous_period_miles"]
+        stats["miles_change_pct"] = (stats["period_miles"] / stats["previous_period_miles"] - 1) * 100
+        stats["efficiency_change_pct"] = (stats["period_efficiency"] / stats["previous_period_efficiency"] - 1) * 100
+    stats = stats.replace([np.inf, -np.inf], np.nan)
+
+    quantiles = grouped[list(PERCENTILE_FIELDS)].quantile([q / 100 for q in PERCENTILES]).unstack()
+    for field in PERCENTILE_FIELDS:
+        for q in PERCENTILES:
+            stats[f"{field}_p{q}"] = quantiles[(field, q / 100)]
+
+    stats = stats.reset_index()
+    for key in keys:
+        stats[key] = stats[key].astype(object).where(stats[key].notna(), UNKNOWN)
+    return stats
+
+
+class CohortReportBuilder:
+    """Computes a CohortReport once from the store, for every export format to share.
+
+    Latest values, efficiency and cost come from one pass over the store
+    columns (the same frame feeds the text report's metrics); age bands come
+    from the VIN model year, health bands from BatteryHealth, and the period
+    deltas from the stored history over the trailing ``period`` and the one before.
+    """
+    def __init__(self, vehicles: List[Vehicle], analyzer: EnergyAndCostAnalyzer = None,
+                 period: Interval = "7d"):
+        self.vehicles = vehicles
+        self.analyzer = analyzer if analyzer is not None else EnergyAndCostAnalyzer(vehicles)
+        self.period_ms = parse_interval(period)
+
+    @timed("cohort_report")
+    def build(self, end: int = None) -> CohortReport:
+        """Compute the report for the period ending at ``end`` (ms; default: the latest snapshot)."""
+        base = latest_frame(self.vehicles, ("timestamp", "health_percent", "degradation_percent"))
+        if end is None:
+            end = int(base["timestamp"].max()) + 1 if len(base) else int(time.time() * 1000)
+        start = end - self.period_ms
+
+        driven = self.analyzer.efficiency_frame(base)
+        metrics = self.analyzer.calculate_efficiency_metrics(driven)
+        table = pd.concat([driven, base[~base["vin"].isin(driven["vin"])]], ignore_index=True)
+
+        report_year = datetime.fromtimestamp(end / 1000).year
+        table["model_year"] = model_years(table["vin"].to_numpy())
+        table["age_band"] = _band((report_year - table["model_year"]).to_numpy(), AGE_BANDS, right=True)
+        table["health_band"] = _band(table["health_percent"].to_numpy(), HEALTH_BANDS)
+        table["fleet"] = "all"
+
+        by_vin = {vehicle.vin: vehicle for vehicle in self.vehicles}
+        ordered = [by_vin[vin] for vin in table["vin"]]
+        # Energy deltas are only read where totals use lifetime energy; the others are estimated.
+        bounds = (start - self.period_ms, start, end)
+        actual = np.flatnonzero(table["source"].to_numpy() == "Actual")
+        miles = period_deltas(ordered, "odometer", bounds)
+        energy = np.full_like(miles, np.nan)
+        energy[actual] = period_deltas([ordered[i] for i in actual], "lifetime_energy_used", bounds)
+        kwh = np.where(np.isnan(energy), miles * table["efficiency"].to_numpy()[:, None], energy)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            efficiency = np.where(miles > 0, kwh / miles, np.nan)
+        for column, prefix in ((1, ""), (0, "previous_")):
+            table[f"{prefix}period_miles"] = miles[:, column]
+            table[f"{prefix}period_kwh"] = kwh[:, column]
+            table[f"{prefix}period_efficiency"] = efficiency[:, column]
+
+        cohorts = {name: cohort_stats(table, keys) for name, keys in COHORTS.items()}
+        return CohortReport(
+            generated=time.time(),
+            period_start=start,
+            period_end=end,
+            period_ms=self.period_ms,
+            vehicles=table[VEHICLE_COLUMNS],
+            cohorts=cohorts,
+            energy=self.analyzer.report_data(metrics),
+        )
+
+
+def _native(value: Any) -> Any:
+    """A JSON-ready scalar: numpy values unwrapped, NaN as None."""
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+def _summary_lines(summary: Dict[str, Any]) -> Iterator[Tuple[str, str]]:
+    """(label, display value) of each fleet summary entry."""
+    for key, value in summary.items():
+        value = _native(value)
+        yield key.replace("_", " ").capitalize(), f"{value:,}" if isinstance(value, int) else f"{value:,.3f}"
+
+
+def _cells(frame: pd.DataFrame) -> List[List[str]]:
+    """Display strings of a table, column by column (empty for missing values)."""
+    columns = []
+    for name in frame.columns:
+        values = frame[name].to_numpy(dtype=object)
+        if pd.api.types.is_float_dtype(frame[name].dtype):
+            fmt = CELL_FORMATS.get(name, DEFAULT_CELL_FORMAT)
+            columns.append(["" if v != v else fmt.format(v) for v in values])
+        else:
+            columns.append(["" if v is None or v != v else str(v) for v in values])
+    return [list(row) for row in zip(*columns)]
+
+
+def write_csv(report: CohortReport, base: str) -> List[str]:
+    """``<base>_cohorts.csv`` and ``<base>_vehicles.csv`` (written in chunks)."""
+    cohorts, vehicles = f"{base}_cohorts.csv", f"{base}_vehicles.csv"
+    report.cohort_table().to_csv(cohorts, index=False)
+    report.vehicles.to_csv(vehicles, index=False, chunksize=CHUNK_ROWS)
+    return [cohorts, vehicles]
+
+
+def write_json(report: CohortReport, base: str) -> List[str]:
+    """``<base>.json``; the vehicles array is streamed chunk by chunk."""
+    filename = f"{base}.json"
+    header = {
+        "generated": report.generated,
+        "period": report.period(),
+        "summary": report.summary,
+        "cohorts": {
+            name: [{key: _native(value) for key, value in row.items()} for row in table.to_dict("records")]
+            for name, table in report.cohorts.items()
+        },
+    }
+    with open(filename, "w") as f:
+        f.write(json.dumps(header, default=_native)[:-1])
+        f.write(',"vehicles":[')
+        for position, chunk in enumerate(report.vehicle_chunks()):
+            if position:
+                f.write(",")
+            f.write(chunk.to_json(orient="records")[1:-1])
+        f.write("]}")
+    return [filename]
+
+
+def write_parquet(report: CohortReport, base: str) -> List[str]:
+    """``<base>_cohorts.parquet`` and ``<base>_vehicles.parquet`` (one row group per chunk)."""
+    if pq is None:
+        raise ImportError("Parquet export requires pyarrow")
+    cohorts, vehicles = f"{base}_cohorts.parquet", f"{base}_vehicles.parquet"
+    pq.write_table(pa.Table.from_pandas(report.cohort_table(), preserve_index=False), cohorts)
+    writer = None
+    try:
+        for chunk in report.vehicle_chunks():
+            table = pa.Table.from_pandas(chunk, preserve_index=False,
+                                         schema=writer.schema if writer is not None else None)
+            if writer is None:
+                writer = pq.ParquetWriter(vehicles, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    return [cohorts, vehicles]
+
+
+def _markdown_rows(frame: pd.DataFrame) -> Iterator[str]:
+    for row in _cells(frame):
+        yield "| " + " | ".join(cell.replace("|", "\\|") for cell in row) + " |\n"
+
+
+def _markdown_header(columns: Sequence[str]) -> str:
+    return "| " + " | ".join(columns) + " |\n|" + "---|" * len(columns) + "\n"
+
+
+def write_markdown(report: CohortReport, base: str) -> List[str]:
+    """``<base>.md``: fleet summary, one table per cohort, then the vehicle ranking."""
+    filename = f"{base}.md"
+    period = report.period()
+    with open(filename, "w") as f:
+        f.write("# Fleet Comparison and Cohort Report\n\n")
+        f.write(f"Period: {period['start']} to {period['end']} (previous from {period['previous_start']})\n\n")
+        for label, value in _summary_lines(report.summary):
+            f.write(f"- {label}: {value}\n")
+        for name, table in report.cohorts.items():
+            f.write(f"\n## By {name}\n\n")
+            f.write(_markdown_header(table.columns))
+            f.writelines(_markdown_rows(table))
+        f.write("\n## Vehicles\n\n")
+        f.write(_markdown_header(report.vehicles.columns))
+        for chunk in report.vehicle_chunks():
+            f.writelines(_markdown_rows(chunk))
+    return [filename]
+
+
+HTML_HEAD = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Fleet Comparison and Cohort Report</title>
+<style>
+body { font-family: sans-serif; margin: 2em; }
+table { border-collapse: collapse; margin-bottom: 2em; font-size: 0.85em; }
+th, td { border: 1px solid #ccc; padding: 0.25em 0.5em; text-align: right; }
+th { background: #f3f3f3; }
+</style></head><body>
+"""
+
+
+def _html_rows(frame: pd.DataFrame) -> Iterator[str]:
+    for row in _cells(frame):
+        yield "<tr>" + "".join(f"<td>{html.escape(cell)}</td>" for cell in row) + "</tr>\n"
+
+
+def _html_header(columns: Sequence[str]) -> str:
+    return "<table><thead><tr>" + "".join(f"<th>{html.escape(c)}</th>" for c in columns) + "</tr></thead><tbody>\n"
+
+
+def write_html(report: CohortReport, base: str) -> List[str]:
+    """``<base>.html``: the same sections as the Markdown report, as static tables."""
+    filename = f"{base}.html"
+    period = report.period()
+    with open(filename, "w") as f:
+        f.write(HTML_HEAD)
+        f.write("<h1>Fleet Comparison and Cohort Report</h1>\n")
+        f.write(f"<p>Period: {period['start']} to {period['end']} (previous from {period['previous_start']})</p>\n<ul>\n")
+        for label, value in _summary_lines(report.summary):
+            f.write(f"<li>{html.escape(label)}: {value}</li>\n")
+        f.write("</ul>\n")
+        for name, table in report.cohorts.items():
+            f.write(f"<h2>By {html.escape(name)}</h2>\n")
+            f.write(_html_header(table.columns))
+            f.writelines(_html_rows(table))
+            f.write("</tbody></table>\n")
+        f.write("<h2>Vehicles</h2>\n")
+        f.write(_html_header(report.vehicles.columns))
+        for chunk in report.vehicle_chunks():
+            f.writelines(_html_rows(chunk))
+        f.write("</tbody></table>\n</body></html>\n")
+    return [filename]
+
+
+def write_text(report: CohortReport, base: str) -> List[str]:
+    """``<base>.txt``: the energy efficiency and cost report."""
+    filename = f"{base}.txt"
+    with open(filename, "w") as f:
+        f.write(format_energy_report(**report.energy))
+    return [filename]
+
+
+WRITERS: Dict[str, Callable[[CohortReport, str], List[str]]] = {
+    "csv": write_csv,
+    "json": write_json,
+    "parquet": write_parquet,
+    "md": write_markdown,
+    "html": write_html,
+    "txt": write_text,
+}
+
+
+def export_report(report: CohortReport, base: str = "reports/fleet_report",
+                  formats: Sequence[str] = DEFAULT_FORMATS) -> Dict[str, List[str]]:
+    """Write a report in several formats concurrently; returns the files written per format.
+
+    Every writer renders from the same CohortReport, each in its own thread
+    (the CSV, JSON and Parquet encoders spend most of their time outside
+    the GIL, and the rest is file I/O).
+    """
+    unknown = [fmt for fmt in formats if fmt not in WRITERS]
+    if unknown:
+        raise ValueError(f"Unknown report formats {unknown}; use any of {', '.join(FORMATS)}")
+    if "parquet" in formats and pq is None:
+        raise ImportError("Parquet export requires pyarrow")
+    directory = os.path.dirname(base)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    def write(fmt: str) -> List[str]:
+        with span("report_export", format=fmt):
+            return WRITERS[fmt](report, base)
+
+    with ThreadPoolExecutor(max_workers=max(1, len(formats)), thread_name_prefix="report") as pool:
+        futures = {fmt: pool.submit(write, fmt) for fmt in formats}
+        return {fmt: future.result() for fmt, future in futures.items()}
@@ -0,0 +1,183 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from decoding import decode_static, decode_vehicles, decode_volatile, split_vehicles
+from instrumentation import endpoint_label, metrics
+
+# Seconds a response stays fresh, per endpoint label (see instrumentation.endpoint_label).
+# Endpoints not listed (vehicles, {vin}/state) are always fetched.
+DEFAULT_TTLS: Dict[str, float] = {
+    "battery_health": 12 * 3600,
+    "{vin}/battery_health": 12 * 3600,
+    "{vin}/drives": 600,
+    "{vin}/charges": 600,
+}
+DEFAULT_MAX_ENTRIES = 4096
+
+
+def digest(payload: bytes) -> bytes:
+    """Content address of a payload."""
+    return hashlib.blake2b(payload, digest_size=16).digest()
+
+
+def cache_key(path: str, params: Optional[Dict] = None) -> str:
+    path = path.lstrip("/")
+    if not params:
+        return path
+    return path + "?" + "&".join(f"{key}={params[key]}" for key in sorted(params))
+
+
+class ResponseCache:
+    """SQLite-backed cache of raw API responses with per-endpoint TTLs and LRU eviction.
+
+    Bodies are stored with their content digest, fetch time and last use.
+    Only endpoints with a TTL are cached; once more than ``max_entries``
+    responses are stored the least recently used ones are dropped.
+    """
+    def __init__(self, path: str = "api_cache.db", ttls: Dict[str, float] = None,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                digest BLOB NOT NULL,
+                body BLOB NOT NULL,
+                fetched REAL NOT NULL,
+                used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_used ON responses (used);
+        """)
+
+    def ttl(self, path: str) -> float:
+        """Freshness lifetime of an endpoint's responses, in seconds (0: not cached)."""
+        return self.ttls.get(endpoint_label(path), 0)
+
+    def get(self, path: str, params: Dict = None, now: float = None) -> Optional[bytes]:
+        """A fresh cached body for a request, or None."""
+        ttl = self.ttl(path)
+        if ttl <= 0:
+            return None
+        now = time.time() if now is None else now
+        key = cache_key(path, params)
+        with self._lock:
+            row = self.conn.execute("SELECT body, fetched FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] >= ttl:
+                return None
+            self.conn.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+        return row[0]
+
+    def put(self, path: str, params: Dict, body: bytes, now: float = None) -> bool:
+        """Store a fetched body; returns whether its content differs from the cached one."""
+        if self.ttl(path) <= 0:
+            return True
+        now = time.time() if now is None else now
+        key = cache_key(path, params)
+        content = digest(body)
+        with self._lock, self.conn:
+            row = self.conn.execute("SELECT digest FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[0] == content:
+                self.conn.execute("UPDATE responses SET fetched = ?, used = ? WHERE key = ?", (now, now, key))
+                return False
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, endpoint, digest, body, fetched, used) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (key, endpoint_label(path), content, body, now, now))
+            self.conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,))
+        return True
+
+    def invalidate(self, endpoint: str = None):
+        """Drop cached responses of one endpoint label, or all of them."""
+        with self._lock, self.conn:
+            if endpoint is None:
+                self.conn.execute("DELETE FROM responses")
+            else:
+                self.conn.execute("DELETE FROM responses WHERE endpoint = ?", (endpoint,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+class DecodedCache:
+    """Remembers the last decoded value per request, reused while the payload is unchanged."""
+    def __init__(self):
+        self._entries: Dict[str, Tuple[bytes, Any]] = {}
+
+    def decode(self, key: str, payload: bytes, decoder: Callable[[bytes], Any]) -> Tuple[Any, bool]:
+        """(decoded value, whether the payload changed since the last call for ``key``)."""
+        content = digest(payload)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == content:
+            return entry[1], False
+        value = decoder(payload)
+        self._entries[key] = (content, value)
+        return value, True
+
+
+class FleetRecordCache:
+    """Content-addressed decoding of /vehicles responses, vehicle by vehicle.
+
+    Each vehicle's raw state is hashed; only vehicles whose bytes changed
+    since the previous response are decoded, and the others keep their
+    previous record objects. Within a changed state the static
+    vehicle_config is hashed separately and decoded once per distinct
+    config, then merged with the freshly decoded volatile fields. Without
+    msgspec the payload is decoded whole whenever it changes.
+    """
+    def __init__(self):
+        self._states: Dict[str, Tuple[bytes, Dict[str, Any]]] = {}
+        self._configs: Dict[bytes, Dict[str, Any]] = {}
+        self._payload: Optional[bytes] = None
+        self._records: List[Dict[str, Any]] = []
+        self.changed: Set[str] = set()
+
+    def decode(self, payload: bytes) -> List[Dict[str, Any]]:
+        """Records of a /vehicles response; VINs whose records changed are left in ``changed``."""
+        content = digest(payload)
+        if content == self._payload:
+            self.changed = set()
+            return self._records
+
+        vehicles = split_vehicles(payload)
+        if vehicles is None:
+            records = decode_vehicles(payload)
+            previous = {record["vin"]: record for record in self._records}
+            self.changed = {record["vin"] for record in records if previous.get(record["vin"]) != record}
+        else:
+            records, self.changed = [], set()
+            states = {}
+            for vin, raw_state in vehicles:
+                state_digest = digest(raw_state)
+                entry = self._states.get(vin)
+                if entry is None or entry[0] != state_digest:
+                    entry = (state_digest, self._decode_state(vin, raw_state))
+                    self.changed.add(vin)
+                states[vin] = entry
+                records.append(entry[1])
+            self._states = states
+        metrics.count("decoded_vehicles", len(self.changed))
+        metrics.count("reused_vehicles", len(records) - len(self.changed))
+        self._payload, self._records = content, records
+        return records
+
+    def _decode_state(self, vin: str, raw_state: bytes) -> Dict[str, Any]:
+        record, raw_config = decode_volatile(raw_state)
+        config_digest = digest(raw_config)
+        static = self._configs.get(config_digest)
+        if static is None:
+            static = self._configs[config_digest] = decode_static(raw_config)
+        record.update(static)
+        record["vin"] = vin
+        return record
@@ -0,0 +1,386 @@
+import re
+import threading
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Union, TYPE_CHECKING
+import numpy as np
+from metrics_store import TimeBound, to_epoch_ms
+
+if TYPE_CHECKING:
+    from metrics_store import MetricsStore
+
+# Numeric fields summarized in the rollups (is_active averages to the share of time awake).
+ROLLUP_FIELDS = ("battery_level", "battery_range", "lifetime_energy_used", "speed", "power",
+                 "odometer", "inside_temp", "outside_temp", "is_active")
+# Bucket widths, finest first.
+LEVELS = {"1min": 60_000, "1h": 3_600_000, "1d": 86_400_000}
+STATS = ("count", "sum", "min", "max", "first", "last")
+AGGREGATES = ("mean", "min", "max", "sum", "count", "first", "last", "delta")
+INTERVAL_UNITS = {"ms": 1, "s": 1000, "min": 60_000, "h": 3_600_000, "d": 86_400_000, "w": 604_800_000}
+
+Interval = Union[int, str]
+Stats = Dict[str, np.ndarray]
+
+
+def parse_interval(interval: Interval) -> int:
+    """An interval in ms, from ms or a string such as ``"15min"``, ``"1h"`` or ``"7d"``."""
+    if isinstance(interval, str):
+        match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*(ms|s|min|h|d|w)\s*", interval)
+        if match is None:
+            raise ValueError(f"Unrecognized interval: {interval!r}")
+        return int(float(match.group(1)) * INTERVAL_UNITS[match.group(2)])
+    return int(interval)
+
+
+def _percentile(agg: str) -> Optional[float]:
+    """The q of a ``"p<q>"`` aggregate (e.g. ``"p95"``), or None for other aggregates."""
+    match = re.fullmatch(r"p(\d+(?:\.\d+)?)", agg)
+    if match is None:
+        if agg not in AGGREGATES:
+            raise ValueError(f"Unknown aggregate {agg!r}; use one of {', '.join(AGGREGATES)} or p<q>")
+        return None
+    return float(match.group(1))
+
+
+def align(start: Optional[int], end: Optional[int], every: int) -> Tuple[Optional[int], Optional[int]]:
+    """Widen [start, end) to whole ``every``-wide buckets."""
+    return (None if start is None else start // every * every,
+            None if end is None else -(-end // every) * every)
+
+
+def raw_stats(values: np.ndarray) -> Stats:
+    """Per-sample stats, so raw samples and rollup buckets reduce the same way."""
+    valid = ~np.isnan(values)
+    return {"count": valid.astype(np.int64), "sum": np.where(valid, values, 0.0),
+            "min": values, "max": values, "first": values, "last": values}
+
+
+def reduce_stats(stats: Stats, starts: np.ndarray) -> Stats:
+    """Combine consecutive groups of rows beginning at ``starts`` (works on 1-D or 2-D stats)."""
+    n = len(stats["count"])
+    rows = np.arange(n).reshape((-1,) + (1,) * (stats["count"].ndim - 1))
+    padded = lambda values: np.concatenate([values, np.full((1,) + values.shape[1:], np.nan)])
+    first_row = np.minimum.reduceat(np.where(np.isnan(stats["first"]), n, rows), starts, axis=0)
+    last_row = np.maximum.reduceat(np.where(np.isnan(stats["last"]), -1, rows), starts, axis=0)
+    return {
+        "count": np.add.reduceat(stats["count"], starts, axis=0),
+        "sum": np.add.reduceat(stats["sum"], starts, axis=0),
+        "min": np.fmin.reduceat(stats["min"], starts, axis=0),
+        "max": np.fmax.reduceat(stats["max"], starts, axis=0),
+        # Row n (and -1) of the padded values is NaN: groups without a valid value.
+        "first": np.take_along_axis(padded(stats["first"]), first_row, axis=0),
+        "last": np.take_along_axis(padded(stats["last"]), last_row, axis=0),
+    }
+
+
+def finish_stats(stats: Stats, agg: str) -> np.ndarray:
+    """Turn reduced stats into one aggregate."""
+    if agg == "mean":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(stats["count"] > 0, stats["sum"] / stats["count"], np.nan)
+    if agg == "delta":
+        return stats["last"] - stats["first"]
+    if agg == "sum":
+        return np.where(stats["count"] > 0, stats["sum"], np.nan)
+    return stats[agg]
+
+
+def group_percentile(values: np.ndarray, groups: np.ndarray, q: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Linearly interpolated q-th percentile of ``values`` per group; returns (groups, percentiles).
+
+    One lexsort orders every group at once; NaN values are ignored.
+    """
+    keep = ~np.isnan(values)
+    values, groups = values[keep], groups[keep]
+    order = np.lexsort((values, groups))
+    values, groups = values[order], groups[order]
+    unique, starts, counts = np.unique(groups, return_index=True, return_counts=True)
+    position = starts + q / 100 * (counts - 1)
+    lo = np.floor(position).astype(np.int64)
+    hi = np.ceil(position).astype(np.int64)
+    return unique, values[lo] + (values[hi] - values[lo]) * (position - lo)
+
+
+class _Buckets:
+    """Growable fixed-width time buckets of stats for every rollup field of one VIN."""
+    def __init__(self, width: int, n_fields: int, capacity: int = 16):
+        self.width = width
+        self.size = 0
+        self.start = np.empty(capacity, dtype=np.int64)
+        self.stats = {name: np.empty((capacity, n_fields), dtype=np.int64 if name == "count" else np.float64)
+                      for name in STATS}
+
+    def _reserve(self, extra: int):
+        capacity = len(self.start)
+        if self.size + extra <= capacity:
+            return
+        capacity = max(capacity * 2, self.size + extra)
+        start = np.empty(capacity, dtype=np.int64)
+        start[:self.size] = self.start[:self.size]
+        self.start = start
+        for name, values in self.stats.items():
+            grown = np.empty((capacity,) + values.shape[1:], dtype=values.dtype)
+            grown[:self.size] = values[:self.size]
+            self.stats[name] = grown
+
+    def fold(self, timestamps: np.ndarray, stats: Stats):
+        """Add time-ordered rows (all later than anything folded before)."""
+        bucket = timestamps // self.width * self.width
+        starts = np.concatenate([[0], np.flatnonzero(bucket[1:] != bucket[:-1]) + 1])
+        new_start = bucket[starts]
+        new = reduce_stats(stats, starts)
+        if self.size and new_start[0] == self.start[self.size - 1]:
+            # The first new bucket continues the last stored one.
+            last = self.size - 1
+            merged = reduce_stats({name: np.stack([self.stats[name][last], new[name][0]]) for name in STATS},
+                                  np.array([0]))
+            for name in STATS:
+                self.stats[name][last] = merged[name][0]
+            new_start = new_start[1:]
+            new = {name: values[1:] for name, values in new.items()}
+        count = len(new_start)
+        self._reserve(count)
+        self.start[self.size:self.size + count] = new_start
+        for name in STATS:
+            self.stats[name][self.size:self.size + count] = new[name]
+        self.size += count
+
+    def bounds(self, start: Optional[int], end: Optional[int]) -> Tuple[int, int]:
+        """Bucket index range whose bucket start lies in [start, end)."""
+        starts = self.start[:self.size]
+        lo = 0 if start is None else int(np.searchsorted(starts, start, side="left"))
+        hi = self.size if end is None else int(np.searchsorted(starts, end, side="left"))
+        return lo, hi
+
+    def field_stats(self, field: int, lo: int, hi: int) -> Stats:
+        return {name: values[lo:hi, field] for name, values in self.stats.items()}
+
+
+class RollupStore:
+    """Multi-resolution rollups (1 min, 1 h, 1 day) of a MetricsStore, with time-series queries.
+
+    The store's append events mark VINs dirty; before a VIN is queried only
+    its rows newer than the last folded timestamp are read (chunk by chunk,
+    including persisted history the first time) and folded into every
+    level. Window queries are answered from the coarsest buckets that fit
+    inside the window plus finer buckets and raw samples at its ragged
+    edges, so a year of minute data costs a few hundred bucket rows.
+    Percentiles cannot be combined from buckets and are read from raw samples.
+    """
+    def __init__(self, store: "MetricsStore", fields: Sequence[str] = ROLLUP_FIELDS,
+                 levels: Dict[str, int] = None):
+        self.store = store
+        self.fields = tuple(fields)
+        self.levels = dict(sorted((levels or LEVELS).items(), key=lambda item: item[1]))
+        self._field_index = {name: i for i, name in enumerate(self.fields)}
+        self._buckets: Dict[str, Dict[str, _Buckets]] = {}
+        self._folded: Dict[str, int] = {}
+        self._dirty: Set[str] = set()
+        self._lock = threading.Lock()
+        store.subscribe(self._on_append)
+
+    def _on_append(self, vin: str):
+        self._dirty.add(vin)
+
+    def _values(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        return np.column_stack([columns[name].astype(np.float64) for name in self.fields])
+
+    def sync(self, vin: str) -> Dict[str, _Buckets]:
+        """Fold a VIN's rows appended since the last sync; returns its buckets per level."""
+        with self._lock:
+            buckets = self._buckets.get(vin)
+            if buckets is not None and vin not in self._dirty:
+                return buckets
+            self._dirty.discard(vin)
+            if buckets is None:
+                buckets = self._buckets[vin] = {name: _Buckets(width, len(self.fields))
+                                                for name, width in self.levels.items()}
+            folded = self._folded.get(vin)
+            start = None if folded is None else folded + 1
+            for chunk in self.store.iter_columns(vin, ("timestamp",) + self.fields, start):
+                timestamps = chunk["timestamp"]
+                if folded is not None:
+                    newer = timestamps > folded
+                    timestamps, chunk = timestamps[newer], {k: v[newer] for k, v in chunk.items()}
+                if not len(timestamps):
+                    continue
+                stats = raw_stats(self._values(chunk))
+                for level in buckets.values():
+                    level.fold(timestamps, stats)
+                folded = int(timestamps[-1])
+            if folded is not None:
+                self._folded[vin] = folded
+            return buckets
+
+    def buckets(self, vin: str, field: str, level: str, start: TimeBound = None,
+                end: TimeBound = None) -> Dict[str, np.ndarray]:
+        """Rollup rows of one field at one level: ``timestamp`` (bucket start) plus each stat."""
+        level_buckets = self.sync(vin)[level]
+        lo, hi = level_buckets.bounds(to_epoch_ms(start), to_epoch_ms(end))
+        rows = {"timestamp": level_buckets.start[lo:hi].copy()}
+        rows.update((name, values.copy()) for name, values in
+                    level_buckets.field_stats(self._field_index[field], lo, hi).items())
+        return rows
+
+    def raw(self, vin: str, field: str, start: Optional[int], end: Optional[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Raw (timestamps, values) of one field over [start, end), as float64."""
+        timestamps, values = [], []
+        for chunk in self.store.iter_columns(vin, ("timestamp", field), start, end):
+            timestamps.append(chunk["timestamp"])
+            values.append(chunk[field].astype(np.float64))
+        if not timestamps:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        return np.concatenate(timestamps), np.concatenate(values)
+
+    def _cover(self, start: int, end: int, level: int) -> List[Tuple[Optional[str], int, int]]:
+        """Split [start, end) into (level name or None for raw, start, end) pieces, in time order."""
+        if start >= end:
+            return []
+        names = list(self.levels)
+        if level < 0:
+            return [(None, start, end)]
+        width = self.levels[names[level]]
+        aligned_start = -(-start // width) * width
+        aligned_end = end // width * width
+        if aligned_start >= aligned_end:
+            return self._cover(start, end, level - 1)
+        return (self._cover(start, aligned_start, level - 1) + [(names[level], aligned_start, aligned_end)]
+                + self._cover(aligned_end, end, level - 1))
+
+    def window_stats(self, vin: str, field: str, start: TimeBound = None, end: TimeBound = None) -> Stats:
+        """Stats of one field over [start, end), combined from rollups and raw edges."""
+        buckets = self.sync(vin)
+        finest = next(iter(buckets.values()))
+        start_ms, end_ms = to_epoch_ms(start), to_epoch_ms(end)
+        if finest.size == 0:
+            return {name: np.array(0 if name == "count" else np.nan) for name in STATS}
+        if start_ms is None:
+            start_ms = int(finest.start[0])
+        if end_ms is None:
+            end_ms = self._folded[vin] + 1
+
+        index = self._field_index[field]
+        parts = []
+        for level, lo_ms, hi_ms in self._cover(start_ms, end_ms, len(self.levels) - 1):
+            if level is None:
+                _, values = self.raw(vin, field, lo_ms, hi_ms)
+                part = raw_stats(values)
+            else:
+                lo, hi = buckets[level].bounds(lo_ms, hi_ms)
+                part = buckets[level].field_stats(index, lo, hi)
+            if len(part["count"]):
+                parts.append(part)
+        if not parts:
+            return {name: np.array(0 if name == "count" else np.nan) for name in STATS}
+        combined = {name: np.concatenate([part[name] for part in parts]) for name in STATS}
+        return {name: values[0] for name, values in reduce_stats(combined, np.array([0])).items()}
+
+    def window(self, vin: str, fields: Union[str, Sequence[str]], start: TimeBound = None,
+               end: TimeBound = None, aggs: Sequence[str] = ("mean",)) -> Dict[str, Dict[str, float]]:
+        """Aggregates of each field over [start, end): ``{field: {agg: value}}``."""
+        fields = [fields] if isinstance(fields, str) else list(fields)
+        result = {}
+        for field in fields:
+            stats = self.window_stats(vin, field, start, end)
+            values = {}
+            for agg in aggs:
+                q = _percentile(agg)
+                if q is None:
+                    values[agg] = float(finish_stats(stats, agg))
+                else:
+                    _, raw = self.raw(vin, field, to_epoch_ms(start), to_epoch_ms(end))
+                    raw = raw[~np.isnan(raw)]
+                    values[agg] = float(np.percentile(raw, q)) if len(raw) else float("nan")
+            result[field] = values
+        return result
+
+    def resample_stats(self, vin: str, field: str, every: Interval, start: TimeBound = None,
+                       end: TimeBound = None) -> Tuple[np.ndarray, Stats]:
+        """(bucket starts, stats) of one field in ``every``-wide buckets, from the coarsest level that divides it.
+
+        Buckets are aligned to multiples of ``every`` since the epoch (UTC),
+        and ``start``/``end`` are widened to whole buckets.
+        """
+        every_ms = parse_interval(every)
+        start_ms, end_ms = align(to_epoch_ms(start), to_epoch_ms(end), every_ms)
+        widths = [(name, width) for name, width in self.levels.items() if every_ms % width == 0]
+        if widths:
+            level, width = widths[-1]
+            level_buckets = self.sync(vin)[level]
+            lo, hi = level_buckets.bounds(start_ms, end_ms)
+            timestamps = level_buckets.start[lo:hi]
+            stats = level_buckets.field_stats(self._field_index[field], lo, hi)
+        else:
+            timestamps, values = self.raw(vin, field, start_ms, end_ms)
+            stats = raw_stats(values)
+        if not len(timestamps):
+            return np.empty(0, dtype=np.int64), {name: values[:0] for name, values in stats.items()}
+        bucket = timestamps // every_ms * every_ms
+        starts = np.concatenate([[0], np.flatnonzero(bucket[1:] != bucket[:-1]) + 1])
+        return bucket[starts], reduce_stats(stats, starts)
+
+    def resample(self, vin: str, field: str, every: Interval, aggs: Sequence[str] = ("mean",),
+                 start: TimeBound = None, end: TimeBound = None) -> Dict[str, np.ndarray]:
+        """``timestamp`` (bucket start) and one array per aggregate, for buckets holding data."""
+        timestamps, stats = self.resample_stats(vin, field, every, start, end)
+        result = {"timestamp": timestamps}
+        for agg in aggs:
+            q = _percentile(agg)
+            if q is None:
+                result[agg] = finish_stats(stats, agg)
+                continue
+            every_ms = parse_interval(every)
+            raw_ts, raw = self.raw(vin, field, *align(to_epoch_ms(start), to_epoch_ms(end), every_ms))
+            groups, values = group_percentile(raw, raw_ts // every_ms * every_ms, q)
+            result[agg] = np.full(len(timestamps), np.nan)
+            result[agg][np.searchsorted(timestamps, groups)] = values
+        return result
+
+    def rolling(self, vin: str, field: str, window: Interval, every: Interval, agg: str = "mean",
+                start: TimeBound = None, end: TimeBound = None) -> Dict[str, np.ndarray]:
+        """Trailing-window aggregate evaluated every ``every`` (window a multiple of every).
+
+        Sums, counts and means use differences of cumulative sums over the
+        resampled grid; ``delta`` differences the carried-forward last value;
+        min and max slide over the grid.
+        """
+        every_ms, window_ms = parse_interval(every), parse_interval(window)
+        if window_ms % every_ms:
+            raise ValueError("window must be a multiple of every")
+        timestamps, stats = self.resample_stats(vin, field, every_ms, start, end)
+        if not len(timestamps):
+            return {"timestamp": timestamps, agg: np.empty(0)}
+        # Dense grid so a window is a fixed number of slots.
+        grid = np.arange(timestamps[0], timestamps[-1] + every_ms, every_ms)
+        slot = (timestamps - grid[0]) // every_ms
+        width = window_ms // every_ms
+        dense = {name: np.full(len(grid), 0 if name in ("count", "sum") else np.nan,
+                               dtype=values.dtype) for name, values in stats.items()}
+        for name, values in stats.items():
+            dense[name][slot] = values
+
+        ends = np.arange(1, len(grid) + 1)
+
+        def trailing_sum(values):
+            # Windows near the start cover fewer slots.
+            cumulative = np.concatenate([[0], np.cumsum(values)])
+            return cumulative[ends] - cumulative[np.maximum(ends - width, 0)]
+
+        if agg in ("mean", "sum", "count"):
+            reduced = {"count": trailing_sum(dense["count"]), "sum": trailing_sum(dense["sum"])}
+            values = finish_stats(reduced, agg)
+        elif agg == "delta":
+            # Carry each slot's last value forward, then difference against the
+            # value carried into the slot just before the window.
+            filled = np.maximum.accumulate(np.where(np.isnan(dense["last"]), -1, np.arange(len(grid))))
+            carried = np.where(filled >= 0, dense["last"][np.maximum(filled, 0)], np.nan)
+            baseline = np.concatenate([np.full(width, np.nan), carried])[:len(grid)]
+            valid_first = dense["first"][~np.isnan(dense["first"])]
+            baseline = np.where(np.isnan(baseline), valid_first[0] if len(valid_first) else np.nan, baseline)
+            values = carried - baseline
+        elif agg in ("min", "max"):
+            reducer = np.fmin if agg == "min" else np.fmax
+            fill = np.full(width - 1, np.nan)
+            view = np.lib.stride_tricks.sliding_window_view(np.concatenate([fill, dense[agg]]), width)
+            values = reducer.reduce(view, axis=1)
+        else:
+            raise ValueError(f"Unsupported rolling aggregate {agg!r}")
+        return {"timestamp": grid, agg: values}
@@ -0,0 +1,296 @@
+import json
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from base import BatteryHealth
+from metrics_store import COLUMNS, CATEGORICAL_FIELDS, Categories, TimeBound, to_epoch_ms
+
+# On-disk record layout: the MetricsStore columns packed into one fixed-width row.
+RECORD_DTYPE = np.dtype(COLUMNS)
+FORMAT_VERSION = 1
+DAY_MS = 86_400_000
+HEALTH_FIELDS = tuple(BatteryHealth.__dataclass_fields__)
+
+
+def _atomic_write_json(path: str, data: Any):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _day_name(timestamp_ms: int) -> str:
+    return datetime.fromtimestamp(timestamp_ms / 1000, timezone.utc).strftime("%Y-%m-%d")
+
+
+class SegmentStore:
+    """Append-only, per-VIN, per-day segment files of fixed-width metrics records.
+
+    Layout under ``root``::
+
+        format.json              record layout and version
+        dictionary.json          string tables for categorical codes and battery health
+        <vin>/index.json         min/max timestamp, row count and sort state per segment
+        <vin>/<YYYY-MM-DD>.seg   raw records appended in arrival order
+        <vin>/<YYYY-MM>.seg      compacted month segments
+        <vin>/<name>.<n>.seg     a compacted segment's current file (the index's ``file``)
+
+    Segments are read through ``np.memmap`` so queries touch only the pages they need.
+    """
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._check_format()
+        self.categories: Dict[str, Categories] = {name: Categories() for name in CATEGORICAL_FIELDS}
+        self.health = Categories()
+        self._health_objects: Dict[int, BatteryHealth] = {}
+        self._dirty = False
+        self._load_dictionary()
+        self._indexes: Dict[str, Dict[str, Dict]] = {}
+
+    def _check_format(self):
+        path = os.path.join(self.root, "format.json")
+        descr = [list(field) for field in RECORD_DTYPE.descr]
+        if not os.path.exists(path):
+            _atomic_write_json(path, {"version": FORMAT_VERSION, "dtype": descr})
+            return
+        with open(path) as f:
+            stored = json.load(f)
+        if stored["version"] != FORMAT_VERSION or stored["dtype"] != descr:
+            raise ValueError(f"segment store at {self.root} uses an incompatible record format")
+
+    def _load_dictionary(self):
+        path = os.path.join(self.root, "dictionary.json")
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            dictionary = json.load(f)
+        for name, values in dictionary["categories"].items():
+            for value in values:
+                self.categories[name].encode(value)
+        for values in dictionary["battery_health"]:
+            self.health.encode(tuple(values))
+
+    def _save_dictionary(self):
+        _atomic_write_json(os.path.join(self.root, "dictionary.json"), {
+            "categories": {name: c.values for name, c in self.categories.items()},
+            "battery_health": [list(values) for values in self.health.values],
+        })
+
+    def _index(self, vin: str) -> Dict[str, Dict]:
+        index = self._indexes.get(vin)
+        if index is None:
+            path = os.path.join(self.root, vin, "index.json")
+            index = self._indexes[vin] = {}
+            if os.path.exists(path):
+                with open(path) as f:
+                    index.update(json.load(f))
+                self._recover(vin, index)
+        return index
+
+    def _recover(self, vin: str, index: Dict[str, Dict]):
+        """Reconcile a VIN's segment files with its index after a crash.
+
+        Bytes past a segment's indexed rows (a write whose index save never
+        happened) are truncated, since appends go after the end of the file
+        and leftover rows would shift every later record out of the indexed
+        range. Entries whose file is missing are dropped, and an entry whose
+        file is shorter than indexed is cut to the rows actually on disk, so
+        nothing is memory-mapped past EOF. Segment files no entry refers to
+        hold no committed rows (a crashed compaction or first append) and are
+        removed.
+        """
+        directory = os.path.join(self.root, vin)
+        changed = False
+        for name, meta in list(index.items()):
+            path = os.path.join(directory, meta.get("file", name))
+            size = meta["rows"] * RECORD_DTYPE.itemsize
+            actual = os.path.getsize(path) if os.path.exists(path) else 0
+            if actual > size:
+                os.truncate(path, size)
+            elif actual < size:
+                rows = actual // RECORD_DTYPE.itemsize
+                if rows:
+                    os.truncate(path, rows * RECORD_DTYPE.itemsize)
+                    meta["rows"] = rows
+                else:
+                    del index[name]
+                changed = True
+        referenced = {meta.get("file", name) for name, meta in index.items()}
+        for filename in os.listdir(directory):
+            if filename.endswith((".seg", ".seg.tmp")) and filename not in referenced:
+                os.remove(os.path.join(directory, filename))
+        if changed:
+            self._save_index(vin)
+
+    def _fresh_file(self, vin: str, name: str) -> str:
+        """An unused file name for a new generation of segment ``name`` (``<stem>.<n>.seg``)."""
+        stem, generation = name[:-len(".seg")], 1
+        while os.path.exists(os.path.join(self.root, vin, f"{stem}.{generation}.seg")):
+            generation += 1
+        return f"{stem}.{generation}.seg"
+
+    def _save_index(self, vin: str):
+        _atomic_write_json(os.path.join(self.root, vin, "index.json"), self._index(vin))
+
+    def vins(self) -> List[str]:
+        """VINs that have at least one segment on disk."""
+        return sorted(
+            name for name in os.listdir(self.root)
+            if os.path.exists(os.path.join(self.root, name, "index.json"))
+        )
+
+    def segments(self, vin: str, start: TimeBound = None, end: TimeBound = None) -> List[Tuple[str, Dict]]:
+        """Segments of a VIN overlapping [start, end), ordered by their first timestamp."""
+        start, end = to_epoch_ms(start), to_epoch_ms(end)
+        return sorted(
+            ((name, meta) for name, meta in self._index(vin).items()
+             if meta["rows"] and (start is None or meta["max_ts"] >= start)
+             and (end is None or meta["min_ts"] < end)),
+            key=lambda item: item[1]["min_ts"]
+        )
+
+    def time_range(self, vin: str) -> Optional[Tuple[int, int]]:
+        """Earliest and latest stored timestamp for a VIN."""
+        index = self._index(vin)
+        if not index:
+            return None
+        return min(m["min_ts"] for m in index.values()), max(m["max_ts"] for m in index.values())
+
+    def append(self, vin: str, records: np.ndarray):
+        """Append records (RECORD_DTYPE, disk codes) to the VIN's day segments."""
+        if not len(records):
+            return
+        os.makedirs(os.path.join(self.root, vin), exist_ok=True)
+        index = self._index(vin)
+        days = records["timestamp"] // DAY_MS
+        for day in np.unique(days):
+            chunk = records[days == day]
+            name = f"{_day_name(int(day) * DAY_MS)}.seg"
+            meta = index.get(name)
+            # A segment missing from the index holds no committed rows; start it afresh.
+            filename = meta.get("file", name) if meta is not None else name
+            with open(os.path.join(self.root, vin, filename), 'ab' if meta is not None else 'wb') as f:
+                f.write(chunk.tobytes())
+            timestamps = chunk["timestamp"]
+            in_order = bool(np.all(timestamps[1:] >= timestamps[:-1]))
+            if meta is None:
+                meta = index[name] = {"min_ts": int(timestamps[0]), "max_ts": int(timestamps[0]),
+                                      "rows": 0, "sorted": True}
+            meta["sorted"] = meta["sorted"] and in_order and int(timestamps[0]) >= meta["max_ts"]
+            meta["min_ts"] = min(meta["min_ts"], int(timestamps.min()))
+            meta["max_ts"] = max(meta["max_ts"], int(timestamps.max()))
+            meta["rows"] += len(chunk)
+            self._save_index(vin)
+
+    def _open(self, vin: str, name: str, rows: int) -> np.ndarray:
+        filename = self._index(vin)[name].get("file", name)
+        return np.memmap(os.path.join(self.root, vin, filename), dtype=RECORD_DTYPE, mode='r', shape=(rows,))
+
+    def scan(self, vin: str, start: TimeBound = None, end: TimeBound = None,
+             reverse: bool = False) -> Iterator[np.ndarray]:
+        """Yield memory-mapped record slices per segment, in time order, for [start, end).
+
+        With ``reverse`` the newest segment comes first (records within a
+        slice stay in time order). Unsorted segments (not yet compacted) are
+        filtered with a mask and therefore yielded as copies.
+        """
+        start_ms, end_ms = to_epoch_ms(start), to_epoch_ms(end)
+        segments = self.segments(vin, start_ms, end_ms)
+        for name, meta in reversed(segments) if reverse else segments:
+            records = self._open(vin, name, meta["rows"])
+            timestamps = records["timestamp"]
+            if meta["sorted"]:
+                lo = 0 if start_ms is None else int(np.searchsorted(timestamps, start_ms, side="left"))
+                hi = len(records) if end_ms is None else int(np.searchsorted(timestamps, end_ms, side="left"))
+                yield records[lo:hi]
+            else:
+                mask = np.ones(len(records), dtype=bool)
+                if start_ms is not None:
+                    mask &= timestamps >= start_ms
+                if end_ms is not None:
+                    mask &= timestamps < end_ms
+                yield np.sort(records[mask], order="timestamp", kind="stable")
+
+    def read(self, vin: str, start: TimeBound = None, end: TimeBound = None) -> np.ndarray:
+        """Records for [start, end); zero-copy when the range falls in one sorted segment."""
+        parts = list(self.scan(vin, start, end))
+        if not parts:
+            return np.empty(0, RECORD_DTYPE)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def decode(self, name: str, codes: np.ndarray) -> np.ndarray:
+        """Decode on-disk categorical codes into an object array of strings."""
+        return self.categories[name].decode_array(codes)
+
+    def health_record(self, code: int) -> Optional[BatteryHealth]:
+        """BatteryHealth for an on-disk code; the same object is returned for the same code."""
+        if code < 0:
+            return None
+        health = self._health_objects.get(code)
+        if health is None:
+            health = self._health_objects[code] = BatteryHealth(**dict(zip(HEALTH_FIELDS, self.health.decode(code))))
+        return health
+
+    def health_code(self, health: Optional[BatteryHealth]) -> int:
+        """On-disk code for a BatteryHealth, registering it if new."""
+        if health is None:
+            return -1
+        before = len(self.health.values)
+        code = self.health.encode(tuple(getattr(health, name) for name in HEALTH_FIELDS))
+        self._dirty |= len(self.health.values) != before
+        return code
+
+    def encode_codes(self, name: str, values: Iterable[str]) -> np.ndarray:
+        """Disk codes for a sequence of categorical values, registering new ones."""
+        before = len(self.categories[name].values)
+        codes = np.array([self.categories[name].encode(v) for v in values], dtype=np.int64)
+        self._dirty |= len(self.categories[name].values) != before
+        return codes
+
+    def commit_dictionary(self):
+        """Persist categorical and battery-health tables if they gained entries."""
+        if self._dirty:
+            self._save_dictionary()
+            self._dirty = False
+
+    def compact(self, vin: str = None, merge_before: datetime = None):
+        """Sort and de-duplicate unsorted segments and merge old day segments by month.
+
+        Day segments that start before ``merge_before`` are folded into a
+        ``<YYYY-MM>.seg`` segment. Duplicate timestamps keep the last write.
+        """
+        merge_before_ms = to_epoch_ms(merge_before)
+        for target_vin in ([vin] if vin else self.vins()):
+            index = self._index(target_vin)
+            groups: Dict[str, List[str]] = {}
+            for name, meta in index.items():
+                target = name
+                if merge_before_ms is not None and len(name) == 14 and meta["max_ts"] < merge_before_ms:
+                    target = f"{name[:7]}.seg"
+                groups.setdefault(target, []).append(name)
+
+            for target, names in groups.items():
+                if names == [target] and index[target]["sorted"]:
+                    continue
+                merged = np.concatenate([np.array(self._open(target_vin, n, index[n]["rows"])) for n in names])
+                merged = np.sort(merged, order="timestamp", kind="stable")
+                keep = np.ones(len(merged), dtype=bool)
+                keep[:-1] = merged["timestamp"][1:] != merged["timestamp"][:-1]
+                merged = merged[keep]
+
+                # The merged rows go to a new file and the index switches to it before
+                # any superseded file is removed, so a crash at any point leaves the
+                # index naming complete files (leftovers are removed on the next load).
+                superseded = [index[name].get("file", name) for name in names]
+                filename = self._fresh_file(target_vin, target)
+                with open(os.path.join(self.root, target_vin, filename), 'wb') as f:
+                    f.write(merged.tobytes())
+                for name in names:
+                    del index[name]
+                index[target] = {"min_ts": int(merged["timestamp"][0]), "max_ts": int(merged["timestamp"][-1]),
+                                 "rows": len(merged), "sorted": True, "file": filename}
+                self._save_index(target_vin)
+                for old_file in superseded:
+                    os.remove(os.path.join(self.root, target_vin, old_file))
@@ -0,0 +1,376 @@
+import sqlite3
+from dataclasses import dataclass, field, fields
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from metrics_store import MetricsStore, TimeBound, to_epoch_ms
+from instrumentation import metrics, timed
+
+IDLE, DRIVING, CHARGING = 0, 1, 2
+SEGMENT_COLUMNS = ("timestamp", "speed", "power", "odometer", "charging_state",
+                   "battery_level", "battery_health", "latitude", "longitude")
+
+
+@dataclass
+class Trip:
+    """One drive: from the first moving snapshot to the last before a long enough stop."""
+    vin: str
+    start_ms: int
+    end_ms: int
+    distance: float  # miles
+    kwh: float
+    start_odometer: float
+    end_odometer: float
+    start_latitude: float
+    start_longitude: float
+    end_latitude: float
+    end_longitude: float
+
+    @property
+    def start(self) -> datetime:
+        return datetime.fromtimestamp(self.start_ms / 1000)
+
+    @property
+    def end(self) -> datetime:
+        return datetime.fromtimestamp(self.end_ms / 1000)
+
+    @property
+    def duration(self) -> float:
+        """Seconds."""
+        return (self.end_ms - self.start_ms) / 1000
+
+    @property
+    def efficiency(self) -> Optional[float]:
+        """kWh per mile, or None for trips without distance."""
+        return self.kwh / self.distance if self.distance > 0 else None
+
+
+@dataclass
+class ChargeSession:
+    """One charge: from the first charging snapshot to the first non-charging one."""
+    vin: str
+    start_ms: int
+    end_ms: int
+    kwh_added: float
+    peak_power: float  # kW
+    start_level: int
+    end_level: int
+    latitude: float
+    longitude: float
+
+    @property
+    def start(self) -> datetime:
+        return datetime.fromtimestamp(self.start_ms / 1000)
+
+    @property
+    def end(self) -> datetime:
+        return datetime.fromtimestamp(self.end_ms / 1000)
+
+    @property
+    def duration(self) -> float:
+        """Seconds."""
+        return (self.end_ms - self.start_ms) / 1000
+
+
+@dataclass
+class _Track:
+    """Per-VIN segmentation state carried between chunks."""
+    last: Optional[Dict[str, float]] = None  # last sample seen, as scalars
+    resumed: bool = False  # the first sample fed was already seen by an earlier run
+    trip: Optional[Dict[str, float]] = None
+    charge: Optional[Dict[str, float]] = None
+    trips: List[Trip] = field(default_factory=list)
+    sessions: List[ChargeSession] = field(default_factory=list)
+
+
+class Segmenter:
+    """Streaming trip and charge-session segmentation over per-VIN snapshots.
+
+    Each chunk of snapshots is classified per sample (driving when moving,
+    charging when the charging state says so, idle otherwise) and reduced to
+    runs with NumPy; a small state machine per VIN then walks the runs,
+    merging drives separated by stops shorter than ``stop_gap`` seconds and
+    closing any segment across a data gap longer than ``max_gap`` seconds.
+    Only the open segment and the last sample are kept between chunks.
+
+    Trip energy integrates positive drive power between snapshots; charge
+    energy is the rise in battery level times pack capacity (from battery
+    health, else ``default_capacity_kwh``), as in the tariff engine.
+    """
+    def __init__(self, store: MetricsStore, stop_gap: float = 300.0, max_gap: float = 1800.0,
+                 min_trip_miles: float = 0.1, default_capacity_kwh: float = 75.0):
+        self.store = store
+        self.stop_gap_ms = int(stop_gap * 1000)
+        self.max_gap_ms = int(max_gap * 1000)
+        self.min_trip_miles = min_trip_miles
+        self.default_capacity_kwh = default_capacity_kwh
+        self._tracks: Dict[str, _Track] = {}
+
+    def feed(self, vin: str, columns: Dict[str, np.ndarray]):
+        """Consume the next chunk of a VIN's snapshots (raw store columns, time ordered)."""
+        track = self._tracks.setdefault(vin, _Track())
+        keep = slice(None)
+        if track.last is not None:
+            keep = columns["timestamp"] > track.last["timestamp"]
+        chunk = {name: np.asarray(columns[name])[keep] for name in SEGMENT_COLUMNS}
+        if not len(chunk["timestamp"]):
+            return
+
+        capacity = self.store.health_values("capacity")[chunk.pop("battery_health")]
+        chunk["capacity"] = np.where(np.isnan(capacity), self.default_capacity_kwh, capacity)
+        charging = chunk.pop("charging_state") == self.store.code("charging_state", "Charging")
+        moving = np.nan_to_num(chunk.pop("speed")) > 0
+        chunk["mode"] = np.where(charging, CHARGING, np.where(moving, DRIVING, IDLE))
+        if track.last is None and track.resumed:
+            # The first sample of a resumed VIN only anchors what comes next.
+            track.last = {name: values[0].item() for name, values in chunk.items()}
+            track.last.update(energy=0.0, charged=0.0)
+            chunk = {name: values[1:] for name, values in chunk.items()}
+            if not len(chunk["timestamp"]):
+                return
+
+        # Prepend the carried sample so the interval bridging the chunks is counted.
+        carried = track.last is not None
+        base_energy = base_charged = 0.0
+        if carried:
+            base_energy, base_charged = track.last["energy"], track.last["charged"]
+            chunk = {name: np.concatenate([[track.last[name]], values]) for name, values in chunk.items()}
+        capacity = chunk["capacity"]
+        ts = chunk["timestamp"].astype(np.int64)
+        mode = chunk["mode"].astype(np.int8)
+        power = np.nan_to_num(chunk["power"])
+        n = len(ts)
+
+        # Cumulative drive energy (trapezoidal positive power) and charge added
+        # (level rise times capacity), with nothing counted across data gaps.
+        gap = np.diff(ts) > self.max_gap_ms
+        driving = (mode[1:] == DRIVING) | (mode[:-1] == DRIVING)
+        drive = np.clip(power, 0, None)
+        drive_kwh = np.where(driving & ~gap, (drive[1:] + drive[:-1]) / 2 * np.diff(ts) / 3_600_000, 0.0)
+        charging = (mode[1:] == CHARGING) | (mode[:-1] == CHARGING)
+        rise = np.clip(np.diff(chunk["battery_level"].astype(np.float64)), 0, None)
+        charge_kwh = np.where(charging & ~gap, rise * capacity[1:] / 100, 0.0)
+        chunk["energy"] = base_energy + np.concatenate([[0.0], np.cumsum(drive_kwh)])
+        chunk["charged"] = base_charged + np.concatenate([[0.0], np.cumsum(charge_kwh)])
+
+        # Runs of equal mode, also split at data gaps; only the runs go through Python.
+        starts = np.concatenate([[0], np.flatnonzero((mode[1:] != mode[:-1]) | gap) + 1])
+        ends = np.append(starts[1:] - 1, n - 1)
+        peaks = np.maximum.reduceat(np.abs(power), starts)
+        sample = lambda i: {name: values[i].item() for name, values in chunk.items()}
+        for run in range(len(starts)):
+            a, b = int(starts[run]), int(ends[run])
+            if carried and b == 0:
+                continue  # the carried sample alone was stepped with the previous chunk
+            previous = None
+            if a > 0 and gap[a - 1]:
+                self._close_trip(vin, track)
+                self._close_charge(vin, track)
+            elif a > 0:
+                previous = sample(a - 1)
+            self._step(vin, track, int(mode[a]), previous, sample(a), sample(b), float(peaks[run]))
+        track.last = sample(n - 1)
+
+    def _step(self, vin: str, track: _Track, mode: int, previous: Optional[Dict],
+              first: Dict, last: Dict, peak: float):
+        """Advance a VIN's state machine by one run of equal-mode samples.
+
+        Segments are anchored on the samples bracketing them (the one before
+        the first and the one after the last in-mode sample), so distance
+        and energy covered between snapshots are not lost.
+        """
+        if mode == DRIVING:
+            self._close_charge(vin, track, first)
+            trip = track.trip
+            if trip is not None and trip["stopped"] and first["timestamp"] - trip["end"]["timestamp"] > self.stop_gap_ms:
+                self._close_trip(vin, track)
+                trip = None
+            if trip is None:
+                trip = track.trip = {"start": previous or first}
+            trip.update(end=last, stopped=False)
+        elif mode == CHARGING:
+            self._close_trip(vin, track, first)
+            if track.charge is None:
+                track.charge = {"start": previous or first, "peak": 0.0}
+            track.charge["end"] = last
+            track.charge["peak"] = max(track.charge["peak"], peak)
+        else:
+            self._close_charge(vin, track, first)
+            trip = track.trip
+            if trip is not None:
+                if not trip["stopped"]:
+                    trip.update(end=first, stopped=True)
+                if last["timestamp"] - trip["end"]["timestamp"] > self.stop_gap_ms:
+                    self._close_trip(vin, track)
+
+    def _close_trip(self, vin: str, track: _Track, stopped_at: Optional[Dict] = None):
+        """Close an open trip; a still-moving trip ends at ``stopped_at`` when given."""
+        trip, track.trip = track.trip, None
+        if trip is None:
+            return
+        start, end = trip["start"], trip["end"]
+        if stopped_at is not None and not trip["stopped"]:
+            end = stopped_at
+        distance = end["odometer"] - start["odometer"]
+        if distance < self.min_trip_miles:
+            return
+        track.trips.append(Trip(
+            vin=vin, start_ms=int(start["timestamp"]), end_ms=int(end["timestamp"]),
+            distance=distance, kwh=end["energy"] - start["energy"],
+            start_odometer=start["odometer"], end_odometer=end["odometer"],
+            start_latitude=start["latitude"], start_longitude=start["longitude"],
+            end_latitude=end["latitude"], end_longitude=end["longitude"],
+        ))
+
+    def _close_charge(self, vin: str, track: _Track, stopped_at: Optional[Dict] = None):
+        """Close an open session; it ends at ``stopped_at``, the first non-charging sample, when given."""
+        charge, track.charge = track.charge, None
+        if charge is None:
+            return
+        start, end = charge["start"], stopped_at or charge["end"]
+        track.sessions.append(ChargeSession(
+            vin=vin, start_ms=int(start["timestamp"]), end_ms=int(end["timestamp"]),
+            kwh_added=end["charged"] - start["charged"], peak_power=charge["peak"],
+            start_level=int(start["battery_level"]), end_level=int(end["battery_level"]),
+            latitude=charge["end"]["latitude"], longitude=charge["end"]["longitude"],
+        ))
+
+    def finish(self, vin: str = None):
+        """Close the open segments (of one VIN or all), e.g. at the end of the data."""
+        for key in [vin] if vin is not None else list(self._tracks):
+            track = self._tracks.get(key)
+            if track is not None:
+                self._close_trip(key, track)
+                self._close_charge(key, track)
+
+    def drain(self, vin: str = None) -> Tuple[List[Trip], List[ChargeSession]]:
+        """Take the completed trips and sessions emitted so far (for one VIN or all)."""
+        tracks = [self._tracks[vin]] if vin is not None else list(self._tracks.values())
+        trips, sessions = [], []
+        for track in tracks:
+            trips.extend(track.trips)
+            sessions.extend(track.sessions)
+            track.trips, track.sessions = [], []
+        return trips, sessions
+
+    def resume(self, vin: str):
+        """Mark a VIN as resuming at ``resume_point()`` of an earlier run.
+
+        Its first sample is then only used as the anchor of the next segment
+        instead of being segmented again.
+        """
+        self._tracks[vin] = _Track(resumed=True)
+
+    def forget(self, vin: str):
+        """Drop a VIN's state, e.g. once its segments are persisted."""
+        self._tracks.pop(vin, None)
+
+    def resume_point(self, vin: str) -> Optional[int]:
+        """Timestamp to resume from so open segments are rebuilt next time, or None.
+
+        This is the start of the earliest open segment, else the last sample,
+        which anchors whatever segment begins next.
+        """
+        track = self._tracks.get(vin)
+        if track is None or track.last is None:
+            return None
+        anchors = [s["start"]["timestamp"] for s in (track.trip, track.charge) if s is not None]
+        return int(min(anchors + [track.last["timestamp"]]))
+
+
+class SegmentDB:
+    """SQLite store of segmented trips and charge sessions, with per-VIN progress."""
+    def __init__(self, path: str = "segments.db"):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        trip_columns = ", ".join(f.name for f in fields(Trip))
+        session_columns = ", ".join(f.name for f in fields(ChargeSession))
+        self.conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS trips ({trip_columns}, PRIMARY KEY (vin, start_ms));
+            CREATE TABLE IF NOT EXISTS charge_sessions ({session_columns}, PRIMARY KEY (vin, start_ms));
+            CREATE TABLE IF NOT EXISTS progress (vin TEXT PRIMARY KEY, resume_ms INTEGER);
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    def add(self, trips: Iterable[Trip], sessions: Iterable[ChargeSession],
+            progress: Dict[str, Optional[int]] = None):
+        """Insert or replace segment records and per-VIN resume points in one transaction."""
+        with self.conn:
+            for table, cls, records in (("trips", Trip, trips), ("charge_sessions", ChargeSession, sessions)):
+                names = [f.name for f in fields(cls)]
+                self.conn.executemany(f"INSERT OR REPLACE INTO {table} VALUES ({','.join('?' * len(names))})",
+                                      ([getattr(r, name) for name in names] for r in records))
+            if progress:
+                self.conn.executemany("INSERT OR REPLACE INTO progress VALUES (?, ?)", progress.items())
+
+    def resume_point(self, vin: str) -> Optional[int]:
+        """Timestamp an earlier run recorded to resume a VIN from, or None."""
+        row = self.conn.execute("SELECT resume_ms FROM progress WHERE vin = ?", (vin,)).fetchone()
+        return row[0] if row else None
+
+    def _query(self, table: str, cls, vin: str = None, start: TimeBound = None, end: TimeBound = None):
+        clauses, params = [], []
+        for clause, value in (("vin = ?", vin), ("start_ms >= ?", to_epoch_ms(start)),
+                              ("start_ms < ?", to_epoch_ms(end))):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.conn.execute(f"SELECT * FROM {table}{where} ORDER BY vin, start_ms", params)
+        return [cls(*row) for row in rows]
+
+    def trips(self, vin: str = None, start: TimeBound = None, end: TimeBound = None) -> List[Trip]:
+        """Stored trips, optionally for one VIN and starting within [start, end)."""
+        return self._query("trips", Trip, vin, start, end)
+
+    def sessions(self, vin: str = None, start: TimeBound = None, end: TimeBound = None) -> List[ChargeSession]:
+        """Stored charge sessions, optionally for one VIN and starting within [start, end)."""
+        return self._query("charge_sessions", ChargeSession, vin, start, end)
+
+    def vehicle_totals(self) -> Dict[str, Dict[str, float]]:
+        """Per-VIN trip and charging totals."""
+        totals: Dict[str, Dict[str, float]] = {}
+        for vin, count, distance, kwh in self.conn.execute(
+                "SELECT vin, COUNT(*), SUM(distance), SUM(kwh) FROM trips GROUP BY vin"):
+            totals[vin] = {"trips": count, "distance": distance, "trip_kwh": kwh,
+                           "sessions": 0, "kwh_added": 0.0}
+        for vin, count, kwh in self.conn.execute(
+                "SELECT vin, COUNT(*), SUM(kwh_added) FROM charge_sessions GROUP BY vin"):
+            entry = totals.setdefault(vin, {"trips": 0, "distance": 0.0, "trip_kwh": 0.0})
+            entry.update(sessions=count, kwh_added=kwh)
+        return totals
+
+
+@timed("segmentation")
+def segment_store(store: MetricsStore, db: SegmentDB, vins: Sequence[str] = None,
+                  end: TimeBound = None, **options) -> Tuple[int, int]:
+    """Segment every VIN's new history into ``db`` in one pass; returns (trips, sessions) added.
+
+    Each VIN resumes from its recorded progress, and history is read chunk
+    by chunk (one segment file at a time for persisted data). Segments
+    still open at the end are rebuilt on the next run.
+    """
+    if vins is None:
+        vins = list(store.vins)
+        if store.backing is not None:
+            vins += sorted(set(store.backing.vins()) - set(vins))
+    segmenter = Segmenter(store, **options)
+    added_trips = added_sessions = 0
+    for vin in vins:
+        start = db.resume_point(vin)
+        if start is not None:
+            segmenter.resume(vin)
+        for chunk in store.iter_columns(vin, SEGMENT_COLUMNS, start, end):
+            segmenter.feed(vin, chunk)
+        trips, sessions = segmenter.drain(vin)
+        resume = segmenter.resume_point(vin)
+        db.add(trips, sessions, {vin: resume} if resume is not None else None)
+        segmenter.forget(vin)
+        added_trips += len(trips)
+        added_sessions += len(sessions)
+    metrics.count("segmented_vins", len(vins))
+    metrics.count("segmented_trips", added_trips)
+    metrics.count("segmented_charge_sessions", added_sessions)
+    return added_trips, added_sessions
@@ -0,0 +1,330 @@
+import argparse
+import os
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from base import BatteryHealth
+from metrics_store import MetricsStore, COLUMNS, CATEGORICAL_FIELDS, HEALTH_FIELDS
+from fleet import FleetAnalytics
+
+# One row per vehicle: its latest metrics, with battery health as values
+# rather than an id into a worker's health table.
+LATEST_DTYPE = np.dtype(
+    [("vin", "U17")]
+    + [(name, dtype) for name, dtype in COLUMNS if name != "battery_health"]
+    + [(name, np.float64) for name in HEALTH_FIELDS]
+)
+TOTAL_FIELDS = ("vehicles", "active", "odometer", "battery_level", "charging")
+
+
+def shard_of(vin: str, count: int) -> int:
+    """Stable shard number of a VIN (the same in every process and run)."""
+    return zlib.crc32(vin.encode()) % count
+
+
+@dataclass
+class Shard:
+    """One worker's share of the fleet: an account, optionally split further by VIN.
+
+    ``vins`` are the vehicles this worker owns when its account is split
+    (listed once by the coordinator); None means the whole account.
+    ``synthetic`` generates a fleet of that many vehicles with SyntheticFleet
+    instead of calling the API (for benchmarking without credentials).
+    """
+    name: str
+    api_key: Optional[str] = None
+    index: int = 0
+    count: int = 1
+    history_dir: Optional[str] = None
+    synthetic: Optional[int] = None
+    vins: Optional[List[str]] = None
+
+
+@dataclass
+class ShardResult:
+    """What a worker sends back: a shared-memory block name and small metadata."""
+    name: str
+    memory: str
+    rows: int
+    categories: Dict[str, List[Any]]
+    totals: Dict[str, float]
+    seconds: Dict[str, float] = field(default_factory=dict)
+
+
+def split_vins(vins: Sequence[str], count: int) -> List[List[str]]:
+    """The VINs of each of ``count`` shards, assigned with shard_of."""
+    parts = [[] for _ in range(count)]
+    for vin in vins:
+        parts[shard_of(vin, count)].append(vin)
+    return parts
+
+
+def account_vins(api_key: str) -> List[str]:
+    """One listing call for an account's VINs."""
+    from tessie_api import TessieAPIManager
+    with TessieAPIManager(api_key=api_key) as api_manager:
+        return [vehicle["vin"] for vehicle in api_manager.get_vehicles()]
+
+
+def plan_shards(api_keys: Sequence[str], workers: int, history_dir: str = None) -> List[Shard]:
+    """Spread accounts over ``workers``; accounts are split by VIN when workers outnumber them.
+
+    A split account is listed once here and each of its shards gets its own
+    VINs, so no worker fetches or decodes vehicles it does not own.
+    """
+    per_account = max(1, -(-workers // max(len(api_keys), 1)))
+    shards = []
+    for account, api_key in enumerate(api_keys):
+        parts = split_vins(account_vins(api_key), per_account) if per_account > 1 else [None]
+        for index, vins in enumerate(parts):
+            name = f"account{account}-{index}of{per_account}"
+            path = f"{history_dir}/{name}" if history_dir else None
+            shards.append(Shard(name, api_key, index, per_account, path, vins=vins))
+    return shards
+
+
+def plan_synthetic_shards(n_vehicles: int, workers: int) -> List[Shard]:
+    """Split a synthetic fleet of ``n_vehicles`` by VIN over ``workers``."""
+    from synthetic import SyntheticFleet
+    parts = split_vins(SyntheticFleet(n_vehicles).vins, workers)
+    return [Shard(f"synthetic-{i}of{workers}", None, i, workers, synthetic=n_vehicles, vins=vins)
+            for i, vins in enumerate(parts)]
+
+
+def _fetch(shard: Shard) -> Tuple[List[Dict], Dict[str, Dict]]:
+    from decoding import decode_vehicles, decode_battery_health
+    if shard.synthetic is not None:
+        from synthetic import SyntheticFleet
+        vehicles, health = SyntheticFleet(shard.synthetic).payload_bytes(shard.vins)
+        return decode_vehicles(vehicles), decode_battery_health(health)
+    from tessie_api import TessieAPIManager
+    with TessieAPIManager(api_key=shard.api_key) as api_manager:
+        if shard.vins is None:
+            return api_manager.fetch_fleet_records()
+        details = api_manager.fetch_vehicle_details(shard.vins, ("state_record", "battery_health"))
+    records, health_map = [], {}
+    for vin in shard.vins:
+        record, health = details[vin]["state_record"], details[vin]["battery_health"]
+        if isinstance(record, Exception):
+            raise record
+        records.append({**record, "vin": vin})
+        if not isinstance(health, Exception):
+            health_map[vin] = health
+    return records, health_map
+
+
+def latest_records(fleet: FleetAnalytics) -> np.ndarray:
+    """The fleet's latest metrics as LATEST_DTYPE rows, in vehicle order, with store codes."""
+    store = fleet.store
+    vins = [vehicle.vin for vehicle in fleet.vehicles]
+    slots = store.slots(vins)
+    latest = np.empty(len(vins), LATEST_DTYPE)
+    latest["vin"] = vins
+    for name, _ in COLUMNS:
+        if name != "battery_health":
+            latest[name] = store.latest_column(name)[slots]
+    health_ids = store.latest_column("battery_health")[slots]
+    for name in HEALTH_FIELDS:
+        latest[name] = store.health_values(name)[health_ids]
+    return latest
+
+
+def partial_totals(latest: np.ndarray, charging_code: int) -> Dict[str, float]:
+    """Summable summary components for a set of vehicles."""
+    return {
+        "vehicles": len(latest),
+        "active": int(latest["is_active"].sum()),
+        "odometer": float(latest["odometer"].sum()),
+        "battery_level": int(latest["battery_level"].astype(np.int64).sum()),
+        "charging": int((latest["charging_state"] == charging_code).sum()),
+    }
+
+
+def run_shard(shard: Shard) -> ShardResult:
+    """Worker: fetch, build and aggregate one shard, leaving its rows in shared memory."""
+    seconds = {}
+    started = time.perf_counter()
+    records, health_map = _fetch(shard)
+    seconds["fetch"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    if shard.history_dir:
+        from segment_store import SegmentStore
+        fleet = FleetAnalytics.from_store(MetricsStore(backing=SegmentStore(shard.history_dir)))
+    else:
+        fleet = FleetAnalytics()
+    fleet.ingest_records(records, health_map)
+    if shard.history_dir:
+        fleet.store.flush()
+    latest = latest_records(fleet)
+    store = fleet.store
+    totals = partial_totals(latest, store.code("charging_state", "Charging"))
+    seconds["build"] = time.perf_counter() - started
+
+    memory = shared_memory.SharedMemory(create=True, size=max(latest.nbytes, 1))
+    np.ndarray(latest.shape, LATEST_DTYPE, buffer=memory.buf)[:] = latest
+    memory.close()
+    categories = {name: list(store.categories[name].values) for name in CATEGORICAL_FIELDS}
+    return ShardResult(shard.name, memory.name, len(latest), categories, totals, seconds)
+
+
+def release(results: Sequence[ShardResult]):
+    """Unlink the shared memory blocks of shard results (blocks already gone are skipped)."""
+    for result in results:
+        try:
+            memory = shared_memory.SharedMemory(name=result.memory)
+        except FileNotFoundError:
+            continue
+        memory.close()
+        memory.unlink()
+
+
+class ShardedFleet:
+    """Fleet-wide result merged from shard results."""
+    def __init__(self, latest: np.ndarray, categories: Dict[str, List[Any]], totals: Dict[str, float],
+                 shard_seconds: Dict[str, Dict[str, float]]):
+        self.latest = latest
+        self.categories = categories
+        self.totals = totals
+        self.shard_seconds = shard_seconds
+        self._fleet: Optional[FleetAnalytics] = None
+
+    def summary(self) -> Dict[str, Any]:
+        """Same fields as FleetAnalytics.get_fleet_summary, from the merged partial totals."""
+        totals = self.totals
+        return {
+            "total_vehicles": totals["vehicles"],
+            "active_vehicles": totals["active"],
+            "total_fleet_miles": totals["odometer"],
+            "average_battery_level": totals["battery_level"] / totals["vehicles"] if totals["vehicles"] else 0,
+            "vehicles_charging": totals["charging"],
+        }
+
+    def fleet(self) -> FleetAnalytics:
+        """A FleetAnalytics holding each vehicle's latest snapshot, for reports and dashboards."""
+        if self._fleet is not None:
+            return self._fleet
+        store = MetricsStore()
+        for name in CATEGORICAL_FIELDS:
+            for value in self.categories[name]:
+                store.categories[name].encode(value)
+
+        # Health values back to shared BatteryHealth objects, one per distinct value set.
+        health = np.column_stack([self.latest[name] for name in HEALTH_FIELDS]) if len(self.latest) else \
+            np.empty((0, len(HEALTH_FIELDS)))
+        known = ~np.isnan(health).any(axis=1)
+        health_ids = np.full(len(self.latest), -1, dtype=np.int32)
+        if known.any():
+            distinct, inverse = np.unique(health[known], axis=0, return_inverse=True)
+            ids = [store.encode({"battery_health": BatteryHealth(*values)})["battery_health"]
+                   for values in distinct.tolist()]
+            health_ids[known] = np.asarray(ids, dtype=np.int32)[inverse.ravel()]
+
+        for i, vin in enumerate(self.latest["vin"].tolist()):
+            columns = {name: self.latest[name][i:i + 1] for name, _ in COLUMNS if name != "battery_health"}
+            columns["battery_health"] = health_ids[i:i + 1]
+            store.extend(vin, columns)
+        self._fleet = FleetAnalytics.from_store(store)
+        return self._fleet
+
+
+class ShardedIngest:
+    """Runs shards in worker processes and merges their partial aggregates.
+
+    Each worker runs its own API client, vehicle construction and local
+    aggregation, then writes one fixed-width row per vehicle into a shared
+    memory block; only the block name, the (small) category dictionaries and
+    the summable totals are pickled back. The coordinator remaps category
+    codes with one table lookup per column and sums the totals, so its work
+    is a few vectorized passes regardless of how the shards were built.
+    """
+    def __init__(self, shards: Sequence[Shard], workers: int = None):
+        self.shards = list(shards)
+        self.workers = workers or len(self.shards)
+
+    def run(self) -> ShardedFleet:
+        # Workers must share the coordinator's tracker, or each would track (and
+        # at exit try to reclaim) the blocks it hands over.
+        resource_tracker.ensure_running()
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(run_shard, shard) for shard in self.shards]
+            wait(futures)
+        # Keep every finished shard's result, even if another failed, so its block is released.
+        results, error = [], None
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as exc:
+                error = error or exc
+        if error is not None:
+            release(results)
+            raise error
+        return self.merge(results)
+
+    @staticmethod
+    def merge(results: Sequence[ShardResult]) -> ShardedFleet:
+        """Concatenate shard rows and sum their totals; every shard's shared memory is released."""
+        merged = MetricsStore().categories
+        parts, totals, seconds = [], dict.fromkeys(TOTAL_FIELDS, 0), {}
+        try:
+            for result in results:
+                memory = shared_memory.SharedMemory(name=result.memory)
+                try:
+                    rows = np.ndarray((result.rows,), LATEST_DTYPE, buffer=memory.buf).copy()
+                finally:
+                    memory.close()
+                for name in CATEGORICAL_FIELDS:
+                    mapping = np.array([merged[name].encode(v) for v in result.categories[name]], dtype=np.int64)
+                    if len(mapping):
+                        rows[name] = mapping[rows[name]]
+                parts.append(rows)
+                for key in TOTAL_FIELDS:
+                    totals[key] += result.totals[key]
+                seconds[result.name] = result.seconds
+        finally:
+            release(results)
+        latest = np.concatenate(parts) if parts else np.empty(0, LATEST_DTYPE)
+        categories = {name: list(merged[name].values) for name in CATEGORICAL_FIELDS}
+        return ShardedFleet(latest, categories, totals, seconds)
+
+
+def main():
+    """Ingest one or more accounts across worker processes and write the fleet reports."""
+    parser = argparse.ArgumentParser(description="Sharded multi-process fleet ingest.")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--keys-file", help="file with one Tessie API key per line (default: key.API_KEY)")
+    parser.add_argument("--history", default=None, help="directory for per-shard persisted history")
+    parser.add_argument("--synthetic", type=int, default=None,
+                        help="ingest a synthetic fleet of this many vehicles instead of calling the API")
+    args = parser.parse_args()
+
+    workers = args.workers or os.cpu_count() or 1
+    if args.synthetic is not None:
+        shards = plan_synthetic_shards(args.synthetic, workers)
+    else:
+        if args.keys_file:
+            with open(args.keys_file) as f:
+                api_keys = [line.strip() for line in f if line.strip()]
+        else:
+            from key import API_KEY
+            api_keys = [API_KEY]
+        shards = plan_shards(api_keys, workers, args.history)
+
+    started = time.perf_counter()
+    result = ShardedIngest(shards, workers).run()
+    print(f"Ingested {len(result.latest):,} vehicles from {len(shards)} shards "
+          f"in {time.perf_counter() - started:.2f}s")
+    print("Fleet Summary:")
+    for key, value in result.summary().items():
+        print(f"{key}: {value}")
+
+    from analysis import EnergyAndCostAnalyzer
+    EnergyAndCostAnalyzer(result.fleet().vehicles).save_text_report()
+
+
+if __name__ == "__main__":
+    main()
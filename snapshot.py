@@ -0,0 +1,112 @@
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# Deliberately free of numpy/pandas/plotly imports: the CLI's summary and
+# report commands load this module alone and answer from the last snapshot.
+
+SNAPSHOT_FILE = "snapshot.json"
+SNAPSHOT_VERSION = 1
+
+
+def _native(value: Any) -> Any:
+    """JSON fallback for numpy scalars."""
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def build_snapshot(summary: Dict[str, Any], report: Dict[str, Any]) -> Dict[str, Any]:
+    """A snapshot of one ingest: the fleet summary and the energy report data."""
+    return {
+        "version": SNAPSHOT_VERSION,
+        "created": time.time(),
+        "summary": summary,
+        "report": report,
+    }
+
+
+def save_snapshot(snapshot: Dict[str, Any], filename: str = SNAPSHOT_FILE) -> None:
+    """Write a snapshot atomically, so readers never see a partial file."""
+    temporary = f"{filename}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(snapshot, f, default=_native, separators=(",", ":"))
+    os.replace(temporary, filename)
+
+
+def load_snapshot(filename: str = SNAPSHOT_FILE) -> Optional[Dict[str, Any]]:
+    """The saved snapshot, or None if there is none (or it is from another version)."""
+    try:
+        with open(filename) as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return None
+    return snapshot if snapshot.get("version") == SNAPSHOT_VERSION else None
+
+
+def snapshot_time(snapshot: Dict[str, Any]) -> str:
+    """When a snapshot was taken, as local ISO time."""
+    return datetime.fromtimestamp(snapshot["created"]).isoformat(timespec="seconds")
+
+
+def format_summary(summary: Dict[str, Any]) -> str:
+    """The fleet summary as printed by main.py."""
+    return "\n".join(["Fleet Summary:"] + [f"{key}: {value}" for key, value in summary.items()])
+
+
+def format_energy_report(metrics: Dict[str, Any], charging: Optional[List[Dict[str, Any]]] = None,
+                         trips: Optional[List[Dict[str, Any]]] = None) -> str:
+    """Render the energy efficiency and cost report from precomputed data.
+
+    ``metrics`` is EnergyAndCostAnalyzer.calculate_efficiency_metrics();
+    ``charging`` and ``trips`` are the optional per-vehicle tariff and
+    telemetry-history sections (see EnergyAndCostAnalyzer.report_data).
+    """
+    fleet_summary = metrics['fleet_summary']
+    report = [
+        "Energy Efficiency and Cost Analysis Report",
+        "\nFleet Summary:",
+        f"- Total Vehicles: {fleet_summary['total_vehicles']}",
+        f"- Total Energy Used: {fleet_summary['total_energy_used']:,.2f} kWh",
+        f"- Total Miles Driven: {fleet_summary['total_miles']:,.2f} miles",
+        f"- Fleet Average Efficiency: {fleet_summary['fleet_efficiency']:.3f} kWh/mile",
+        f"- Total Energy Cost: ${fleet_summary['total_cost']:,.2f}",
+        f"- Average Cost per Mile: ${fleet_summary['average_cost_per_mile']:.3f}",
+        "\nVehicle Rankings (by efficiency):"
+    ]
+
+    for idx, vehicle in enumerate(metrics['vehicles'], 1):
+        report.append(
+            f"\n{idx}. {vehicle['name']} ({vehicle['model']}) - {vehicle['source']} Data:"
+            f"\n   - Efficiency: {vehicle['efficiency']:.3f} kWh/mile"
+            f"\n   - Total Energy Used: {vehicle['total_energy']:,.1f} kWh"
+            f"\n   - Total Cost: ${vehicle['total_cost']:,.2f}"
+            f"\n   - Cost per Mile: ${vehicle['cost_per_mile']:.3f}"
+        )
+
+    if charging is not None:
+        report.append("\nCharging Costs (by tariff window):")
+        for summary in charging:
+            if not summary['sessions']:
+                continue
+            report.append(
+                f"\n- {summary['name']}: {summary['sessions']} sessions, "
+                f"{summary['kwh']:,.1f} kWh, ${summary['cost']:,.2f}"
+            )
+            for window, totals in summary['by_window'].items():
+                report.append(f"   - {window}: {totals['kwh']:,.1f} kWh, ${totals['cost']:,.2f}")
+
+    if trips is not None:
+        report.append("\nTrips and Charging (from telemetry history):")
+        for vehicle_totals in trips:
+            line = (f"\n- {vehicle_totals['name']}: {vehicle_totals['trips']} trips, "
+                    f"{vehicle_totals['distance']:,.1f} miles, {vehicle_totals['trip_kwh']:,.1f} kWh")
+            if vehicle_totals['distance']:
+                line += f" ({vehicle_totals['trip_kwh'] / vehicle_totals['distance']:.3f} kWh/mile)"
+            report.append(line)
+            report.append(f"   - {vehicle_totals['sessions']} charge sessions, "
+                          f"{vehicle_totals['kwh_added']:,.1f} kWh added")
+
+    return "\n".join(report)
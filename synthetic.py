@@ -0,0 +1,181 @@
+import json
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+
+ACTIVITIES = ("driving", "charging", "idle", "asleep")
+DEFAULT_MIX = {"driving": 0.15, "charging": 0.15, "idle": 0.45, "asleep": 0.25}
+
+# car_type, VIN model letter, trims, original capacity (kWh), EPA range (mi), kWh/mile
+MODELS = [
+    ("model3", "3", ("50", "62", "74d"), (57.5, 75.0, 78.0), (272.0, 315.0, 358.0), 0.245),
+    ("modely", "Y", ("74d", "74d", "p74d"), (75.0, 78.0, 78.0), (303.0, 330.0, 303.0), 0.285),
+    ("models", "S", ("100d", "p100d", "100d"), (95.0, 100.0, 100.0), (370.0, 348.0, 405.0), 0.300),
+    ("modelx", "X", ("100d", "p100d", "100d"), (95.0, 100.0, 100.0), (326.0, 311.0, 348.0), 0.350),
+]
+MODEL_WEIGHTS = (0.45, 0.40, 0.08, 0.07)
+# VIN position 10 model-year codes.
+YEAR_CODES = "HJKLMNPR"  # 2017 ... 2024
+CITIES = np.array([(40.7128, -74.0060), (37.7749, -122.4194), (47.6062, -122.3321),
+                   (30.2672, -97.7431), (41.8781, -87.6298)])
+
+
+@dataclass
+class SyntheticFleet:
+    """Generates realistic /vehicles and /battery_health payloads for a fake fleet.
+
+    Vehicle state is simulated for all vehicles at once with NumPy; each call
+    to ``step()`` advances every vehicle by ``interval`` seconds. Activities
+    follow a sticky Markov chain whose stationary mix is ``mix``, so
+    vehicles drive, charge and sleep in runs rather than flipping each step.
+    """
+    n_vehicles: int
+    seed: int = 0
+    interval: float = 300.0
+    mix: Dict[str, float] = None
+    persistence: float = 0.8
+    missing_energy: float = 0.3
+    start_ms: int = 1_704_067_200_000  # 2024-01-01 UTC
+
+    def __post_init__(self):
+        rng = self.rng = np.random.default_rng(self.seed)
+        n = self.n_vehicles
+        mix = {**DEFAULT_MIX, **(self.mix or {})}
+        self._mix = np.array([mix[a] for a in ACTIVITIES], dtype=np.float64)
+        self._mix /= self._mix.sum()
+
+        self.model = rng.choice(len(MODELS), size=n, p=MODEL_WEIGHTS)
+        self.trim = rng.integers(0, 3, size=n)
+        self.year = rng.integers(0, len(YEAR_CODES), size=n)
+        self.vins = [
+            f"5YJ{MODELS[m][1]}E1EB0{YEAR_CODES[y]}F{i:06d}"
+            for i, (m, y) in enumerate(zip(self.model, self.year))
+        ]
+        self.names = [f"{MODELS[m][0][-1].upper()}-{i:06d}" for i, m in enumerate(self.model)]
+        self.original_capacity = np.array([MODELS[m][3][t] for m, t in zip(self.model, self.trim)])
+        self.rated_range = np.array([MODELS[m][4][t] for m, t in zip(self.model, self.trim)])
+        self.efficiency = np.array([MODELS[m][5] for m in self.model]) * rng.normal(1.0, 0.08, n)
+
+        age_years = len(YEAR_CODES) - self.year + rng.random(n)
+        self.odometer = age_years * rng.normal(12_000, 3_000, n).clip(2_000)
+        self.health = (100 - 1.2 * age_years - rng.gamma(2.0, 1.0, n)).clip(70, 100)
+        self.lifetime_energy = self.odometer * self.efficiency * rng.normal(1.05, 0.03, n)
+        self.reports_energy = rng.random(n) >= self.missing_energy
+        self.battery_level = rng.integers(20, 95, n).astype(np.float64)
+        home = CITIES[rng.integers(0, len(CITIES), n)]
+        self.latitude = home[:, 0] + rng.normal(0, 0.05, n)
+        self.longitude = home[:, 1] + rng.normal(0, 0.05, n)
+        self.outside_temp = rng.normal(15, 8, n)
+        self.activity = rng.choice(len(ACTIVITIES), size=n, p=self._mix)
+        self.timestamp = np.full(n, self.start_ms, dtype=np.int64)
+        self.speed = np.zeros(n)
+        self.power = np.zeros(n)
+
+    def step(self):
+        """Advance every vehicle by one interval."""
+        rng, n, hours = self.rng, self.n_vehicles, self.interval / 3600
+        switch = rng.random(n) > self.persistence
+        self.activity = np.where(switch, rng.choice(len(ACTIVITIES), size=n, p=self._mix), self.activity)
+        # Flat batteries go charging; full ones stop.
+        self.activity[(self.battery_level < 10)] = ACTIVITIES.index("charging")
+        full = (self.activity == ACTIVITIES.index("charging")) & (self.battery_level >= 90)
+        self.activity[full] = ACTIVITIES.index("idle")
+
+        driving = self.activity == ACTIVITIES.index("driving")
+        charging = self.activity == ACTIVITIES.index("charging")
+        capacity = self.original_capacity * self.health / 100
+
+        self.speed = np.where(driving, rng.gamma(4.0, 9.0, n).clip(5, 85), 0.0)
+        miles = self.speed * hours
+        energy = miles * self.efficiency
+        charge_kw = np.where(charging, rng.choice([7.6, 11.5, 150.0], size=n, p=(0.5, 0.35, 0.15)), 0.0)
+        added = charge_kw * hours
+        drain = np.where(self.activity == ACTIVITIES.index("idle"), 0.02 * hours * capacity / 24, 0.0)
+
+        self.battery_level = (self.battery_level + (added - energy - drain) / capacity * 100).clip(0, 100)
+        self.odometer = self.odometer + miles
+        self.lifetime_energy = self.lifetime_energy + energy
+        heading = rng.uniform(0, 2 * np.pi, n)
+        self.latitude = self.latitude + np.where(driving, miles / 69 * np.cos(heading), 0.0)
+        self.longitude = self.longitude + np.where(driving, miles / 53 * np.sin(heading), 0.0)
+        self.power = np.where(driving, energy / np.maximum(hours, 1e-9), -charge_kw)
+        # Capacity fades with charge throughput, roughly 1% per 8,000 miles.
+        self.health = (self.health - miles / 8_000 - added / capacity * 0.004).clip(60, 100)
+        self.outside_temp = self.outside_temp + rng.normal(0, 0.3, n)
+        self.timestamp = self.timestamp + int(self.interval * 1000)
+
+    def _state(self, i: int) -> Dict:
+        activity = ACTIVITIES[self.activity[i]]
+        car_type = MODELS[self.model[i]][0]
+        charging = activity == "charging"
+        level = int(round(self.battery_level[i]))
+        health = self.health[i] / 100
+        return {
+            "display_name": self.names[i],
+            "state": "asleep" if activity == "asleep" else "online",
+            "vehicle_config": {
+                "car_type": car_type,
+                "performance_package": "Performance" if MODELS[self.model[i]][2][self.trim[i]].startswith("p") else "Base",
+                "trim_badging": MODELS[self.model[i]][2][self.trim[i]],
+                "efficiency_package": f"{car_type[-1].upper()}{2017 + int(self.year[i])}",
+            },
+            "charge_state": {
+                "battery_level": level,
+                "battery_range": round(self.rated_range[i] * health * level / 100, 2),
+                "charging_state": "Charging" if charging else "Disconnected",
+                "lifetime_energy_used": round(float(self.lifetime_energy[i]), 1) if self.reports_energy[i] else None,
+            },
+            "drive_state": {
+                "timestamp": int(self.timestamp[i]),
+                "latitude": round(float(self.latitude[i]), 6),
+                "longitude": round(float(self.longitude[i]), 6),
+                "speed": int(self.speed[i]) if activity == "driving" else None,
+                "power": round(float(self.power[i]), 1),
+                "shift_state": "D" if activity == "driving" else None,
+            },
+            "vehicle_state": {"odometer": round(float(self.odometer[i]), 2)},
+            "climate_state": {
+                "inside_temp": round(float(self.outside_temp[i] + (5 if activity != "asleep" else 1)), 1),
+                "outside_temp": round(float(self.outside_temp[i]), 1),
+                "is_climate_on": activity == "driving",
+            },
+        }
+
+    def _indices(self, vins: Optional[Sequence[str]]) -> Iterable[int]:
+        if vins is None:
+            return range(self.n_vehicles)
+        position = {vin: i for i, vin in enumerate(self.vins)}
+        return [position[vin] for vin in vins]
+
+    def vehicles_payload(self, vins: Sequence[str] = None) -> Dict:
+        """Current fleet (or just ``vins``) as a /vehicles response body."""
+        return {"results": [{"vin": self.vins[i], "last_state": self._state(i)} for i in self._indices(vins)]}
+
+    def battery_health_payload(self, vins: Sequence[str] = None) -> Dict:
+        """Current fleet (or just ``vins``) as a /battery_health response body."""
+        capacity = np.round(self.original_capacity * self.health / 100, 1)
+        max_range = np.round(self.rated_range * self.health / 100, 1)
+        return {"results": [
+            {
+                "vin": self.vins[i],
+                "max_range": float(max_range[i]),
+                "max_ideal_range": float(np.round(max_range[i] * 1.04, 1)),
+                "capacity": float(capacity[i]),
+                "original_capacity": float(self.original_capacity[i]),
+                "degradation_percent": float(np.round(100 - self.health[i], 1)),
+                "health_percent": float(np.round(self.health[i], 1)),
+            }
+            for i in self._indices(vins)
+        ]}
+
+    def snapshots(self, count: int) -> Iterator[Tuple[List[Dict], List[Dict]]]:
+        """Yield ``count`` (vehicles, battery_health) result lists, advancing between them."""
+        for index in range(count):
+            if index:
+                self.step()
+            yield self.vehicles_payload()["results"], self.battery_health_payload()["results"]
+
+    def payload_bytes(self, vins: Sequence[str] = None) -> Tuple[bytes, bytes]:
+        """Current /vehicles and /battery_health bodies (optionally for ``vins`` only) as JSON bytes."""
+        return (json.dumps(self.vehicles_payload(vins)).encode(),
+                json.dumps(self.battery_health_payload(vins)).encode())
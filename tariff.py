@@ -0,0 +1,338 @@
+import json
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+from dateutil import tz as dateutil_tz
+from metrics_store import MetricsStore, TimeBound
+from segmentation import ChargeSession, SegmentDB
+
+MINUTES_PER_WEEK = 7 * 24 * 60
+EARTH_RADIUS_M = 6_371_000.0
+
+
+@dataclass
+class RateWindow:
+    """A recurring time-of-use window covering [start_hour, end_hour) on the given weekdays."""
+    name: str
+    rate: float
+    start_hour: float
+    end_hour: float
+    days: Tuple[int, ...] = (0, 1, 2, 3, 4, 5, 6)  # Monday is 0
+
+
+@dataclass
+class RateTier:
+    """Surcharge applied once a vehicle's monthly charged energy exceeds the previous tier."""
+    up_to_kwh: Optional[float]
+    surcharge: float
+
+
+class Tariff:
+    """Electricity tariff with a base rate, time-of-use windows and monthly tiers.
+
+    Windows are compiled into a minute-of-week rate table, so pricing a batch
+    of timestamps is a vectorized local-time conversion plus array indexing.
+    Later windows take precedence where windows overlap; windows may wrap
+    past midnight (e.g. 21 to 7).
+    """
+    def __init__(self, name: str, base_rate: float, windows: Sequence[RateWindow] = (),
+                 tiers: Sequence[RateTier] = (), timezone=None):
+        self.name = name
+        self.base_rate = base_rate
+        self.windows = list(windows)
+        self.tiers = list(tiers)
+        self.timezone = timezone if timezone is not None else dateutil_tz.tzlocal()
+        self.window_names = ["base"] + [w.name for w in self.windows]
+
+        self._minute_rates = np.full(MINUTES_PER_WEEK, base_rate, dtype=np.float64)
+        self._minute_windows = np.zeros(MINUTES_PER_WEEK, dtype=np.int16)
+        minutes = np.arange(24 * 60)
+        for index, window in enumerate(self.windows, 1):
+            start, end = int(window.start_hour * 60), int(window.end_hour * 60)
+            in_window = (minutes >= start) & (minutes < end) if start < end else (minutes >= start) | (minutes < end)
+            for day in window.days:
+                day_minutes = day * 24 * 60 + minutes[in_window]
+                self._minute_rates[day_minutes] = window.rate
+                self._minute_windows[day_minutes] = index
+
+        self._tier_limits = np.array(
+            [t.up_to_kwh if t.up_to_kwh is not None else np.inf for t in self.tiers], dtype=np.float64)
+        self._tier_surcharges = np.array([t.surcharge for t in self.tiers], dtype=np.float64)
+
+    def _local_time(self, timestamps_ms: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Minute of week and month number of each timestamp in the tariff's timezone."""
+        local = pd.DatetimeIndex(pd.to_datetime(timestamps_ms, unit='ms', utc=True)).tz_convert(self.timezone)
+        minute_of_week = (local.dayofweek * 24 + local.hour) * 60 + local.minute
+        return np.asarray(minute_of_week, dtype=np.intp), np.asarray(local.year * 12 + local.month)
+
+    def price(self, timestamps_ms: np.ndarray, kwh: np.ndarray,
+              monthly_kwh_before: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Cost and window index for energy increments drawn at the given times.
+
+        ``monthly_kwh_before`` is the vehicle's energy already charged that
+        month before each increment; it selects the tier surcharge.
+        """
+        minute_of_week, _ = self._local_time(timestamps_ms)
+        rates = self._minute_rates[minute_of_week]
+        if len(self.tiers) and monthly_kwh_before is not None:
+            tier = np.minimum(np.searchsorted(self._tier_limits, monthly_kwh_before, side="right"),
+                              len(self.tiers) - 1)
+            rates = rates + self._tier_surcharges[tier]
+        return rates * kwh, self._minute_windows[minute_of_week]
+
+    def months(self, timestamps_ms: np.ndarray) -> np.ndarray:
+        return self._local_time(timestamps_ms)[1]
+
+
+@dataclass
+class TariffLocation:
+    """A circular geofence (e.g. home or a depot) with its own tariff."""
+    name: str
+    latitude: float
+    longitude: float
+    radius_m: float
+    tariff: Tariff
+
+
+@dataclass
+class ChargeSessionCost:
+    """Energy and cost of one charge session."""
+    vin: str
+    display_name: str
+    start: datetime
+    end: datetime
+    location: str
+    tariff: str
+    kwh: float
+    cost: float
+    by_window: Dict[str, Dict[str, float]] = field(default_factory=dict)
+
+
+@dataclass
+class TariffResult:
+    """Per-session and per-vehicle charging cost breakdowns."""
+    sessions: List[ChargeSessionCost]
+    vehicles: Dict[str, Dict]
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres; broadcasts over array arguments."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+class TariffEngine:
+    """Prices charge sessions by tariff window: persisted SegmentDB sessions, or runs found in stored history."""
+    def __init__(self, default_tariff: Tariff, locations: Sequence[TariffLocation] = (),
+                 default_capacity_kwh: float = 75.0, charging_efficiency: float = 1.0):
+        self.default_tariff = default_tariff
+        self.locations = list(locations)
+        self.default_capacity_kwh = default_capacity_kwh
+        self.charging_efficiency = charging_efficiency
+
+    def locate(self, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+        """Index into ``locations`` of the nearest containing geofence per point, or -1."""
+        if not self.locations or not len(latitudes):
+            return np.full(len(latitudes), -1, dtype=np.intp)
+        centers = np.array([(loc.latitude, loc.longitude) for loc in self.locations])
+        radii = np.array([loc.radius_m for loc in self.locations])
+        distances = haversine_m(latitudes[:, None], longitudes[:, None], centers[:, 0], centers[:, 1])
+        distances = np.where(distances <= radii, distances, np.inf)
+        nearest = distances.argmin(axis=1)
+        return np.where(np.isfinite(distances.min(axis=1)), nearest, -1)
+
+    def price_vehicle(self, store: MetricsStore, vin: str, display_name: str = None,
+                      start: TimeBound = None, end: TimeBound = None) -> List[ChargeSessionCost]:
+        """Price every charge session in a VIN's stored history for [start, end).
+
+        Sessions are found here as runs of charging samples; price_sessions
+        prices the sessions segmentation.py has persisted instead.
+        """
+        columns = store.columns(vin, ["timestamp", "charging_state", "battery_level",
+                                      "latitude", "longitude", "battery_health"], start, end)
+        timestamps = columns["timestamp"]
+        charging = columns["charging_state"] == store.code("charging_state", "Charging")
+        if len(timestamps) < 2 or not charging.any():
+            return []
+
+        # Sessions are runs of consecutive charging samples; each interval that
+        # starts or ends while charging belongs to the adjacent run.
+        starts = charging & ~np.concatenate([[False], charging[:-1]])
+        run_ids = np.cumsum(starts) - 1
+        in_session = charging[1:] | charging[:-1]
+        session_of_interval = np.where(charging[1:], run_ids[1:], run_ids[:-1])[in_session]
+
+        capacities = np.array([h.capacity for h in store.health_table] + [self.default_capacity_kwh])
+        capacity = capacities[columns["battery_health"][1:][in_session]]
+        level_delta = np.diff(columns["battery_level"].astype(np.float64))[in_session]
+        kwh = np.clip(level_delta, 0, None) / 100 * capacity / self.charging_efficiency
+        midpoints = ((timestamps[1:] + timestamps[:-1]) // 2)[in_session]
+
+        session_starts = np.flatnonzero(starts)
+        n_sessions = len(session_starts)
+        # A session ends at the first non-charging sample after its run, if any.
+        stops = np.flatnonzero(~charging & np.concatenate([[False], charging[:-1]]))
+        session_ends = np.append(stops, len(timestamps) - 1)[:n_sessions]
+        location_ids = self.locate(columns["latitude"][session_starts], columns["longitude"][session_starts])
+        return self._price(vin, display_name, timestamps[session_starts], timestamps[session_ends],
+                           location_ids, session_of_interval, kwh, midpoints)
+
+    def price_sessions(self, store: MetricsStore, sessions: Sequence[ChargeSession],
+                       display_name: str = None) -> List[ChargeSessionCost]:
+        """Price one VIN's persisted charge sessions (see segmentation.SegmentDB).
+
+        Each session's ``kwh_added`` is spread over its stored samples in
+        proportion to the battery level rise, so energy lands in the tariff
+        windows it was drawn in; a session whose samples are no longer
+        stored is priced at its midpoint.
+        """
+        if not sessions:
+            return []
+        vin = sessions[0].vin
+        sessions = sorted(sessions, key=lambda session: session.start_ms)
+        session_start = np.array([session.start_ms for session in sessions], dtype=np.int64)
+        session_end = np.array([session.end_ms for session in sessions], dtype=np.int64)
+        kwh_added = np.array([session.kwh_added for session in sessions], dtype=np.float64)
+        n_sessions = len(sessions)
+
+        columns = store.columns(vin, ["timestamp", "battery_level", "battery_health"],
+                                int(session_start[0]), int(session_end.max()) + 1)
+        timestamps = columns["timestamp"]
+        # An interval belongs to the session whose [start, end] contains it.
+        owner = np.searchsorted(session_start, timestamps[:-1], side="right") - 1
+        inside = (owner >= 0) & (timestamps[1:] <= session_end[np.maximum(owner, 0)])
+        capacities = np.array([h.capacity for h in store.health_table] + [self.default_capacity_kwh])
+        rise = np.clip(np.diff(columns["battery_level"].astype(np.float64)), 0, None)
+        weights = (rise * capacities[columns["battery_health"][1:]] / 100)[inside]
+        session_of_interval = owner[inside]
+        midpoints = ((timestamps[1:] + timestamps[:-1]) // 2)[inside]
+
+        weight_sums = np.bincount(session_of_interval, weights=weights, minlength=n_sessions)
+        covered = weight_sums > 0
+        kwh = weights * np.where(covered, kwh_added / np.where(covered, weight_sums, 1), 0)[session_of_interval]
+        uncovered = np.flatnonzero(~covered & (kwh_added > 0))
+        session_of_interval = np.concatenate([session_of_interval, uncovered])
+        kwh = np.concatenate([kwh, kwh_added[uncovered]]) / self.charging_efficiency
+        midpoints = np.concatenate([midpoints, (session_start[uncovered] + session_end[uncovered]) // 2])
+        order = np.argsort(midpoints, kind="stable")
+
+        location_ids = self.locate(np.array([session.latitude for session in sessions]),
+                                   np.array([session.longitude for session in sessions]))
+        return self._price(vin, display_name, session_start, session_end, location_ids,
+                           session_of_interval[order], kwh[order], midpoints[order])
+
+    def _price(self, vin: str, display_name: Optional[str], session_start_ms: np.ndarray,
+               session_end_ms: np.ndarray, location_ids: np.ndarray, session_of_interval: np.ndarray,
+               kwh: np.ndarray, midpoints: np.ndarray) -> List[ChargeSessionCost]:
+        """Price time-ordered energy increments, each belonging to one of the sessions, and roll them up."""
+        n_sessions = len(session_start_ms)
+        tariffs = [self.locations[i].tariff if i >= 0 else self.default_tariff for i in location_ids]
+
+        costs = np.zeros(len(kwh))
+        windows = np.zeros(len(kwh), dtype=np.int16)
+        session_tariff = np.array([id(t) for t in tariffs])
+        for tariff in {id(t): t for t in tariffs}.values():
+            mask = session_tariff[session_of_interval] == id(tariff)
+            if not mask.any():
+                continue
+            monthly_before = None
+            if tariff.tiers:
+                months = tariff.months(midpoints[mask])
+                cumulative = np.cumsum(kwh[mask])
+                month_start = np.flatnonzero(np.concatenate([[True], months[1:] != months[:-1]]))
+                offsets = np.repeat(cumulative[month_start] - kwh[mask][month_start],
+                                    np.diff(np.append(month_start, len(months))))
+                monthly_before = cumulative - kwh[mask] - offsets
+            costs[mask], windows[mask] = tariff.price(midpoints[mask], kwh[mask], monthly_before)
+
+        n_windows = max(len(t.window_names) for t in tariffs)
+        session_kwh = np.bincount(session_of_interval, weights=kwh, minlength=n_sessions)
+        session_cost = np.bincount(session_of_interval, weights=costs, minlength=n_sessions)
+        window_key = session_of_interval * n_windows + windows
+        window_kwh = np.bincount(window_key, weights=kwh, minlength=n_sessions * n_windows).reshape(n_sessions, -1)
+        window_cost = np.bincount(window_key, weights=costs, minlength=n_sessions * n_windows).reshape(n_sessions, -1)
+        window_used = np.bincount(window_key, minlength=n_sessions * n_windows).reshape(n_sessions, -1) > 0
+
+        sessions = []
+        for index in range(n_sessions):
+            tariff = tariffs[index]
+            sessions.append(ChargeSessionCost(
+                vin=vin,
+                display_name=display_name or vin,
+                start=datetime.fromtimestamp(session_start_ms[index] / 1000),
+                end=datetime.fromtimestamp(session_end_ms[index] / 1000),
+                location=self.locations[location_ids[index]].name if location_ids[index] >= 0 else "other",
+                tariff=tariff.name,
+                kwh=float(session_kwh[index]),
+                cost=float(session_cost[index]),
+                by_window={
+                    tariff.window_names[w]: {"kwh": float(window_kwh[index, w]), "cost": float(window_cost[index, w])}
+                    for w in np.flatnonzero(window_used[index])
+                },
+            ))
+        return sessions
+
+    def price_fleet(self, vehicles: Sequence, start: TimeBound = None, end: TimeBound = None,
+                    segments: SegmentDB = None) -> TariffResult:
+        """Price charge sessions for every vehicle and roll them up per vehicle.
+
+        With ``segments``, the charge sessions persisted there are priced, so
+        costs cover the same sessions as the trip and charging totals;
+        otherwise sessions are found in the stored history.
+        """
+        sessions: List[ChargeSessionCost] = []
+        summaries: Dict[str, Dict] = {}
+        for vehicle in vehicles:
+            if segments is not None:
+                vehicle_sessions = self.price_sessions(vehicle.store, segments.sessions(vehicle.vin, start, end),
+                                                       vehicle.display_name)
+            else:
+                vehicle_sessions = self.price_vehicle(vehicle.store, vehicle.vin, vehicle.display_name, start, end)
+            sessions.extend(vehicle_sessions)
+            by_window: Dict[str, Dict[str, float]] = {}
+            for session in vehicle_sessions:
+                for window, totals in session.by_window.items():
+                    entry = by_window.setdefault(window, {"kwh": 0.0, "cost": 0.0})
+                    entry["kwh"] += totals["kwh"]
+                    entry["cost"] += totals["cost"]
+            summaries[vehicle.vin] = {
+                "name": vehicle.display_name,
+                "sessions": len(vehicle_sessions),
+                "kwh": sum(s.kwh for s in vehicle_sessions),
+                "cost": sum(s.cost for s in vehicle_sessions),
+                "by_window": by_window,
+            }
+        return TariffResult(sessions=sessions, vehicles=summaries)
+
+
+def _tariff_from_config(config: Dict) -> Tariff:
+    timezone = config.get("timezone")
+    return Tariff(
+        config["name"], config["base_rate"],
+        windows=[RateWindow(**{**window, "days": tuple(window.get("days", range(7)))})
+                 for window in config.get("windows", ())],
+        tiers=[RateTier(**tier) for tier in config.get("tiers", ())],
+        timezone=dateutil_tz.gettz(timezone) if timezone else None,
+    )
+
+
+def load_tariff_engine(path: str, default_rate: float = 0.36) -> TariffEngine:
+    """A TariffEngine from a JSON tariff file, or one flat ``default_rate`` tariff if the file does not exist.
+
+    The file holds ``default`` (a tariff: ``name``, ``base_rate`` and optional
+    ``windows``, ``tiers`` and ``timezone``), optional ``locations`` (each with
+    ``name``, ``latitude``, ``longitude``, ``radius_m`` and a ``tariff``) and
+    optional ``default_capacity_kwh`` and ``charging_efficiency``.
+    """
+    if not os.path.exists(path):
+        return TariffEngine(Tariff("flat", default_rate))
+    with open(path) as f:
+        config = json.load(f)
+    locations = [TariffLocation(**{**location, "tariff": _tariff_from_config(location["tariff"])})
+                 for location in config.get("locations", ())]
+    options = {key: config[key] for key in ("default_capacity_kwh", "charging_efficiency") if key in config}
+    return TariffEngine(_tariff_from_config(config["default"]), locations, **options)
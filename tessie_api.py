@@ -1,23 +1,320 @@
+import asyncio
+import functools
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
 import requests
-from typing import Dict, List
+from requests.adapters import HTTPAdapter
+from decoding import SchemaError, loads, decode_state, decode_battery_health
+from instrumentation import metrics, endpoint_label
+from response_cache import DecodedCache, FleetRecordCache, ResponseCache
 
-class TessieAPIManager:
-    """Base API manager for Tessie API communication."""
-    def __init__(self, api_key: str):
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+VEHICLE_ENDPOINTS = ("state", "battery_health", "drives", "charges")  # also "state_record"
+
+
+class TessieAPIError(Exception):
+    """Raised when a Tessie request fails or exhausts its retries."""
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class TokenBucket:
+    """Asyncio token-bucket rate limiter."""
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class AsyncTessieAPI:
+    """Asyncio Tessie client with pooled connections, rate limiting and retries."""
+    def __init__(self, api_key: str, base_url: str = "https://api.tessie.com",
+                 max_connections: int = 32, max_concurrency: int = 16,
+                 rate_limit: float = 10.0, burst: int = 20,
+                 timeout: Tuple[float, float] = (5.0, 30.0),
+                 max_retries: int = 4, backoff: float = 0.5, max_backoff: float = 30.0,
+                 cache: ResponseCache = None):
         self.api_key = api_key
-        self.base_url = "https://api.tessie.com"
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_concurrency = max_concurrency
+
         self.session = requests.Session()
         self.session.headers.update({
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="tessie-http")
+        self._limiter = TokenBucket(rate_limit, burst)
+        self._semaphore = None
+        self.cache = cache
+        self._fleet_records = FleetRecordCache()
+        self._decoded = DecodedCache()
+        self._health_map: Dict[str, Dict] = {}
+        self._health_changed: Set[str] = set()
+
+    def _retry_delay(self, attempt: int, response: Optional[requests.Response]) -> float:
+        """Full-jitter exponential backoff, never shorter than a Retry-After header."""
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        return delay
+
+    async def request(self, path: str, params: Dict = None) -> Dict:
+        """GET a Tessie endpoint and return the decoded JSON payload."""
+        return loads(await self.request_bytes(path, params))
+
+    async def request_bytes(self, path: str, params: Dict = None) -> bytes:
+        """GET a Tessie endpoint and return the raw response body.
+
+        With a ResponseCache, fresh cached bodies are returned without a
+        request and fetched bodies of cacheable endpoints are stored.
+        """
+        if self.cache is not None:
+            cached = self.cache.get(path, params)
+            metrics.count("api_cache_hits" if cached is not None else "api_cache_misses",
+                          endpoint=endpoint_label(path) if metrics.enabled else "")
+            if cached is not None:
+                return cached
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        loop = asyncio.get_running_loop()
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        call = functools.partial(self.session.get, url, params=params, timeout=self.timeout)
+
+        endpoint = endpoint_label(path) if metrics.enabled else None
+        for attempt in range(self.max_retries + 1):
+            await self._limiter.acquire()
+            response, error = None, None
+            async with self._semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await loop.run_in_executor(self._executor, call)
+                except requests.RequestException as exc:
+                    error = exc
+                if endpoint is not None:
+                    status = str(response.status_code) if response is not None else "error"
+                    metrics.observe("api_request_seconds", time.perf_counter() - started,
+                                    endpoint=endpoint, status=status)
+
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                if not response.ok:
+                    raise TessieAPIError(f"GET {path} failed with {response.status_code}", response.status_code)
+                if endpoint is not None:
+                    metrics.count("api_response_bytes", len(response.content), endpoint=endpoint)
+                if self.cache is not None:
+                    self.cache.put(path, params, response.content)
+                return response.content
+            if attempt == self.max_retries:
+                status = response.status_code if response is not None else None
+                metrics.count("api_failures", endpoint=endpoint or "")
+                raise TessieAPIError(f"GET {path} failed after {attempt + 1} attempts: {error or status}", status)
+            metrics.count("api_retries", endpoint=endpoint or "")
+            await asyncio.sleep(self._retry_delay(attempt, response))
+
+    async def _request_windowed(self, path: str, start: datetime, end: datetime,
+                                window: timedelta, params: Dict = None) -> List[Dict]:
+        """Split a time-ranged list endpoint into windows fetched concurrently."""
+        bounds = []
+        cursor = start
+        while cursor < end:
+            bounds.append((cursor, min(cursor + window, end)))
+            cursor += window
+        pages = await asyncio.gather(*(
+            self.request(path, {**(params or {}), "from": int(lo.timestamp()), "to": int(hi.timestamp())})
+            for lo, hi in bounds
+        ))
+        return [item for page in pages for item in page["results"]]
+
+    async def get_vehicles(self, only_active: bool = False) -> List[Dict]:
+        """Fetch all vehicles data."""
+        payload = await self.request("vehicles", {"only_active": str(only_active).lower()})
+        return payload["results"]
+
+    async def get_battery_health(self) -> List[Dict]:
+        """Fetch battery health data for all vehicles."""
+        payload = await self.request("battery_health", {"distance_format": "mi", "only_active": "false"})
+        return payload["results"]
+
+    async def get_state(self, vin: str, use_cache: bool = True) -> Dict:
+        """Fetch the current state of one vehicle."""
+        return await self.request(f"{vin}/state", {"use_cache": str(use_cache).lower()})
+
+    async def get_vehicle_battery_health(self, vin: str) -> Dict:
+        """Fetch battery health for one vehicle."""
+        payload = await self.request(f"{vin}/battery_health", {"distance_format": "mi"})
+        return payload.get("result", payload)
+
+    async def get_drives(self, vin: str, start: datetime = None, end: datetime = None,
+                         window: timedelta = timedelta(days=30)) -> List[Dict]:
+        """Fetch drives for one vehicle, optionally over a time range."""
+        if start is None:
+            return (await self.request(f"{vin}/drives", {"distance_format": "mi"}))["results"]
+        return await self._request_windowed(f"{vin}/drives", start, end or datetime.now(), window,
+                                            {"distance_format": "mi"})
+
+    async def get_charges(self, vin: str, start: datetime = None, end: datetime = None,
+                          window: timedelta = timedelta(days=30)) -> List[Dict]:
+        """Fetch charging sessions for one vehicle, optionally over a time range."""
+        if start is None:
+            return (await self.request(f"{vin}/charges", {"distance_format": "mi"}))["results"]
+        return await self._request_windowed(f"{vin}/charges", start, end or datetime.now(), window,
+                                            {"distance_format": "mi"})
+
+    async def get_vehicle_records(self, only_active: bool = False) -> List[Dict]:
+        """Fetch all vehicles as flat metrics records (see decoding.decode_vehicles).
+
+        Vehicles whose state is byte-for-byte unchanged since the previous
+        call keep their previous record objects instead of being decoded again.
+        """
+        return self._fleet_records.decode(
+            await self.request_bytes("vehicles", {"only_active": str(only_active).lower()}))
+
+    async def get_battery_health_map(self) -> Dict[str, Dict]:
+        """Fetch battery health for all vehicles, keyed by VIN (reused while the payload is unchanged)."""
+        previous = self._health_map
+        payload = await self.request_bytes("battery_health", {"distance_format": "mi", "only_active": "false"})
+        self._health_map, changed = self._decoded.decode("battery_health", payload, decode_battery_health)
+        self._health_changed = {vin for vin, item in self._health_map.items()
+                                if previous.get(vin) != item} if changed else set()
+        return self._health_map
+
+    async def get_state_record(self, vin: str, use_cache: bool = True) -> Dict:
+        """Fetch the current state of one vehicle as a flat metrics record."""
+        return decode_state(await self.request_bytes(f"{vin}/state", {"use_cache": str(use_cache).lower()}))
+
+    async def fetch_fleet(self) -> Tuple[List[Dict], List[Dict]]:
+        """Fetch fleet vehicles and battery health concurrently."""
+        vehicles, health = await asyncio.gather(self.get_vehicles(), self.get_battery_health())
+        return vehicles, health
+
+    async def fetch_fleet_records(self, changed_only: bool = False) -> Tuple[List[Dict], Dict[str, Dict]]:
+        """Fetch vehicle records and the VIN -> battery health map concurrently.
+
+        With ``changed_only``, returns just the vehicles whose state or
+        battery health changed since the previous call on this client
+        (every vehicle on the first call), with their health entries.
+        """
+        records, health = await asyncio.gather(self.get_vehicle_records(), self.get_battery_health_map())
+        if not changed_only:
+            return records, health
+        changed = self._fleet_records.changed | self._health_changed
+        return ([record for record in records if record["vin"] in changed],
+                {vin: health[vin] for vin in changed if vin in health})
+
+    async def fetch_vehicle_details(self, vins: Iterable[str],
+                                    endpoints: Iterable[str] = VEHICLE_ENDPOINTS
+                                    ) -> Dict[str, Dict[str, Union[Dict, List, Exception]]]:
+        """Fetch per-VIN endpoints for many vehicles in parallel.
+
+        A failed call is reported as its TessieAPIError (or SchemaError for a
+        malformed payload) in place of the payload so one unreachable vehicle
+        does not fail the whole refresh.
+        """
+        calls = {
+            "state": self.get_state,
+            "state_record": self.get_state_record,
+            "battery_health": self.get_vehicle_battery_health,
+            "drives": self.get_drives,
+            "charges": self.get_charges,
+        }
+        keys = [(vin, endpoint) for vin in vins for endpoint in endpoints]
+        results = await asyncio.gather(*(calls[endpoint](vin) for vin, endpoint in keys),
+                                       return_exceptions=True)
+        details: Dict[str, Dict] = {}
+        for (vin, endpoint), result in zip(keys, results):
+            if isinstance(result, Exception) and not isinstance(result, (TessieAPIError, SchemaError)):
+                raise result
+            details.setdefault(vin, {})[endpoint] = result
+        return details
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+
+class TessieAPIManager:
+    """Base API manager for Tessie API communication.
+
+    A synchronous facade over AsyncTessieAPI; coroutines run on a private
+    event loop in a background thread so callers need no asyncio code.
+    """
+    def __init__(self, api_key: str, base_url: str = "https://api.tessie.com", **options):
+        self.client = AsyncTessieAPI(api_key, base_url=base_url, **options)
+        self.api_key = api_key
+        self.base_url = self.client.base_url
+        self.session = self.client.session
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="tessie-loop", daemon=True)
+        self._thread.start()
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
 
     def get_vehicles(self) -> List[Dict]:
         """Fetch all vehicles data."""
-        response = self.session.get(f"{self.base_url}/vehicles?only_active=false")
-        return response.json()["results"]
+        return self._run(self.client.get_vehicles())
 
     def get_battery_health(self) -> List[Dict]:
         """Fetch battery health data for all vehicles."""
-        response = self.session.get(f"{self.base_url}/battery_health?distance_format=mi&only_active=false")
-        return response.json()["results"]
\ No newline at end of file
+        return self._run(self.client.get_battery_health())
+
+    def get_state(self, vin: str, use_cache: bool = True) -> Dict:
+        """Fetch the current state of one vehicle."""
+        return self._run(self.client.get_state(vin, use_cache))
+
+    def get_drives(self, vin: str, start: datetime = None, end: datetime = None) -> List[Dict]:
+        """Fetch drives for one vehicle."""
+        return self._run(self.client.get_drives(vin, start, end))
+
+    def get_charges(self, vin: str, start: datetime = None, end: datetime = None) -> List[Dict]:
+        """Fetch charging sessions for one vehicle."""
+        return self._run(self.client.get_charges(vin, start, end))
+
+    def fetch_fleet(self) -> Tuple[List[Dict], List[Dict]]:
+        """Fetch vehicles and battery health concurrently."""
+        return self._run(self.client.fetch_fleet())
+
+    def fetch_fleet_records(self, changed_only: bool = False) -> Tuple[List[Dict], Dict[str, Dict]]:
+        """Fetch decoded vehicle records and battery health concurrently."""
+        return self._run(self.client.fetch_fleet_records(changed_only))
+
+    def fetch_vehicle_details(self, vins: Iterable[str], endpoints: Iterable[str] = VEHICLE_ENDPOINTS) -> Dict:
+        """Fetch per-VIN endpoints for many vehicles in parallel."""
+        return self._run(self.client.fetch_vehicle_details(list(vins), tuple(endpoints)))
+
+    def close(self):
+        """Stop the background loop and release pooled connections."""
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self.client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,47 @@
+import pytest
+
+import decoding
+from decoding import SchemaError
+from synthetic import SyntheticFleet
+
+GARBLED = [b"", b"null", b"[]", b"\xff\xfe", b'{"results": [', b'{"results": 3}']
+BACKENDS = ["msgspec", "json"] if decoding.msgspec is not None else ["json"]
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(decoding, "msgspec", None)
+    return request.param
+
+
+@pytest.mark.parametrize("payload", GARBLED)
+@pytest.mark.parametrize("decode", [decoding.decode_vehicles, decoding.decode_state, decoding.decode_battery_health])
+def test_garbled_payloads_raise_schema_error(backend, decode, payload):
+    with pytest.raises(SchemaError):
+        decode(payload)
+
+
+def test_vehicle_without_state_raises_schema_error(backend):
+    with pytest.raises(SchemaError):
+        decoding.decode_vehicles(b'{"results": [{"vin": "V1"}]}')
+
+
+@pytest.mark.skipif(decoding.msgspec is None, reason="msgspec not installed")
+@pytest.mark.parametrize("decode", [decoding.split_vehicles, decoding.decode_volatile, decoding.decode_static])
+def test_garbled_raw_payloads_raise_schema_error(decode):
+    with pytest.raises(SchemaError):
+        decode(b'{"results": [')
+
+
+def test_decoders_agree(monkeypatch):
+    vehicles, health = SyntheticFleet(5).payload_bytes()
+    records = decoding.decode_vehicles(vehicles)
+    monkeypatch.setattr(decoding, "msgspec", None)
+    assert decoding.decode_vehicles(vehicles) == records
+    assert set(decoding.decode_battery_health(health)) == {record["vin"] for record in records}
+
+
+def test_schema_error_is_a_value_error():
+    with pytest.raises(ValueError):
+        decoding.loads(b"{")
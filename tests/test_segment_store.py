@@ -0,0 +1,104 @@
+import json
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+import segment_store
+from segment_store import DAY_MS, RECORD_DTYPE, SegmentStore
+
+DAY = 1_704_067_200_000  # 2024-01-01 UTC
+MONTH_END = datetime(2024, 2, 1, tzinfo=timezone.utc)
+
+
+def records(timestamps):
+    rows = np.zeros(len(timestamps), RECORD_DTYPE)
+    rows["timestamp"] = timestamps
+    rows["odometer"] = timestamps
+    return rows
+
+
+def stored(root, vin="V1"):
+    return (SegmentStore(root).read(vin)["timestamp"] - DAY).tolist()
+
+
+class Crash(Exception):
+    pass
+
+
+def test_append_and_read(tmp_path):
+    store = SegmentStore(str(tmp_path))
+    store.append("V1", records([DAY + 2, DAY + 1, DAY + DAY_MS]))
+    assert stored(str(tmp_path)) == [1, 2, DAY_MS]
+    assert [name for name, _ in store.segments("V1")] == ["2024-01-01.seg", "2024-01-02.seg"]
+
+
+def test_rows_written_before_a_crashed_index_save_are_discarded(tmp_path, monkeypatch):
+    root = str(tmp_path)
+    SegmentStore(root).append("V1", records([DAY + 1, DAY + 2]))
+    store = SegmentStore(root)
+    with monkeypatch.context() as patch:
+        patch.setattr(SegmentStore, "_save_index", lambda self, vin: (_ for _ in ()).throw(Crash()))
+        with pytest.raises(Crash):
+            store.append("V1", records([DAY + 3, DAY + DAY_MS + 1]))
+
+    recovered = SegmentStore(root)
+    recovered.append("V1", records([DAY + 10, DAY + DAY_MS + 5]))
+    assert stored(root) == [1, 2, 10, DAY_MS + 5]
+
+
+def test_compact_sorts_deduplicates_and_merges_months(tmp_path):
+    root = str(tmp_path)
+    store = SegmentStore(root)
+    store.append("V1", records([DAY + 2, DAY + 1, DAY + 1]))
+    store.append("V1", records([DAY + DAY_MS + 1]))
+    store.compact("V1", MONTH_END)
+
+    assert stored(root) == [1, 2, DAY_MS + 1]
+    assert [name for name, _ in SegmentStore(root).segments("V1")] == ["2024-01.seg"]
+    assert sorted(os.listdir(tmp_path / "V1")) == ["2024-01.1.seg", "index.json"]
+
+
+@pytest.mark.parametrize("crash_after", range(5))
+def test_compact_survives_a_crash_at_any_step(tmp_path, monkeypatch, crash_after):
+    root = str(tmp_path)
+    store = SegmentStore(root)
+    store.append("V1", records([DAY + 2, DAY + 1]))
+    store.append("V1", records([DAY + DAY_MS + 1, DAY + DAY_MS + 3]))
+
+    steps = []
+    remove, write_json = os.remove, segment_store._atomic_write_json
+
+    def step():
+        if len(steps) == crash_after:
+            raise Crash()
+        steps.append(None)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(os, "remove", lambda path: (step(), remove(path)))
+        patch.setattr(segment_store, "_atomic_write_json", lambda path, data: (step(), write_json(path, data)))
+        try:
+            store.compact("V1", MONTH_END)
+        except Crash:
+            pass
+
+    assert stored(root) == [1, 2, DAY_MS + 1, DAY_MS + 3]
+    files = set(os.listdir(tmp_path / "V1")) - {"index.json"}
+    with open(tmp_path / "V1" / "index.json") as f:
+        index = json.load(f)
+    assert files == {meta.get("file", name) for name, meta in index.items()}
+
+
+def test_index_entries_for_missing_or_short_files_are_recovered(tmp_path):
+    root = str(tmp_path)
+    store = SegmentStore(root)
+    store.append("V1", records([DAY + 1, DAY + 2, DAY + 3]))
+    store.append("V1", records([DAY + DAY_MS + 1]))
+    os.truncate(tmp_path / "V1" / "2024-01-01.seg", 2 * RECORD_DTYPE.itemsize + 5)
+    os.remove(tmp_path / "V1" / "2024-01-02.seg")
+
+    assert stored(root) == [1, 2]
+    with open(tmp_path / "V1" / "index.json") as f:
+        index = json.load(f)
+    assert list(index) == ["2024-01-01.seg"] and index["2024-01-01.seg"]["rows"] == 2
@@ -0,0 +1,30 @@
+import pytest
+
+from decoding import decode_vehicles, decode_battery_health
+from fleet import FleetAnalytics
+from sharded import ShardedIngest, plan_synthetic_shards, split_vins
+from synthetic import SyntheticFleet
+
+N_VEHICLES = 300
+
+
+@pytest.fixture(scope="module")
+def single_summary():
+    vehicles, health = SyntheticFleet(N_VEHICLES).payload_bytes()
+    fleet = FleetAnalytics()
+    fleet.ingest_records(decode_vehicles(vehicles), decode_battery_health(health))
+    return fleet.get_fleet_summary()
+
+
+def test_split_vins_partitions_the_fleet():
+    vins = SyntheticFleet(N_VEHICLES).vins
+    parts = split_vins(vins, 3)
+    assert sorted(vin for part in parts for vin in part) == sorted(vins)
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_sharded_summary_matches_single_process(single_summary, workers):
+    result = ShardedIngest(plan_synthetic_shards(N_VEHICLES, workers), workers).run()
+    assert result.summary() == pytest.approx(single_summary)
+    assert len(result.fleet().vehicles) == N_VEHICLES
+    assert result.fleet().get_fleet_summary() == pytest.approx(single_summary)
@@ -0,0 +1,70 @@
+import json
+import math
+
+import pytest
+
+from decoding import decode_vehicles, decode_battery_health
+from fleet import FleetAnalytics
+from metrics_store import MetricsStore
+from segment_store import SegmentStore
+from synthetic import SyntheticFleet
+from vehicle import Vehicle
+
+
+@pytest.fixture
+def record():
+    vehicles, _ = SyntheticFleet(1).payload_bytes()
+    return decode_vehicles(vehicles)[0]
+
+
+def later(record, ms=1000, **changes):
+    return {**record, "timestamp": record["timestamp"] + ms, **changes}
+
+
+def test_value_change_is_stored_even_when_hashes_collide(record):
+    # hash(-1) == hash(-2) in CPython
+    vehicle = Vehicle.from_record({**record, "outside_temp": -1.0})
+    assert vehicle.ingest_record(later(record, outside_temp=-2.0)) is not None
+    assert vehicle.store.latest(vehicle.vin).outside_temp == -2.0
+
+
+def test_unchanged_record_is_skipped(record):
+    vehicle = Vehicle.from_record(record)
+    assert vehicle.ingest_record(later(record)) is None
+    assert len(vehicle.store.history(vehicle.vin)) == 1
+
+
+def test_nan_is_unchanged(record):
+    vehicle = Vehicle.from_record({**record, "speed": math.nan})
+    assert vehicle.ingest_record(later(record, speed=math.nan)) is None
+
+
+def test_health_change_is_stored_with_same_timestamp(record):
+    _, health = SyntheticFleet(1).payload_bytes()
+    entry = decode_battery_health(health)[record["vin"]]
+    vehicle = Vehicle.from_record(record, entry)
+    vehicle.update_battery_health({**entry, "capacity": entry["capacity"] - 1})
+    assert vehicle.ingest_record(dict(record)) is not None
+    assert vehicle.store.latest(vehicle.vin).battery_health.capacity == entry["capacity"] - 1
+
+
+def test_state_payload_path(record):
+    vehicles, _ = SyntheticFleet(1).payload_bytes()
+    vehicle = Vehicle(json.loads(vehicles)["results"][0])
+    state = json.loads(vehicles)["results"][0]["last_state"]
+    state["drive_state"]["timestamp"] += 1000
+    assert vehicle.ingest_state(state) is None
+    state["drive_state"]["timestamp"] += 1000
+    state["charge_state"]["battery_level"] += 1
+    assert vehicle.ingest_state(state) is not None
+
+
+def test_vehicle_rebuilt_from_history_skips_reingested_record(record, tmp_path):
+    fleet = FleetAnalytics(MetricsStore(backing=SegmentStore(str(tmp_path))))
+    fleet.ingest_records([record], {})
+    fleet.store.flush()
+
+    restored = FleetAnalytics.from_store(MetricsStore(backing=SegmentStore(str(tmp_path))))
+    vehicle = restored.get_vehicle(record["vin"])
+    assert vehicle.ingest_record(later(record)) is None
+    assert vehicle.ingest_record(later(record, 2000, battery_level=record["battery_level"] - 1)) is not None
@@ -1,23 +1,73 @@
-from datetime import datetime
-from typing import Dict
-from base import VehicleMetrics, ChargingState, BatteryHealth
+from typing import Any, Dict, List, Optional, Sequence, Union
+import numpy as np
+from base import BatteryHealth
+from metrics_store import MetricsStore, MetricsRow, TimeBound
+from decoding import flatten_state
+from rollups import Interval
+
+
+_MISSING = object()
+
+
+def _same_value(previous: Any, value: Any) -> bool:
+    """Whether a record value is unchanged: BatteryHealth by identity, NaN equal to NaN, others by ``==``."""
+    if isinstance(value, BatteryHealth) or isinstance(previous, BatteryHealth):
+        return previous is value
+    if previous is _MISSING:
+        return False
+    return bool(previous == value) or (previous != previous and value != value)
+
 
 class Vehicle:
     """Class representing a single Tesla vehicle."""
-    def __init__(self, vehicle_data: Dict, battery_health_data: Dict = None):
+    def __init__(self, vehicle_data: Dict, battery_health_data: Dict = None, store: MetricsStore = None):
         self.vin = vehicle_data["vin"]
         self.display_name = vehicle_data["last_state"]["display_name"]
         self.vehicle_type = vehicle_data["last_state"]["vehicle_config"]["car_type"]
-        self.metrics_history = []
+        self.store = store if store is not None else MetricsStore()
+        self._last_timestamp = None
+        self._field_values: Dict[str, Any] = {}
 
         self.battery_health = None
         if battery_health_data:
             self.update_battery_health(battery_health_data)
         self.update_metrics(vehicle_data["last_state"])
 
+    @classmethod
+    def from_record(cls, record: Dict[str, Any], battery_health_data: Dict = None,
+                    store: MetricsStore = None) -> "Vehicle":
+        """Create a vehicle from a flat record produced by decoding.decode_vehicles."""
+        vehicle = cls.__new__(cls)
+        vehicle.vin = record["vin"]
+        vehicle.display_name = record["display_name"]
+        vehicle.vehicle_type = record["model_type"]
+        vehicle.store = store if store is not None else MetricsStore()
+        vehicle._last_timestamp = None
+        vehicle._field_values = {}
+        vehicle.battery_health = None
+        if battery_health_data:
+            vehicle.update_battery_health(battery_health_data)
+        vehicle.update_record(record)
+        return vehicle
+
+    @classmethod
+    def from_store(cls, vin: str, store: MetricsStore) -> "Vehicle":
+        """Rebuild a vehicle from history already held in (or persisted behind) a store."""
+        latest = store.latest(vin)
+        if latest is None:
+            raise KeyError(vin)
+        vehicle = cls.__new__(cls)
+        vehicle.vin = vin
+        vehicle.display_name = latest.display_name
+        vehicle.vehicle_type = latest.model_type
+        vehicle.store = store
+        vehicle.battery_health = latest.battery_health
+        vehicle._remember(store.record(vin))
+        return vehicle
+
     def update_battery_health(self, health_data: Dict):
         """Update battery health data."""
-        self.battery_health = BatteryHealth(
+        health = BatteryHealth(
             max_range=health_data['max_range'],
             max_ideal_range=health_data['max_ideal_range'],
             capacity=health_data['capacity'],
@@ -25,49 +75,104 @@ class Vehicle:
             degradation_percent=health_data['degradation_percent'],
             health_percent=health_data['health_percent']
         )
+        # Keep the existing object when nothing changed so snapshots share it.
+        if health != self.battery_health:
+            self.battery_health = health
+
+    @property
+    def metrics_history(self) -> List[MetricsRow]:
+        """Row views of every stored snapshot, oldest first."""
+        return self.store.history(self.vin)
 
-    def update_metrics(self, state_data: Dict) -> VehicleMetrics:
+    def attach_store(self, store: MetricsStore):
+        """Move this vehicle's history into another (usually fleet-wide) store."""
+        if store is not self.store:
+            store.adopt(self.store, self.vin)
+            self.store = store
+
+    def update_metrics(self, state_data: Dict) -> MetricsRow:
         """Update vehicle metrics from state data."""
-        config = state_data['vehicle_config']
-        charge_state = state_data['charge_state']
+        return self.update_record(flatten_state(state_data))
 
-        lifetime_energy = (
-            charge_state.get('lifetime_energy_used')
-            if charge_state.get('lifetime_energy_used') is not None
-            else 0.0
-        )
+    def update_record(self, record: Dict[str, Any]) -> MetricsRow:
+        """Append a snapshot from a flat decoded record."""
+        record = self._complete(record)
+        self._remember(record)
+        return self.store.append(self.vin, record)
 
-        metrics = VehicleMetrics(
-            timestamp=datetime.fromtimestamp(state_data['drive_state']['timestamp'] / 1000),
-            is_active=state_data['state'] == 'online',
-            display_name=state_data['display_name'],
-            vin=self.vin,
-
-            battery_level=charge_state['battery_level'],
-            battery_range=charge_state['battery_range'],
-            charging_state=ChargingState(charge_state['charging_state']),
-            lifetime_energy_used=lifetime_energy,
-
-            battery_health=self.battery_health,
-
-            latitude=state_data['drive_state']['latitude'],
-            longitude=state_data['drive_state']['longitude'],
-            speed=state_data['drive_state']['speed'],
-            power=state_data['drive_state']['power'] or 0,
-            odometer=state_data['vehicle_state']['odometer'],
-
-            inside_temp=state_data['climate_state']['inside_temp'],
-            outside_temp=state_data['climate_state']['outside_temp'],
-            is_climate_on=state_data['climate_state']['is_climate_on'],
-
-            model_type=config['car_type'],
-            performance_package=config['performance_package'],
-            trim_badging=config['trim_badging'],
-            efficiency_package=config['efficiency_package']
-        )
-        self.metrics_history.append(metrics)
-        return metrics
+    def ingest_state(self, state_data: Dict) -> Optional[MetricsRow]:
+        """Append a snapshot only if the state changed since the last one.
+
+        Snapshots with an unchanged drive_state timestamp are skipped outright
+        unless the battery health changed, so health updates are always kept;
+        otherwise the tracked fields are hashed and compared field by field.
+        Returns the new row, or None when nothing changed.
+        """
+        if state_data['drive_state']['timestamp'] == self._last_timestamp and not self._health_changed():
+            return None
+        return self.ingest_record(flatten_state(state_data))
+
+    def ingest_record(self, record: Dict[str, Any]) -> Optional[MetricsRow]:
+        """Like ingest_state, for a flat decoded record."""
+        if record['timestamp'] == self._last_timestamp and not self._health_changed():
+            return None
+        record = self._complete(record)
+        if not self.changed_fields(record):
+            self._last_timestamp = record['timestamp']
+            return None
+        self._remember(record)
+        return self.store.append(self.vin, record)
+
+    def changed_fields(self, record: Dict[str, Any]) -> List[str]:
+        """Fields of a record whose values differ from the last stored snapshot."""
+        previous = self._field_values
+        return [
+            name for name, value in record.items()
+            if name != 'timestamp' and not _same_value(previous.get(name, _MISSING), value)
+        ]
+
+    def _health_changed(self) -> bool:
+        return not _same_value(self._field_values.get('battery_health', _MISSING), self.battery_health)
+
+    def _remember(self, record: Dict[str, Any]):
+        self._last_timestamp = record['timestamp']
+        self._field_values = {name: value for name, value in record.items() if name != 'timestamp'}
+
+    def _complete(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """A copy of a decoded record with the vehicle-level fields it does not carry.
+
+        The caller's record is left as is: decoders such as FleetRecordCache
+        keep their records to compare with the next response.
+        """
+        return {**record, 'vin': self.vin, 'battery_health': self.battery_health}
+
+    def battery_health_history(self, start: TimeBound = None, end: TimeBound = None) -> Dict[str, Any]:
+        """Battery health samples recorded for this vehicle (see MetricsStore.health_history)."""
+        return self.store.health_history(self.vin, start, end)
+
+    def window(self, fields: Union[str, Sequence[str]], start: TimeBound = None, end: TimeBound = None,
+               aggs: Sequence[str] = ("mean",)) -> Dict[str, Dict[str, float]]:
+        """Aggregates of metrics over [start, end), e.g. ``window("battery_level", aggs=("mean", "p95"))``."""
+        return self.store.rollups.window(self.vin, fields, start, end, aggs)
+
+    def resample(self, field: str, every: Interval, aggs: Sequence[str] = ("mean",),
+                 start: TimeBound = None, end: TimeBound = None) -> Dict[str, np.ndarray]:
+        """A metric downsampled into ``every``-wide buckets, e.g. ``resample("battery_level", "1h")``."""
+        return self.store.rollups.resample(self.vin, field, every, aggs, start, end)
+
+    def rolling(self, field: str, window: Interval, every: Interval, agg: str = "mean",
+                start: TimeBound = None, end: TimeBound = None) -> Dict[str, np.ndarray]:
+        """A trailing-window aggregate of a metric, evaluated every ``every``."""
+        return self.store.rollups.rolling(self.vin, field, window, every, agg, start, end)
+
+    def efficiency_between(self, start: TimeBound = None, end: TimeBound = None) -> Optional[float]:
+        """kWh per mile over [start, end) from the lifetime energy and odometer counters."""
+        deltas = self.window(("lifetime_energy_used", "odometer"), start, end, ("delta",))
+        energy, miles = deltas["lifetime_energy_used"]["delta"], deltas["odometer"]["delta"]
+        if not miles > 0 or np.isnan(energy):
+            return None
+        return energy / miles
 
-    def get_latest_metrics(self):
+    def get_latest_metrics(self) -> Optional[MetricsRow]:
         """Get the latest vehicle metrics."""
-        return self.metrics_history[-1] if self.metrics_history else None
\ No newline at end of file
+        return self.store.latest(self.vin)
\ No newline at end of file
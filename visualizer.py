@@ -1,178 +1,23 @@
+import base64
+import gzip
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
 import plotly.graph_objects as go
-from typing import List
+from plotly.offline import get_plotlyjs, get_plotlyjs_version
+import numpy as np
+from instrumentation import metrics
+import pandas as pd
+from typing import IO, Callable, Dict, List, Optional, Tuple
 from vehicle import Vehicle
+from fleet import FleetAnalytics, build_latest_view
 
-class FleetVisualizer:
-    """Class for creating fleet data visualizations."""
-    def __init__(self, vehicles: List[Vehicle]):
-        self.vehicles = vehicles
-
-    def create_dashboard(self, output_file: str = "dashboard.html"):
-        """Create an interactive dashboard of fleet metrics."""
-        # Battery levels
-        fig_battery = go.Figure()
-        for vehicle in self.vehicles:
-            metrics = vehicle.get_latest_metrics()
-            fig_battery.add_trace(
-                go.Bar(
-                    name=vehicle.display_name,
-                    x=[vehicle.display_name],
-                    y=[metrics.battery_level],
-                    text=[f"{metrics.battery_level}%"]
-                )
-            )
-        fig_battery.update_layout(
-            title="Vehicle Battery Levels",
-            yaxis_title="Battery Level (%)"
-        )
-
-        # Vehicle locations
-        fig_map = go.Figure()
-        fig_map.add_trace(
-            go.Scattermapbox(
-                lat=[v.get_latest_metrics().latitude for v in self.vehicles],
-                lon=[v.get_latest_metrics().longitude for v in self.vehicles],
-                mode='markers+text',
-                marker=dict(size=12),
-                text=[v.display_name for v in self.vehicles],
-                name="Vehicle Locations"
-            )
-        )
-        fig_map.update_layout(
-            title="Vehicle Locations",
-            mapbox=dict(
-                style="carto-positron",
-                zoom=10,
-                center=dict(
-                    lat=sum(v.get_latest_metrics().latitude for v in self.vehicles) / len(self.vehicles),
-                    lon=sum(v.get_latest_metrics().longitude for v in self.vehicles) / len(self.vehicles)
-                )
-            )
-        )
-
-        # Lifetime Energy Usage
-        fig_energy = go.Figure()
-        for vehicle in self.vehicles:
-            metrics = vehicle.get_latest_metrics()
-            if metrics.lifetime_energy_used is not None:
-                fig_energy.add_trace(
-                    go.Bar(
-                        name=vehicle.display_name,
-                        x=[vehicle.display_name],
-                        y=[metrics.lifetime_energy_used],
-                        text=[f"{metrics.lifetime_energy_used:,.0f} kWh"],
-                        textposition='auto',
-                    )
-                )
-        fig_energy.update_layout(
-            title="Lifetime Energy Usage",
-            yaxis_title="Energy Used (kWh)"
-        )
-
-        # Battery Health Comparison
-        fig_health = go.Figure()
-        fig_health.add_trace(
-            go.Bar(
-                name="Health",
-                x=[v.display_name for v in self.vehicles],
-                y=[v.get_latest_metrics().battery_health.health_percent for v in self.vehicles],
-                text=[f"{v.get_latest_metrics().battery_health.health_percent}%" for v in self.vehicles],
-                textposition='auto',
-                marker_color='green'
-            )
-        )
-        fig_health.add_trace(
-            go.Bar(
-                name="Degradation",
-                x=[v.display_name for v in self.vehicles],
-                y=[v.get_latest_metrics().battery_health.degradation_percent for v in self.vehicles],
-                text=[f"{v.get_latest_metrics().battery_health.degradation_percent}%" for v in self.vehicles],
-                textposition='auto',
-                marker_color='red'
-            )
-        )
-        fig_health.update_layout(
-            title="Battery Health vs Degradation",
-            yaxis_title="Percentage",
-            barmode='group'
-        )
-
-        # Battery Capacity Comparison
-        fig_capacity = go.Figure()
-        for vehicle in self.vehicles:
-            metrics = vehicle.get_latest_metrics()
-            health = metrics.battery_health
-            fig_capacity.add_trace(
-                go.Bar(
-                    name=vehicle.display_name,
-                    x=['Current', 'Original'],
-                    y=[health.capacity, health.original_capacity],
-                    text=[f"{health.capacity:.1f} kWh", f"{health.original_capacity:.1f} kWh"],
-                    textposition='auto',
-                )
-            )
-        fig_capacity.update_layout(
-            title="Battery Capacity Comparison",
-            yaxis_title="Capacity (kWh)",
-            barmode='group'
-        )
-
-        # Range vs Odometer Scatter
-        fig_range = go.Figure()
-        fig_range.add_trace(
-            go.Scatter(
-                x=[v.get_latest_metrics().odometer for v in self.vehicles],
-                y=[v.get_latest_metrics().battery_health.max_range for v in self.vehicles],
-                mode='markers+text',
-                text=[v.display_name for v in self.vehicles],
-                textposition="top center",
-                marker=dict(
-                    size=12,
-                    color=[v.get_latest_metrics().battery_health.health_percent for v in self.vehicles],
-                    colorscale='Viridis',
-                    showscale=True,
-                    colorbar=dict(title="Health %")
-                )
-            )
-        )
-        fig_range.update_layout(
-            title="Maximum Range vs Odometer",
-            xaxis_title="Odometer (miles)",
-            yaxis_title="Maximum Range (miles)"
-        )
-
-        # Model Comparison Table
-        model_data = []
-        for vehicle in self.vehicles:
-            metrics = vehicle.get_latest_metrics()
-            health = metrics.battery_health
-            model_data.append([
-                vehicle.display_name,
-                metrics.model_type,
-                metrics.performance_package,
-                f"{metrics.odometer:,.0f}",
-                f"{health.health_percent:.1f}%",
-                f"{health.max_range:.0f}",
-                f"{health.capacity:.1f}"
-            ])
-
-        fig_models = go.Figure(data=[go.Table(
-            header=dict(
-                values=['Vehicle', 'Model', 'Performance', 'Odometer', 'Health', 'Max Range', 'Capacity'],
-                fill_color='paleturquoise',
-                align='left'
-            ),
-            cells=dict(
-                values=list(zip(*model_data)),
-                fill_color='lavender',
-                align='left'
-            )
-        )])
-        fig_models.update_layout(title="Vehicle Comparison")
+# Map center (contiguous US) when no vehicle has a known position.
+DEFAULT_MAP_CENTER = {"lat": 39.83, "lon": -98.58}
 
-        # Export to HTML
-        with open(output_file, 'w') as f:
-            f.write("""
+DASHBOARD_HEAD = """
             <html>
             <head>
                 <title>Tesla Fleet Dashboard</title>
@@ -223,21 +68,570 @@ class FleetVisualizer:
                 <h1>Tesla Fleet Analytics Dashboard</h1>
                 <div class="dashboard">
                     <div class="section-title"><h2>Current Status</h2></div>
-                    <div class="plot">
-            """)
-            f.write(fig_battery.to_html(full_html=False, include_plotlyjs='cdn'))
-            f.write('</div><div class="plot">')
-            f.write(fig_map.to_html(full_html=False, include_plotlyjs=False))
-            f.write('</div><div class="plot">')
-            f.write(fig_energy.to_html(full_html=False, include_plotlyjs=False))
-            f.write('</div><div class="section-title"><h2>Battery Health Analysis</h2></div>')
-            f.write('<div class="plot">')
-            f.write(fig_health.to_html(full_html=False, include_plotlyjs=False))
-            f.write('</div><div class="plot">')
-            f.write(fig_capacity.to_html(full_html=False, include_plotlyjs=False))
-            f.write('</div><div class="plot">')
-            f.write(fig_range.to_html(full_html=False, include_plotlyjs=False))
-            f.write('</div><div class="wide-plot">')
-            f.write(fig_models.to_html(full_html=False, include_plotlyjs=False))            
-            f.write('</div></div><footer>Created by Group 7 - CIS3120</footer></body></html>')
-            
+"""
+DASHBOARD_FOOT = '</div></div><footer>Created by Group 7 - CIS3120</footer></body></html>'
+# Fleets larger than this get the scalable dashboard when mode="auto".
+SCALABLE_THRESHOLD = 200
+# Classic dashboards for fleets this large build their figures in a process pool.
+PARALLEL_THRESHOLD = 50
+
+# Decodes the shared data blob into typed arrays, binds columns into each
+# figure's traces and plots it. Bindings: {trace, attr, column[, index][, array]}.
+SCALABLE_SCRIPT = """
+(function () {
+    var blob = JSON.parse(document.getElementById('fleet-data').textContent);
+    var figures = JSON.parse(document.getElementById('fleet-figures').textContent);
+    var types = {float32: Float32Array, float64: Float64Array, int32: Int32Array, int16: Int16Array, uint8: Uint8Array};
+    var cache = {};
+    function column(name) {
+        if (!(name in cache)) {
+            var spec = blob.columns[name];
+            if (spec.strings) {
+                cache[name] = spec.strings;
+            } else {
+                var raw = atob(spec.data), bytes = new Uint8Array(raw.length);
+                for (var i = 0; i < raw.length; i++) bytes[i] = raw.charCodeAt(i);
+                var values = new types[spec.dtype](bytes.buffer);
+                cache[name] = spec.categories ? Array.from(values, function (code) {
+                    return code < 0 ? null : spec.categories[code];
+                }) : values;
+            }
+        }
+        return cache[name];
+    }
+    function assign(target, path, value) {
+        var keys = path.split('.');
+        for (var i = 0; i < keys.length - 1; i++) target = target[keys[i]] = target[keys[i]] || {};
+        target[keys[keys.length - 1]] = value;
+    }
+    function bound(binding) {
+        var values = column(binding.column);
+        if (binding.index) {
+            return Array.from(column(binding.index), function (i) { return values[i]; });
+        }
+        return binding.array ? Array.from(values) : values;
+    }
+    figures.forEach(function (figure) {
+        figure.bindings.forEach(function (binding) {
+            assign(figure.data[binding.trace], binding.attr, bound(binding));
+        });
+        Plotly.newPlot(figure.div, figure.data, figure.layout, {responsive: true});
+    });
+    if (!blob.live) return;
+    // Live mode: {positions, columns} deltas patch the cached columns in
+    // place, then only the traces bound to a changed column are restyled.
+    var source = new EventSource(blob.live);
+    source.addEventListener('reload', function () { location.reload(); });
+    source.addEventListener('update', function (event) {
+        var delta = JSON.parse(event.data);
+        Object.keys(delta.columns).forEach(function (name) {
+            var values = column(name), spec = blob.columns[name], updates = delta.columns[name];
+            delta.positions.forEach(function (position, i) {
+                var value = updates[i];
+                values[position] = value === null && !spec.categories && !spec.strings ? NaN : value;
+            });
+        });
+        figures.forEach(function (figure) {
+            figure.bindings.forEach(function (binding) {
+                if (!(binding.column in delta.columns)) return;
+                var update = {};
+                update[binding.attr] = [bound(binding)];
+                Plotly.restyle(figure.div, update, [binding.trace]);
+            });
+        });
+    });
+})();
+"""
+
+
+# Columns of the scalable data blob besides "name" and "energy_index".
+SCALABLE_FLOAT_COLUMNS = ("latitude", "longitude", "lifetime_energy_used", "odometer", "health_percent",
+                          "degradation_percent", "capacity", "original_capacity", "max_range")
+SCALABLE_CATEGORY_COLUMNS = ("model_type", "performance_package")
+SCALABLE_COLUMNS = ("battery_level",) + SCALABLE_FLOAT_COLUMNS + SCALABLE_CATEGORY_COLUMNS
+
+
+def _encode_column(values: np.ndarray, dtype) -> Dict:
+    """Base64 little-endian typed-array encoding of one numeric column."""
+    dtype = np.dtype(dtype).newbyteorder('<')
+    data = np.ascontiguousarray(values, dtype=dtype).tobytes()
+    return {"dtype": dtype.name, "data": base64.b64encode(data).decode("ascii")}
+
+
+def _encode_categories(values: np.ndarray) -> Dict:
+    """Dictionary-encode a string column as int16 codes plus its categories."""
+    codes, categories = pd.factorize(values)
+    return {**_encode_column(codes, np.int16), "categories": [str(c) for c in categories]}
+
+
+def _figure_spec(div: str, figure: go.Figure, bindings: List[Dict]) -> Dict:
+    """A figure's JSON with empty data arrays that ``bindings`` fill from the blob."""
+    spec = json.loads(figure.to_json())
+    return {"div": div, "data": spec["data"], "layout": spec["layout"], "bindings": bindings}
+
+
+def figure_battery(view: Dict[str, np.ndarray]) -> go.Figure:
+    """Bar chart of battery levels, one trace per vehicle."""
+    names = view["name"]
+    fig_battery = go.Figure()
+    for name, level in zip(names, view["battery_level"].tolist()):
+        fig_battery.add_trace(
+            go.Bar(
+                name=name,
+                x=[name],
+                y=[level],
+                text=[f"{level}%"]
+            )
+        )
+    fig_battery.update_layout(
+        title="Vehicle Battery Levels",
+        yaxis_title="Battery Level (%)"
+    )
+    return fig_battery
+
+
+def map_center(view: Dict[str, np.ndarray]) -> Dict[str, float]:
+    """Mean position of the vehicles with a known location, or DEFAULT_MAP_CENTER if none has one."""
+    latitude, longitude = view["latitude"], view["longitude"]
+    located = np.isfinite(latitude) & np.isfinite(longitude)
+    if not located.any():
+        return dict(DEFAULT_MAP_CENTER)
+    return dict(lat=float(latitude[located].mean()), lon=float(longitude[located].mean()))
+
+
+def figure_map(view: Dict[str, np.ndarray]) -> go.Figure:
+    """Map of vehicle locations."""
+    names = view["name"]
+    fig_map = go.Figure()
+    fig_map.add_trace(
+        go.Scattermapbox(
+            lat=view["latitude"].tolist(),
+            lon=view["longitude"].tolist(),
+            mode='markers+text',
+            marker=dict(size=12),
+            text=names.tolist(),
+            name="Vehicle Locations"
+        )
+    )
+    fig_map.update_layout(
+        title="Vehicle Locations",
+        mapbox=dict(
+            style="carto-positron",
+            zoom=10,
+            center=map_center(view)
+        )
+    )
+    return fig_map
+
+
+def figure_energy(view: Dict[str, np.ndarray]) -> go.Figure:
+    """Bar chart of lifetime energy use, one trace per vehicle with data."""
+    names = view["name"]
+    fig_energy = go.Figure()
+    for name, energy in zip(names, view["lifetime_energy_used"].tolist()):
+        if not np.isnan(energy):
+            fig_energy.add_trace(
+                go.Bar(
+                    name=name,
+                    x=[name],
+                    y=[energy],
+                    text=[f"{energy:,.0f} kWh"],
+                    textposition='auto',
+                )
+            )
+    fig_energy.update_layout(
+        title="Lifetime Energy Usage",
+        yaxis_title="Energy Used (kWh)"
+    )
+    return fig_energy
+
+
+def figure_health(view: Dict[str, np.ndarray]) -> go.Figure:
+    """Grouped bars of battery health and degradation."""
+    names = view["name"]
+    health_percent = view["health_percent"].tolist()
+    degradation_percent = view["degradation_percent"].tolist()
+    fig_health = go.Figure()
+    fig_health.add_trace(
+        go.Bar(
+            name="Health",
+            x=names.tolist(),
+            y=health_percent,
+            text=[f"{value}%" for value in health_percent],
+            textposition='auto',
+            marker_color='green'
+        )
+    )
+    fig_health.add_trace(
+        go.Bar(
+            name="Degradation",
+            x=names.tolist(),
+            y=degradation_percent,
+            text=[f"{value}%" for value in degradation_percent],
+            textposition='auto',
+            marker_color='red'
+        )
+    )
+    fig_health.update_layout(
+        title="Battery Health vs Degradation",
+        yaxis_title="Percentage",
+        barmode='group'
+    )
+    return fig_health
+
+
+def figure_capacity(view: Dict[str, np.ndarray]) -> go.Figure:
+    """Current vs original capacity, one trace per vehicle."""
+    names = view["name"]
+    fig_capacity = go.Figure()
+    for name, capacity, original in zip(names, view["capacity"].tolist(), view["original_capacity"].tolist()):
+        fig_capacity.add_trace(
+            go.Bar(
+                name=name,
+                x=['Current', 'Original'],
+                y=[capacity, original],
+                text=[f"{capacity:.1f} kWh", f"{original:.1f} kWh"],
+                textposition='auto',
+            )
+        )
+    fig_capacity.update_layout(
+        title="Battery Capacity Comparison",
+        yaxis_title="Capacity (kWh)",
+        barmode='group'
+    )
+    return fig_capacity
+
+
+def figure_range(view: Dict[str, np.ndarray]) -> go.Figure:
+    """Scatter of maximum range against odometer, coloured by health."""
+    names = view["name"]
+    health_percent = view["health_percent"].tolist()
+    fig_range = go.Figure()
+    fig_range.add_trace(
+        go.Scatter(
+            x=view["odometer"].tolist(),
+            y=view["max_range"].tolist(),
+            mode='markers+text',
+            text=names.tolist(),
+            textposition="top center",
+            marker=dict(
+                size=12,
+                color=health_percent,
+                colorscale='Viridis',
+                showscale=True,
+                colorbar=dict(title="Health %")
+            )
+        )
+    )
+    fig_range.update_layout(
+        title="Maximum Range vs Odometer",
+        xaxis_title="Odometer (miles)",
+        yaxis_title="Maximum Range (miles)"
+    )
+    return fig_range
+
+
+def figure_models(view: Dict[str, np.ndarray]) -> go.Figure:
+    """Table comparing every vehicle."""
+    names = view["name"]
+    health_percent = view["health_percent"].tolist()
+    fig_models = go.Figure(data=[go.Table(
+        header=dict(
+            values=['Vehicle', 'Model', 'Performance', 'Odometer', 'Health', 'Max Range', 'Capacity'],
+            fill_color='paleturquoise',
+            align='left'
+        ),
+        cells=dict(
+            values=[
+                names.tolist(),
+                view["model_type"].tolist(),
+                view["performance_package"].tolist(),
+                [f"{value:,.0f}" for value in view["odometer"].tolist()],
+                [f"{value:.1f}%" for value in health_percent],
+                [f"{value:.0f}" for value in view["max_range"].tolist()],
+                [f"{value:.1f}" for value in view["capacity"].tolist()],
+            ],
+            fill_color='lavender',
+            align='left'
+        )
+    )])
+    fig_models.update_layout(title="Vehicle Comparison")
+    return fig_models
+
+
+FIGURE_BUILDERS: Dict[str, Callable[[Dict[str, np.ndarray]], go.Figure]] = {
+    "battery": figure_battery,
+    "map": figure_map,
+    "energy": figure_energy,
+    "health": figure_health,
+    "capacity": figure_capacity,
+    "range": figure_range,
+    "models": figure_models,
+}
+# View columns each figure reads; only these are shipped to worker processes.
+FIGURE_COLUMNS = {
+    "battery": ("name", "battery_level"),
+    "map": ("name", "latitude", "longitude"),
+    "energy": ("name", "lifetime_energy_used"),
+    "health": ("name", "health_percent", "degradation_percent"),
+    "capacity": ("name", "capacity", "original_capacity"),
+    "range": ("name", "odometer", "max_range", "health_percent"),
+    "models": ("name", "model_type", "performance_package", "odometer", "health_percent", "max_range", "capacity"),
+}
+# Classic layout: each figure with the markup written before it, in page order.
+CLASSIC_SECTIONS = [
+    ("battery", DASHBOARD_HEAD + '                    <div class="plot">\n            '),
+    ("map", '</div><div class="plot">'),
+    ("energy", '</div><div class="plot">'),
+    ("health", '</div><div class="section-title"><h2>Battery Health Analysis</h2></div><div class="plot">'),
+    ("capacity", '</div><div class="plot">'),
+    ("range", '</div><div class="plot">'),
+    ("models", '</div><div class="wide-plot">'),
+]
+
+
+def render_figure(key: str, view: Dict[str, np.ndarray], include_plotlyjs) -> Tuple[str, Dict[str, float]]:
+    """Build one classic figure and serialize it to an HTML fragment, with timings."""
+    started = time.perf_counter()
+    figure = FIGURE_BUILDERS[key](view)
+    built = time.perf_counter()
+    html = figure.to_html(full_html=False, include_plotlyjs=include_plotlyjs)
+    return html, {"build": built - started, "serialize": time.perf_counter() - built, "bytes": len(html)}
+
+
+def open_output(output_file: str, compress: Optional[bool] = None) -> IO[str]:
+    """Open a dashboard file for writing, gzip-compressed if asked or named *.gz."""
+    if compress is None:
+        compress = output_file.endswith(".gz")
+    if compress:
+        return gzip.open(output_file, 'wt', encoding='utf-8')
+    return open(output_file, 'w')
+
+
+class FleetVisualizer:
+    """Class for creating fleet data visualizations."""
+    def __init__(self, vehicles: List[Vehicle], fleet: FleetAnalytics = None):
+        self.vehicles = vehicles
+        self.fleet = fleet
+        self.timings: Dict[str, Dict[str, float]] = {}
+
+    def _latest_view(self):
+        """Latest per-vehicle values, reusing the fleet's incrementally refreshed view when available."""
+        if self.fleet is not None and self.fleet.vehicles is self.vehicles:
+            return self.fleet.latest_view()
+        return build_latest_view(self.vehicles)
+
+    def create_dashboard(self, output_file: str = "dashboard.html", mode: str = "auto", offline: bool = True,
+                         workers: Optional[int] = None, compress: Optional[bool] = None):
+        """Create an interactive dashboard of fleet metrics.
+
+        ``mode`` is "classic" (a labelled trace per vehicle), "scalable" (see
+        create_scalable_dashboard) or "auto", which switches to scalable for
+        fleets over SCALABLE_THRESHOLD vehicles.
+
+        Classic figures are built and serialized concurrently in a process
+        pool of ``workers`` processes (default: one per CPU from
+        PARALLEL_THRESHOLD vehicles, else in-process) and streamed to the
+        file in page order. ``compress`` gzips the output (default: when
+        ``output_file`` ends in ".gz"). Per-figure timings are left in
+        ``self.timings``.
+        """
+        if mode == "auto":
+            mode = "scalable" if len(self.vehicles) > SCALABLE_THRESHOLD else "classic"
+        if mode == "scalable":
+            return self.create_scalable_dashboard(output_file, offline, compress)
+        if mode != "classic":
+            raise ValueError(f"unknown dashboard mode: {mode}")
+
+        view = self._latest_view()
+        self.timings = {}
+        started = time.perf_counter()
+        if workers is None:
+            workers = (os.cpu_count() or 1) if len(self.vehicles) >= PARALLEL_THRESHOLD else 1
+
+        with ExitStack() as stack:
+            if workers > 1:
+                pool = stack.enter_context(ProcessPoolExecutor(max_workers=min(workers, len(CLASSIC_SECTIONS))))
+                parts = [pool.submit(render_figure, key, {name: view[name] for name in FIGURE_COLUMNS[key]},
+                                     'cdn' if index == 0 else False)
+                         for index, (key, _) in enumerate(CLASSIC_SECTIONS)]
+                results = (part.result() for part in parts)
+            else:
+                results = (render_figure(key, view, 'cdn' if index == 0 else False)
+                           for index, (key, _) in enumerate(CLASSIC_SECTIONS))
+
+            # Sections are written in page order as soon as each one is ready.
+            f = stack.enter_context(open_output(output_file, compress))
+            for (key, prefix), (html, timing) in zip(CLASSIC_SECTIONS, results):
+                f.write(prefix)
+                f.write(html)
+                self.timings[key] = timing
+            f.write(DASHBOARD_FOOT)
+        self.timings["total"] = {"seconds": time.perf_counter() - started, "workers": workers}
+        self._record_timings("classic")
+
+    def _data_blob(self, view: Dict[str, np.ndarray], events_url: str = None) -> Dict:
+        """Every column the scalable figures reference, encoded once."""
+        energy_index = np.flatnonzero(~np.isnan(view["lifetime_energy_used"]))
+        columns = {"name": {"strings": view["name"].tolist()}, "energy_index": _encode_column(energy_index, np.int32)}
+        columns["battery_level"] = _encode_column(view["battery_level"], np.uint8)
+        for name in SCALABLE_FLOAT_COLUMNS:
+            columns[name] = _encode_column(view[name], np.float32)
+        for name in SCALABLE_CATEGORY_COLUMNS:
+            columns[name] = _encode_categories(view[name])
+        blob = {"vehicles": len(view["name"]), "columns": columns}
+        if events_url:
+            blob["live"] = events_url
+        return blob
+
+    def _scalable_figures(self, view: Dict[str, np.ndarray]) -> List[Dict]:
+        """Figure specs with one vectorized trace per series and no per-vehicle labels."""
+        figures = []
+
+        fig_battery = go.Figure(go.Bar(x=[], y=[], hovertemplate="%{x}: %{y}%<extra></extra>"))
+        fig_battery.update_layout(title="Vehicle Battery Levels", yaxis_title="Battery Level (%)")
+        figures.append(_figure_spec("fig-battery", fig_battery, [
+            {"trace": 0, "attr": "x", "column": "name"},
+            {"trace": 0, "attr": "y", "column": "battery_level"},
+        ]))
+
+        fig_map = go.Figure([
+            go.Densitymapbox(lat=[], lon=[], radius=10, showscale=False, name="Density"),
+            go.Scattermapbox(lat=[], lon=[], mode='markers', marker=dict(size=5), hovertext=[],
+                             hoverinfo='text', name="Vehicle Locations"),
+        ])
+        fig_map.update_layout(
+            title="Vehicle Locations",
+            mapbox=dict(
+                style="carto-positron",
+                zoom=3 if len(view["name"]) > SCALABLE_THRESHOLD else 10,
+                center=map_center(view)
+            )
+        )
+        figures.append(_figure_spec("fig-map", fig_map, [
+            {"trace": trace, "attr": attr, "column": column}
+            for trace in (0, 1) for attr, column in (("lat", "latitude"), ("lon", "longitude"))
+        ] + [{"trace": 1, "attr": "hovertext", "column": "name"}]))
+
+        fig_energy = go.Figure(go.Bar(x=[], y=[], hovertemplate="%{x}: %{y:,.0f} kWh<extra></extra>"))
+        fig_energy.update_layout(title="Lifetime Energy Usage", yaxis_title="Energy Used (kWh)")
+        figures.append(_figure_spec("fig-energy", fig_energy, [
+            {"trace": 0, "attr": "x", "column": "name", "index": "energy_index"},
+            {"trace": 0, "attr": "y", "column": "lifetime_energy_used", "index": "energy_index"},
+        ]))
+
+        fig_health = go.Figure([
+            go.Bar(name="Health", x=[], y=[], marker_color='green', hovertemplate="%{x}: %{y:.1f}%"),
+            go.Bar(name="Degradation", x=[], y=[], marker_color='red', hovertemplate="%{x}: %{y:.1f}%"),
+        ])
+        fig_health.update_layout(title="Battery Health vs Degradation", yaxis_title="Percentage", barmode='group')
+        figures.append(_figure_spec("fig-health", fig_health, [
+            {"trace": 0, "attr": "x", "column": "name"},
+            {"trace": 0, "attr": "y", "column": "health_percent"},
+            {"trace": 1, "attr": "x", "column": "name"},
+            {"trace": 1, "attr": "y", "column": "degradation_percent"},
+        ]))
+
+        fig_capacity = go.Figure([
+            go.Bar(name="Current", x=[], y=[], hovertemplate="%{x}: %{y:.1f} kWh"),
+            go.Bar(name="Original", x=[], y=[], hovertemplate="%{x}: %{y:.1f} kWh"),
+        ])
+        fig_capacity.update_layout(title="Battery Capacity Comparison", yaxis_title="Capacity (kWh)", barmode='group')
+        figures.append(_figure_spec("fig-capacity", fig_capacity, [
+            {"trace": 0, "attr": "x", "column": "name"},
+            {"trace": 0, "attr": "y", "column": "capacity"},
+            {"trace": 1, "attr": "x", "column": "name"},
+            {"trace": 1, "attr": "y", "column": "original_capacity"},
+        ]))
+
+        fig_range = go.Figure(go.Scattergl(
+            x=[], y=[], mode='markers', hovertext=[], hoverinfo='text+x+y',
+            marker=dict(size=6, color=[], colorscale='Viridis', showscale=True, colorbar=dict(title="Health %"))
+        ))
+        fig_range.update_layout(title="Maximum Range vs Odometer", xaxis_title="Odometer (miles)",
+                                yaxis_title="Maximum Range (miles)")
+        figures.append(_figure_spec("fig-range", fig_range, [
+            {"trace": 0, "attr": "x", "column": "odometer"},
+            {"trace": 0, "attr": "y", "column": "max_range"},
+            {"trace": 0, "attr": "hovertext", "column": "name"},
+            {"trace": 0, "attr": "marker.color", "column": "health_percent"},
+        ]))
+
+        fig_models = go.Figure(go.Table(
+            header=dict(values=['Vehicle', 'Model', 'Performance', 'Odometer', 'Health', 'Max Range', 'Capacity'],
+                        fill_color='paleturquoise', align='left'),
+            cells=dict(values=[[]] * 7, format=[None, None, None, ",.0f", ".1f", ".0f", ".1f"],
+                       suffix=[None, None, None, None, "%", None, None],
+                       fill_color='lavender', align='left')
+        ))
+        fig_models.update_layout(title="Vehicle Comparison")
+        table_columns = ("name", "model_type", "performance_package", "odometer", "health_percent",
+                         "max_range", "capacity")
+        figures.append(_figure_spec("fig-models", fig_models, [
+            {"trace": 0, "attr": f"cells.values.{position}", "column": column, "array": True}
+            for position, column in enumerate(table_columns)
+        ]))
+        return figures
+
+    def scalable_page(self, plotlyjs: str, events_url: str = None) -> List[str]:
+        """HTML parts of the scalable dashboard, loading plotly.js via the ``plotlyjs`` markup.
+
+        With ``events_url`` the page subscribes to that server-sent event
+        stream and applies "update" deltas with Plotly.restyle.
+        """
+        view = self._latest_view()
+        # "</" is escaped so vehicle names cannot close the script elements early.
+        blob = json.dumps(self._data_blob(view, events_url), separators=(",", ":")).replace("</", "<\\/")
+        figures = json.dumps(self._scalable_figures(view), separators=(",", ":")).replace("</", "<\\/")
+        return [
+            DASHBOARD_HEAD,
+            '<div class="plot" id="fig-battery"></div><div class="plot" id="fig-map"></div>'
+            '<div class="plot" id="fig-energy"></div>'
+            '<div class="section-title"><h2>Battery Health Analysis</h2></div>'
+            '<div class="plot" id="fig-health"></div><div class="plot" id="fig-capacity"></div>'
+            '<div class="plot" id="fig-range"></div><div class="wide-plot" id="fig-models"></div>',
+            '</div>',
+            plotlyjs,
+            f'<script type="application/json" id="fleet-data">{blob}</script>',
+            f'<script type="application/json" id="fleet-figures">{figures}</script>',
+            f'<script type="text/javascript">{SCALABLE_SCRIPT}</script>',
+            '<footer>Created by Group 7 - CIS3120</footer></body></html>',
+        ]
+
+    def create_scalable_dashboard(self, output_file: str = "dashboard.html", offline: bool = True,
+                                  compress: Optional[bool] = None):
+        """Create the dashboard for large fleets.
+
+        Every chart is a single vectorized trace per series (WebGL for the
+        range scatter, a density layer under the map markers), the data is
+        written once as a shared base64 typed-array blob that all figures
+        bind to in the browser, and plotly.js is inlined once (or loaded
+        from the CDN when ``offline`` is False).
+        """
+        started = time.perf_counter()
+        if offline:
+            plotlyjs = f'<script type="text/javascript">{get_plotlyjs()}</script>'
+        else:
+            plotlyjs = f'<script src="https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js"></script>'
+        parts = self.scalable_page(plotlyjs)
+        serialized = time.perf_counter()
+        with open_output(output_file, compress) as f:
+            for part in parts:
+                f.write(part)
+        self.timings = {
+            "serialize": {"seconds": serialized - started, "bytes": sum(map(len, parts))},
+            "total": {"seconds": time.perf_counter() - started, "workers": 1},
+        }
+        self._record_timings("scalable")
+
+    def _record_timings(self, mode: str):
+        """Feed self.timings into the render histograms and output-size counters."""
+        if not metrics.enabled:
+            return
+        for part, timing in self.timings.items():
+            for stage in ("build", "serialize", "seconds"):
+                if stage in timing:
+                    metrics.observe("render_seconds", timing[stage], mode=mode, part=part,
+                                    stage="total" if stage == "seconds" else stage)
+            if "bytes" in timing:
+                metrics.count("render_bytes", timing["bytes"], mode=mode, part=part)